@@ -21,17 +21,26 @@
  ***************************************************************************/
 """
 import os.path
-from qgis.core import QGis, QgsVectorLayer, QgsMapLayerRegistry
+from qgis.core import QGis, QgsMapLayer, QgsMapLayerRegistry, QgsVectorLayer
+from qgis.gui import QgsMessageBar
 from PyQt4 import QtCore, QtGui
 # Initialize Qt resources from file resources.py
 from .ui import resources_rc
 # Import the code for the dialog
 from .widgets.SpreadsheetLayersDialog import SpreadsheetLayersDialog
+from .util.materialize import isMaterializationOutdated
+from .util.ogr_worker import nextRequestId, stopSharedWorker
+from .util.source_watcher import SourceWatcher
+from .util.vrt_config import VrtConfigError, readVrtConfig
 
 
 class SpreadsheetLayersPlugin(QtCore.QObject):
     """QGIS Plugin Implementation."""
 
+    vrtPathProperty = SpreadsheetLayersDialog.pluginKey + '/vrtPath'
+
+    materializeRequested = QtCore.pyqtSignal(int, object, object)
+
     def __init__(self, iface):
         """Constructor.
 
@@ -45,6 +54,12 @@ class SpreadsheetLayersPlugin(QtCore.QObject):
         self.iface = iface
         # initialize plugin directory
         self.plugin_dir = os.path.dirname(__file__)
+        # Shared worker materializing layers, connected while converting
+        self.worker = None
+        # (layerId, vrtPath, outPath) of layers waiting for conversion
+        self.materializeQueue = []
+        self.materializing = None
+        self.materializeRequestId = 0
         # initialize locale
         locale = QtCore.QSettings().value('locale/userLocale')[0:2]
         locale_path = os.path.join(
@@ -75,7 +90,39 @@ class SpreadsheetLayersPlugin(QtCore.QObject):
             self.iface.layerMenu().insertAction(action, self.action)
         self.iface.layerToolBar().addAction(self.action)
 
+        QgsMapLayerRegistry.instance().layersAdded.connect(
+            self.refreshMaterializedLayers)
+
+        self.watcher = None
+        settings = QtCore.QSettings()
+        pluginKey = SpreadsheetLayersDialog.pluginKey
+        if settings.value(pluginKey + '/watchSources', True, type=bool):
+            self.watcher = SourceWatcher(
+                settings.value(pluginKey + '/typeInferenceRowCount',
+                               10000, type=int),
+                self)
+            self.watcher.layersRefreshed.connect(self.onLayersRefreshed)
+            QgsMapLayerRegistry.instance().layersAdded.connect(
+                self.watchLayers)
+            QgsMapLayerRegistry.instance().layersWillBeRemoved.connect(
+                self.unwatchLayers)
+            self.watchLayers(QgsMapLayerRegistry.instance().mapLayers()
+                             .values())
+
     def unload(self):
+        QgsMapLayerRegistry.instance().layersAdded.disconnect(
+            self.refreshMaterializedLayers)
+        self.materializeQueue = []
+        self.materializeNext()
+        if getattr(self, 'watcher', None) is not None:
+            QgsMapLayerRegistry.instance().layersAdded.disconnect(
+                self.watchLayers)
+            QgsMapLayerRegistry.instance().layersWillBeRemoved.disconnect(
+                self.unwatchLayers)
+            self.watcher.stop()
+            self.watcher = None
+        stopSharedWorker()
+
         if hasattr(self, 'action'):
             if QGis.QGIS_VERSION_INT > 20400:
                 self.iface.addLayerMenu().removeAction(self.action)
@@ -86,11 +133,156 @@ class SpreadsheetLayersPlugin(QtCore.QObject):
     def showDialog(self):
         dlg = SpreadsheetLayersDialog(self.iface.mainWindow())
         dlg.show()
-        if dlg.exec_():
-            layer = QgsVectorLayer(dlg.vrtPath(), dlg.layerName(), 'ogr')
-            layer.setProviderEncoding('UTF-8')
-            if not layer.isValid():
-                print "Layer failed to load"
-            else:
-                QgsMapLayerRegistry.instance().addMapLayer(layer)
+        accepted = dlg.exec_()
+        if self.materializing is not None:
+            # Dialog requests cancelled the running conversion
+            self.requestMaterialization()
+        if accepted:
+            layers = []
+            for uri, layerName, vrtPath, encoding in dlg.layerSources():
+                layer = QgsVectorLayer(uri, layerName, 'ogr')
+                layer.setProviderEncoding(encoding)
+                if vrtPath is not None:
+                    layer.setCustomProperty(self.vrtPathProperty, vrtPath)
+                if not layer.isValid():
+                    print "Layer failed to load"
+                else:
+                    layers.append(layer)
+            # Add all layers at once, layer tree and canvas update only once
+            QgsMapLayerRegistry.instance().addMapLayers(layers)
+            for msg in dlg.bulkErrors():
+                self.iface.messageBar().pushMessage(
+                    self.tr("Spreadsheet layers"), msg,
+                    QgsMessageBar.WARNING, 5)
         dlg.deleteLater()
+
+    def refreshMaterializedLayers(self, layers):
+        """Rebuild materialized layers whose spreadsheet has changed.
+
+        Layers are converted one at a time by the worker shared with the
+        dialogs, and reloaded once their file is written.
+        """
+        for layer in layers:
+            vrtPath = layer.customProperty(self.vrtPathProperty)
+            if not vrtPath:
+                continue
+            outPath = layer.source().split('|')[0]
+            if not isMaterializationOutdated(vrtPath, outPath):
+                continue
+            self.materializeQueue.append((layer.id(), vrtPath, outPath))
+        if self.materializing is None:
+            self.materializeNext()
+
+    def workerConnections(self):
+        return [
+            (self.materializeRequested, self.worker.materialize),
+            (self.worker.materialized, self.onMaterialized),
+            (self.worker.failed, self.onMaterializeFailed)]
+
+    def materializeNext(self):
+        """Convert next queued layer, release the worker when done."""
+        if self.materializeQueue:
+            self.materializing = self.materializeQueue.pop(0)
+            self.requestMaterialization()
+            return
+        self.materializing = None
+        if self.worker is not None:
+            for signal, slot in self.workerConnections():
+                signal.disconnect(slot)
+            self.worker = None
+
+    def requestMaterialization(self):
+        if self.worker is None:
+            self.worker = SpreadsheetLayersDialog.openSharedWorker()
+            for signal, slot in self.workerConnections():
+                signal.connect(slot)
+        self.materializeRequestId = nextRequestId()
+        self.worker.currentRequestId = self.materializeRequestId
+        layerId, vrtPath, outPath = self.materializing
+        self.materializeRequested.emit(self.materializeRequestId,
+                                       vrtPath,
+                                       outPath)
+
+    @QtCore.pyqtSlot(int, object)
+    def onMaterialized(self, requestId, outPath):
+        if requestId != self.materializeRequestId:
+            return
+        layer = QgsMapLayerRegistry.instance().mapLayer(self.materializing[0])
+        if layer is not None:
+            provider = layer.dataProvider()
+            if hasattr(provider, 'reloadData'):
+                provider.reloadData()
+            layer.triggerRepaint()
+        self.materializeNext()
+
+    @QtCore.pyqtSlot(int, object)
+    def onMaterializeFailed(self, requestId, msg):
+        if requestId != self.materializeRequestId:
+            return
+        self.iface.messageBar().pushMessage(
+            self.tr("Spreadsheet layers"), msg,
+            QgsMessageBar.WARNING, 5)
+        self.materializeNext()
+
+    def layerVrtPaths(self, layer):
+        """Return (vrtPath, outPath) of a spreadsheet layer, or None.
+
+        outPath is the converted file the layer is loaded from, None for
+        layers loaded from their VRT file, which must have been written by
+        the plugin with its options.
+        """
+        if (layer.type() != QgsMapLayer.VectorLayer
+            or layer.providerType() != 'ogr'
+        ):
+            return None
+        source = layer.source().split('|')[0]
+        vrtPath = layer.customProperty(self.vrtPathProperty)
+        if vrtPath:
+            return vrtPath, source
+        if not source.lower().endswith('.vrt'):
+            return None
+        try:
+            spec = readVrtConfig(source)
+        except (VrtConfigError, OSError):
+            return None
+        if spec.fields is None:
+            return None
+        return source, None
+
+    def watchLayers(self, layers):
+        """Watch source files of spreadsheet layers."""
+        for layer in layers:
+            paths = self.layerVrtPaths(layer)
+            if paths is not None:
+                self.watcher.watch(layer.id(), *paths)
+
+    def unwatchLayers(self, layerIds):
+        for layerId in layerIds:
+            self.watcher.unwatch(layerId)
+
+    def onLayersRefreshed(self, results):
+        """Reload layers whose source changed, then repaint once."""
+        registry = QgsMapLayerRegistry.instance()
+        for result in results:
+            if result['error'] is not None:
+                self.iface.messageBar().pushMessage(
+                    self.tr("Spreadsheet layers"),
+                    u'{}: {}'.format(result['vrtPath'], result['error']),
+                    QgsMessageBar.WARNING, 5)
+                continue
+            if result['mismatches']:
+                self.iface.messageBar().pushMessage(
+                    self.tr("Spreadsheet layers"),
+                    self.tr(u"{}: values of {} no longer fit their type")
+                        .format(result['vrtPath'],
+                                u', '.join(result['mismatches'])),
+                    QgsMessageBar.WARNING, 5)
+            for layerId in result['layerIds']:
+                layer = registry.mapLayer(layerId)
+                if layer is None:
+                    continue
+                provider = layer.dataProvider()
+                if hasattr(provider, 'reloadData'):
+                    provider.reloadData()
+                layer.updateExtents()
+        self.iface.mapCanvas().refresh()
@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+'''Generate synthetic spreadsheet files for benchmarks.
+
+Files are written without GDAL, which can't write spreadsheets, and
+without any dependency except xlwt for XLS files.
+A sheet is made of headerOffset title lines, one header line, data rows
+and trailingEmptyRows formatted but empty rows, like spreadsheets edited by
+hand often have. Data columns cycle through integer, real, string and date
+values, sparsity being the probability of an empty cell.
+'''
+
+import csv
+import random
+import zipfile
+import datetime
+from xml.sax.saxutils import escape
+
+
+FORMATS = ['xlsx', 'ods', 'xls', 'csv']
+
+COLUMN_KINDS = ['integer', 'real', 'string', 'date']
+
+EPOCH = datetime.date(1899, 12, 30)
+
+
+class FixtureShape(object):
+    '''FixtureShape describes the content of a generated sheet.'''
+
+    def __init__(self, rows=10000, columns=10, sparsity=0.0,
+                 trailingEmptyRows=0, headerOffset=0, seed=0):
+        self.rows = rows
+        self.columns = columns
+        self.sparsity = sparsity
+        self.trailingEmptyRows = trailingEmptyRows
+        self.headerOffset = headerOffset
+        self.seed = seed
+
+    def asDict(self):
+        return {'rows': self.rows,
+                'columns': self.columns,
+                'sparsity': self.sparsity,
+                'trailingEmptyRows': self.trailingEmptyRows,
+                'headerOffset': self.headerOffset,
+                'seed': self.seed}
+
+    def kind(self, column):
+        return COLUMN_KINDS[column % len(COLUMN_KINDS)]
+
+    def headers(self):
+        return [u'{}{}'.format(self.kind(column), column + 1)
+                for column in xrange(0, self.columns)]
+
+    def lines(self):
+        '''Yield lines of the sheet as lists of values, None when empty.'''
+        for i in xrange(0, self.headerOffset):
+            yield [u'Title line {}'.format(i + 1)] + [None] * (self.columns - 1)
+        yield self.headers()
+
+        rand = random.Random(self.seed)
+        for row in xrange(0, self.rows):
+            values = []
+            for column in xrange(0, self.columns):
+                if self.sparsity and rand.random() < self.sparsity:
+                    values.append(None)
+                    continue
+                kind = self.kind(column)
+                if kind == 'integer':
+                    values.append(rand.randint(-100000, 100000))
+                elif kind == 'real':
+                    values.append(round(rand.uniform(-1000, 1000), 4))
+                elif kind == 'string':
+                    values.append(u'value {}'.format(rand.randint(0, 1000)))
+                else:
+                    values.append(datetime.date(2000, 1, 1) +
+                                  datetime.timedelta(rand.randint(0, 9000)))
+            yield values
+
+        for row in xrange(0, self.trailingEmptyRows):
+            yield [None] * self.columns
+
+
+def columnName(column):
+    name = ''
+    column += 1
+    while column > 0:
+        column, remainder = divmod(column - 1, 26)
+        name = chr(ord('A') + remainder) + name
+    return name
+
+
+XLSX_FILES = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+        '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+        ' xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Data" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>'
+        '<Relationship Id="rId3" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+        '</Relationships>',
+    # Style 1 is a date, style 2 a formatted empty cell
+    'xl/styles.xml':
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+        '<fonts count="1"><font/></fonts>'
+        '<fills count="1"><fill/></fills>'
+        '<borders count="1"><border/></borders>'
+        '<cellXfs count="3"><xf numFmtId="0"/><xf numFmtId="14" applyNumberFormat="1"/>'
+        '<xf numFmtId="0" fontId="0" fillId="0"/></cellXfs>'
+        '</styleSheet>',
+}
+
+
+def writeXlsx(path, shape):
+    strings = {}
+    rows = []
+    lineCount = 0
+    for line, values in enumerate(shape.lines()):
+        lineCount += 1
+        cells = []
+        for column, value in enumerate(values):
+            ref = '{}{}'.format(columnName(column), line + 1)
+            if value is None:
+                if line >= shape.headerOffset + 1 + shape.rows:
+                    cells.append('<c r="{}" s="2"/>'.format(ref))
+                continue
+            if isinstance(value, unicode):
+                index = strings.setdefault(value, len(strings))
+                cells.append('<c r="{}" t="s"><v>{}</v></c>'.format(ref, index))
+            elif isinstance(value, datetime.date):
+                cells.append('<c r="{}" s="1"><v>{}</v></c>'.format(
+                    ref, (value - EPOCH).days))
+            else:
+                cells.append('<c r="{}"><v>{!r}</v></c>'.format(ref, value))
+        rows.append('<row r="{}">{}</row>'.format(line + 1, ''.join(cells)))
+
+    sheet = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+             '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+             '<dimension ref="A1:{}{}"/><sheetData>{}</sheetData></worksheet>'
+             ).format(columnName(shape.columns - 1), lineCount, ''.join(rows))
+    sharedStrings = sorted(strings, key=strings.get)
+    sst = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"'
+           ' count="{0}" uniqueCount="{0}">{1}</sst>'
+           ).format(len(sharedStrings),
+                    u''.join(u'<si><t>{}</t></si>'.format(escape(s))
+                             for s in sharedStrings).encode('UTF-8'))
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, content in sorted(XLSX_FILES.items()):
+            z.writestr(name, content)
+        z.writestr('xl/sharedStrings.xml', sst)
+        z.writestr('xl/worksheets/sheet1.xml', sheet)
+
+
+ODS_MANIFEST = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0">'
+    '<manifest:file-entry manifest:media-type="application/vnd.oasis.opendocument.spreadsheet" manifest:full-path="/"/>'
+    '<manifest:file-entry manifest:media-type="text/xml" manifest:full-path="content.xml"/>'
+    '</manifest:manifest>')
+
+
+def writeOds(path, shape):
+    rows = []
+    for line, values in enumerate(shape.lines()):
+        cells = []
+        for value in values:
+            if value is None:
+                cells.append(u'<table:table-cell/>')
+            elif isinstance(value, unicode):
+                cells.append(u'<table:table-cell office:value-type="string">'
+                             u'<text:p>{}</text:p></table:table-cell>'
+                             .format(escape(value)))
+            elif isinstance(value, datetime.date):
+                cells.append(u'<table:table-cell office:value-type="date"'
+                             u' office:date-value="{}"/>'.format(value.isoformat()))
+            else:
+                cells.append(u'<table:table-cell office:value-type="float"'
+                             u' office:value="{!r}"/>'.format(value))
+        rows.append(u'<table:table-row>{}</table:table-row>'.format(u''.join(cells)))
+
+    content = (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+               u'<office:document-content'
+               u' xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"'
+               u' xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"'
+               u' xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0"'
+               u' office:version="1.2">'
+               u'<office:body><office:spreadsheet>'
+               u'<table:table table:name="Data">{}</table:table>'
+               u'</office:spreadsheet></office:body></office:document-content>'
+               ).format(u''.join(rows))
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        # mimetype must be the first, uncompressed, entry
+        z.writestr(zipfile.ZipInfo('mimetype'),
+                   'application/vnd.oasis.opendocument.spreadsheet')
+        z.writestr('META-INF/manifest.xml', ODS_MANIFEST)
+        z.writestr('content.xml', content.encode('UTF-8'))
+
+
+def writeXls(path, shape):
+    '''Write an XLS file with xlwt, raising ImportError without it.'''
+    import xlwt
+    if shape.headerOffset + 1 + shape.rows + shape.trailingEmptyRows > 65536:
+        raise ValueError('XLS sheets are limited to 65536 lines')
+    book = xlwt.Workbook(encoding='UTF-8')
+    sheet = book.add_sheet('Data')
+    dateStyle = xlwt.easyxf(num_format_str='YYYY-MM-DD')
+    blankStyle = xlwt.easyxf('pattern: pattern solid;')
+    for line, values in enumerate(shape.lines()):
+        for column, value in enumerate(values):
+            if value is None:
+                if line >= shape.headerOffset + 1 + shape.rows:
+                    sheet.write(line, column, None, blankStyle)
+            elif isinstance(value, datetime.date):
+                sheet.write(line, column, value, dateStyle)
+            else:
+                sheet.write(line, column, value)
+    book.save(path)
+
+
+def csvValue(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, unicode):
+        return value.encode('UTF-8')
+    return repr(value)
+
+
+def writeCsv(path, shape):
+    with open(path, 'wb') as f:
+        writer = csv.writer(f)
+        for values in shape.lines():
+            writer.writerow([csvValue(value) for value in values])
+
+
+WRITERS = {'xlsx': writeXlsx,
+           'ods': writeOds,
+           'xls': writeXls,
+           'csv': writeCsv}
+
+
+def writeFixture(path, fileFormat, shape):
+    '''Write a fixture file of shape in fileFormat, see FORMATS.'''
+    WRITERS[fileFormat](path, shape)
+    return path
@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+'''Time hot paths of the plugin on generated spreadsheet files.
+
+Usage: python -m SpreadsheetLayers.benchmarks.run [options]
+
+A fixture of the given shape is generated in each format, then every stage
+is run --repeat times on it. Stages are the operations the dialog runs on
+the worker thread, without Qt:
+
+- open: opening of the file with the open options of the plugin, CSV
+  options being sniffed beforehand;
+- setLayer: OgrSample read of the sample rows, as OgrTableModel.setLayer;
+- countNonEmptyRows: end of file detection;
+- updateFields: field names and type inference from data rows;
+- prepareVrt: VRT content of the layer;
+- vrtFirstFeature: open the written VRT file and read its first feature;
+- vrtFullScan: open the written VRT file and read all its features.
+
+Results are written as JSON, with GDAL and Python versions, so runs on
+different GDAL versions can be compared, see --baseline.
+'''
+
+import os
+import sys
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import datetime
+import timeit
+from collections import OrderedDict
+from osgeo import gdal, ogr
+
+from SpreadsheetLayers.benchmarks.fixtures import (FORMATS,
+                                                   FixtureShape,
+                                                   writeFixture)
+from SpreadsheetLayers.util.csv_util import isCsv, sniffCsv
+from SpreadsheetLayers.util.gdal_util import (dataSourceDriverName,
+                                              openOptionsSupported)
+from SpreadsheetLayers.util.ogr_util import (OgrSample,
+                                             countNonEmptyRows,
+                                             readFields)
+from SpreadsheetLayers.util.spreadsheet_layer import (SpreadsheetLayerBuilder,
+                                                      SpreadsheetLayerSpec)
+from SpreadsheetLayers.util.type_inference import inferFieldTypes
+
+
+def timeStage(function, repeat):
+    '''Run function repeat times, return timings in seconds and result.'''
+    runs = []
+    result = None
+    for i in xrange(0, repeat):
+        start = timeit.default_timer()
+        result = function()
+        runs.append(timeit.default_timer() - start)
+    ordered = sorted(runs)
+    return OrderedDict([('min', ordered[0]),
+                        ('median', ordered[len(ordered) // 2]),
+                        ('runs', runs)]), result
+
+
+def readVrt(vrtPath, maxFeatures=None):
+    '''Read features of a VRT file, return the number of features read.'''
+    dataSource = ogr.Open(vrtPath, 0)
+    if dataSource is None:
+        raise IOError(u'Could not open {}'.format(vrtPath))
+    layer = dataSource.GetLayer(0)
+    count = 0
+    feature = layer.GetNextFeature()
+    while feature is not None:
+        count += 1
+        if maxFeatures is not None and count >= maxFeatures:
+            break
+        feature = layer.GetNextFeature()
+    return count
+
+
+def benchmarkFile(filePath, shape, repeat, sampleRowCount, inferenceRows):
+    '''Return timings of every stage on a fixture file.'''
+    stages = OrderedDict()
+    # Fixture header line comes after ignored title lines
+    spec = SpreadsheetLayerSpec(filePath,
+                                header=True,
+                                linesToIgnore=shape.headerOffset,
+                                eofDetection=True)
+    if isCsv(filePath) and openOptionsSupported():
+        spec.csvOptions = sniffCsv(filePath)
+
+    # Files are opened as the plugin does, header line being read as data
+    stages['open'], dataSource = timeStage(spec.open, repeat)
+    if dataSource is None:
+        raise IOError(u'Could not open {}'.format(filePath))
+    layer = dataSource.GetLayer(0)
+    spec.sheet = layer.GetName().decode('UTF-8')
+
+    stages['setLayer'], sample = timeStage(
+        lambda: OgrSample(layer, sampleRowCount, encoding=spec.encoding()),
+        repeat)
+
+    stages['countNonEmptyRows'], nonEmptyRows = timeStage(
+        lambda: countNonEmptyRows(layer,
+                                  driverName=dataSourceDriverName(dataSource)),
+        repeat)
+
+    def updateFields():
+        fields = readFields(layer, spec.offset(), spec.header,
+                            spec.encoding())
+        types = inferFieldTypes(layer, spec.offset(), inferenceRows or None,
+                                encoding=spec.encoding())
+        for field, fieldType in zip(fields, types):
+            field['type'] = fieldType
+        return fields
+    stages['updateFields'], spec.fields = timeStage(updateFields, repeat)
+
+    builder = SpreadsheetLayerBuilder(spec,
+                                      layer.GetFeatureCount(),
+                                      nonEmptyRows)
+    stages['prepareVrt'], content = timeStage(builder.vrt, repeat)
+
+    vrtPath = builder.write()
+    stages['vrtFirstFeature'], first = timeStage(
+        lambda: readVrt(vrtPath, 1), repeat)
+    stages['vrtFullScan'], featuresRead = timeStage(
+        lambda: readVrt(vrtPath), repeat)
+
+    return OrderedDict([('fileSize', os.path.getsize(filePath)),
+                        ('featureCount', layer.GetFeatureCount()),
+                        ('nonEmptyRows', nonEmptyRows),
+                        ('featuresRead', featuresRead),
+                        ('stages', stages)])
+
+
+def compare(results, baseline, out):
+    '''Write median ratios of results over baseline results to out.'''
+    previous = dict((result['format'], result)
+                    for result in baseline.get('results', []))
+    out.write('Median time ratio, GDAL {} over GDAL {}:\n'.format(
+        results['gdal'], baseline.get('gdal')))
+    for result in results['results']:
+        old = previous.get(result['format'])
+        if 'stages' not in result or old is None or 'stages' not in old:
+            continue
+        for stage, timings in result['stages'].iteritems():
+            if stage not in old['stages'] or not old['stages'][stage]['median']:
+                continue
+            out.write('  {:<5} {:<18} {:6.2f}\n'.format(
+                result['format'], stage,
+                timings['median'] / old['stages'][stage]['median']))
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m SpreadsheetLayers.benchmarks.run',
+        description='Time hot paths of the plugin on generated files.')
+    parser.add_argument('--formats', default=','.join(FORMATS),
+                        help='comma separated formats to generate, among {}'
+                             .format(', '.join(FORMATS)))
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='number of data rows (default: 10000)')
+    parser.add_argument('--columns', type=int, default=10,
+                        help='number of columns (default: 10)')
+    parser.add_argument('--sparsity', type=float, default=0.0,
+                        help='probability of an empty cell (default: 0)')
+    parser.add_argument('--trailing-empty-rows', type=int, default=0,
+                        help='number of formatted empty rows after data'
+                             ' (default: 0)')
+    parser.add_argument('--header-offset', type=int, default=0,
+                        help='number of title lines before header line'
+                             ' (default: 0)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random generator seed (default: 0)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs of each stage (default: 3)')
+    parser.add_argument('--sample-rows', type=int, default=20,
+                        help='number of sample rows (default: 20)')
+    parser.add_argument('--type-inference-rows', type=int, default=10000,
+                        help='number of rows used to infer types, 0 for all'
+                             ' (default: 10000)')
+    parser.add_argument('--keep', metavar='DIRECTORY',
+                        help='write fixtures in DIRECTORY and keep them')
+    parser.add_argument('-o', '--output', metavar='JSON',
+                        help='write results to JSON file instead of stdout')
+    parser.add_argument('--baseline', metavar='JSON',
+                        help='compare results with a previous JSON file')
+    args = parser.parse_args(argv)
+    args.formats = [f.strip().lower() for f in args.formats.split(',')]
+    for fileFormat in args.formats:
+        if fileFormat not in FORMATS:
+            parser.error('unknown format {}'.format(fileFormat))
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    return args
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+    shape = FixtureShape(rows=args.rows,
+                         columns=args.columns,
+                         sparsity=args.sparsity,
+                         trailingEmptyRows=args.trailing_empty_rows,
+                         headerOffset=args.header_offset,
+                         seed=args.seed)
+
+    # Header lines are handled by the plugin, not by drivers
+    for driver in ('ODS', 'XLS', 'XLSX'):
+        gdal.SetConfigOption('OGR_{}_HEADERS'.format(driver), 'DISABLE')
+
+    directory = args.keep or tempfile.mkdtemp(prefix='spreadsheet-bench-')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    results = OrderedDict([
+        ('date', datetime.datetime.utcnow().isoformat()),
+        ('gdal', gdal.__version__),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('repeat', args.repeat),
+        ('sampleRows', args.sample_rows),
+        ('typeInferenceRows', args.type_inference_rows),
+        ('shape', shape.asDict()),
+        ('results', [])])
+    try:
+        for fileFormat in args.formats:
+            result = OrderedDict([('format', fileFormat)])
+            filePath = os.path.join(directory, u'bench.{}'.format(fileFormat))
+            try:
+                writeFixture(filePath, fileFormat, shape)
+            except (ImportError, ValueError) as e:
+                result['skipped'] = unicode(e)
+                results['results'].append(result)
+                continue
+            try:
+                result.update(benchmarkFile(filePath,
+                                            shape,
+                                            args.repeat,
+                                            args.sample_rows,
+                                            args.type_inference_rows))
+            except (IOError, ValueError) as e:
+                result['error'] = unicode(e)
+            results['results'].append(result)
+    finally:
+        if not args.keep:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    content = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(content + '\n')
+    else:
+        sys.stdout.write(content + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f), sys.stderr)
+
+    return 1 if any('error' in result for result in results['results']) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
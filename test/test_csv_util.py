@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+
+import codecs
+
+from SpreadsheetLayers.test.utilities import TemporaryDirectoryTestCase
+from SpreadsheetLayers.util.csv_util import csvOpenOptions, isCsv, sniffCsv
+
+
+class CsvUtilTest(TemporaryDirectoryTestCase):
+
+    def test_isCsv(self):
+        self.assertTrue(isCsv(u'/data/file.CSV'))
+        self.assertTrue(isCsv(u'/data/file.tsv'))
+        self.assertFalse(isCsv(u'/data/file.xlsx'))
+
+    def test_sniffComma(self):
+        path = self.writeFile('test.csv',
+                              'name,x,y\n'
+                              'a,1.5,2\n'
+                              'b,3.5,4\n')
+        self.assertEqual(sniffCsv(path), {'separator': 'COMMA',
+                                          'encoding': 'UTF-8',
+                                          'header': True})
+
+    def test_sniffSemicolon(self):
+        path = self.writeFile('test.csv',
+                              'name;x;y\n'
+                              'a;1,5;2\n'
+                              'b;3,5;4\n')
+        self.assertEqual(sniffCsv(path)['separator'], 'SEMICOLON')
+
+    def test_sniffTab(self):
+        path = self.writeFile('test.tsv',
+                              'name\tx\n'
+                              'a\t1\n'
+                              'b\t2\n')
+        self.assertEqual(sniffCsv(path)['separator'], 'TAB')
+
+    def test_sniffNoHeader(self):
+        path = self.writeFile('test.csv',
+                              '1,2\n'
+                              '3,4\n'
+                              '5,6\n')
+        self.assertFalse(sniffCsv(path)['header'])
+
+    def test_sniffUtf8(self):
+        content = u'préfecture;département\nRennes;35\nBrest;29\n'
+        path = self.writeFile('test.csv', content.encode('UTF-8'))
+        self.assertEqual(sniffCsv(path)['encoding'], 'UTF-8')
+
+    def test_sniffUtf8Bom(self):
+        content = u'préfecture,code\nRennes,35\nBrest,29\n'
+        path = self.writeFile('test.csv',
+                              codecs.BOM_UTF8 + content.encode('UTF-8'))
+        options = sniffCsv(path)
+        self.assertEqual(options['encoding'], 'UTF-8')
+        self.assertEqual(options['separator'], 'COMMA')
+
+    def test_sniffCp1252Headers(self):
+        content = u'préfecture;département;état\nRennes;35;1\nBrest;29;2\n'
+        path = self.writeFile('test.csv', content.encode('CP1252'))
+        options = sniffCsv(path)
+        self.assertEqual(options['encoding'], 'CP1252')
+        self.assertEqual(options['separator'], 'SEMICOLON')
+        self.assertTrue(options['header'])
+
+    def test_sniffCutCharacter(self):
+        # A multibyte character cut at the end of the prefix is still UTF-8
+        content = u'name,value\n' + u'a,é\n' * 10
+        path = self.writeFile('test.csv', content.encode('UTF-8'))
+        self.assertEqual(sniffCsv(path, maxBytes=16)['encoding'], 'UTF-8')
+
+    def test_csvOpenOptions(self):
+        options = {'separator': 'SEMICOLON'}
+        self.assertEqual(csvOpenOptions(options),
+                         ['SEPARATOR=SEMICOLON', 'HEADERS=NO'])
+        self.assertEqual(csvOpenOptions(options, header=True),
+                         ['SEPARATOR=SEMICOLON', 'HEADERS=YES'])
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import os
+
+from SpreadsheetLayers.test.utilities import TemporaryDirectoryTestCase
+from SpreadsheetLayers.util import datasource_pool
+from SpreadsheetLayers.util.datasource_pool import DataSourcePool
+
+
+class FakeDataSource(object):
+
+    def __init__(self, path, openOptions):
+        self.path = path
+        self.openOptions = openOptions
+
+
+class DataSourcePoolTest(TemporaryDirectoryTestCase):
+    '''Eviction tests, with datasources opened without GDAL.'''
+
+    def setUp(self):
+        super(DataSourcePoolTest, self).setUp()
+        self.opened = []
+        self.openDataSource = datasource_pool.openDataSource
+        datasource_pool.openDataSource = self.fakeOpenDataSource
+        # Estimated memory is the file size
+        self.pool = DataSourcePool(maxMemory=250)
+        self.pool.expansionFactor = 1
+
+    def tearDown(self):
+        datasource_pool.openDataSource = self.openDataSource
+        super(DataSourcePoolTest, self).tearDown()
+
+    def fakeOpenDataSource(self, path, openOptions=None, shared=False):
+        self.assertTrue(shared)
+        if not os.path.exists(path):
+            return None
+        dataSource = FakeDataSource(path, openOptions)
+        self.opened.append(dataSource)
+        return dataSource
+
+    def file(self, name, size=100):
+        return self.writeFile(name, 'x' * size)
+
+    def test_reuse(self):
+        path = self.file('a.csv')
+        dataSource = self.pool.acquire(path)
+        self.pool.release(dataSource)
+        self.assertIs(self.pool.acquire(path), dataSource)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_openOptions(self):
+        path = self.file('a.csv')
+        noHeader = self.pool.acquire(path, ['HEADERS=NO'])
+        header = self.pool.acquire(path, ['HEADERS=YES'])
+        self.assertIsNot(noHeader, header)
+        self.assertIs(self.pool.acquire(path, ['HEADERS=NO']), noHeader)
+
+    def test_openFailure(self):
+        path = self.file('a.csv')
+        datasource_pool.openDataSource = lambda *args, **kwargs: None
+        self.assertIs(self.pool.acquire(path), None)
+        self.assertEqual(len(self.pool), 0)
+
+    def test_leastRecentlyUsedEvicted(self):
+        paths = [self.file(name) for name in ('a.csv', 'b.csv', 'c.csv')]
+        dataSources = [self.pool.acquire(path) for path in paths[:2]]
+        for dataSource in dataSources:
+            self.pool.release(dataSource)
+        # a is used again, b is now the least recently used
+        self.pool.release(self.pool.acquire(paths[0]))
+        self.pool.release(self.pool.acquire(paths[2]))
+        self.assertEqual(len(self.pool), 2)
+        self.assertIs(self.pool.acquire(paths[0]), dataSources[0])
+        self.assertIsNot(self.pool.acquire(paths[1]), dataSources[1])
+
+    def test_referencedNotEvicted(self):
+        paths = [self.file(name) for name in ('a.csv', 'b.csv', 'c.csv')]
+        dataSources = [self.pool.acquire(path) for path in paths]
+        self.assertEqual(len(self.pool), 3)
+        for dataSource in dataSources:
+            self.pool.release(dataSource)
+        self.assertEqual(len(self.pool), 2)
+
+    def test_changedFile(self):
+        path = self.file('a.csv')
+        dataSource = self.pool.acquire(path)
+        self.pool.release(dataSource)
+        st = os.stat(path)
+        os.utime(path, (st.st_atime, st.st_mtime + 10))
+        self.assertIsNot(self.pool.acquire(path), dataSource)
+        self.assertEqual(len(self.pool), 1)
+
+    def test_clear(self):
+        path = self.file('a.csv')
+        self.pool.acquire(path)
+        self.pool.release(self.pool.acquire(self.file('b.csv')))
+        self.pool.clear()
+        self.assertEqual(len(self.pool), 1)
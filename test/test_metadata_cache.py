@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sqlite3
+
+from SpreadsheetLayers.test.utilities import TemporaryDirectoryTestCase
+from SpreadsheetLayers.util.metadata_cache import (SCHEMA_VERSION,
+                                                   MetadataCache)
+
+
+class MetadataCacheTest(TemporaryDirectoryTestCase):
+
+    def setUp(self):
+        super(MetadataCacheTest, self).setUp()
+        self.cachePath = self.path(os.path.join('cache', 'metadata.sqlite'))
+        self.cache = MetadataCache(self.cachePath)
+        self.filePath = self.writeFile('test.csv', 'a,b\n1,2\n')
+
+    def tearDown(self):
+        self.cache.close()
+        super(MetadataCacheTest, self).tearDown()
+
+    def test_schema(self):
+        connection = self.cache.connection()
+        self.assertTrue(os.path.exists(self.cachePath))
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        self.assertEqual(version, SCHEMA_VERSION)
+        tables = set(row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"))
+        self.assertEqual(tables, set(['files', 'sheets', 'fields']))
+
+    def test_olderSchemaDropped(self):
+        connection = sqlite3.connect(self.path('old.sqlite'))
+        connection.execute('CREATE TABLE files (path TEXT)')
+        connection.execute("INSERT INTO files VALUES ('old')")
+        connection.execute('PRAGMA user_version = {}'
+                           .format(SCHEMA_VERSION - 1))
+        connection.commit()
+        connection.close()
+
+        cache = MetadataCache(self.path('old.sqlite'))
+        try:
+            connection = cache.connection()
+            self.assertEqual(
+                connection.execute('SELECT COUNT(*) FROM files').fetchone(),
+                (0,))
+            self.assertEqual(
+                connection.execute('PRAGMA user_version').fetchone()[0],
+                SCHEMA_VERSION)
+        finally:
+            cache.close()
+
+    def test_sheets(self):
+        self.assertEqual(self.cache.sheets(self.filePath), None)
+        self.cache.setSheets(self.filePath, 'CSV', [(u'test', 1)])
+        self.assertEqual(self.cache.sheets(self.filePath),
+                         ('CSV', [(u'test', 1)]))
+
+    def test_nonEmptyRows(self):
+        self.cache.setSheets(self.filePath, 'CSV', [(u'test', 2)])
+        self.assertEqual(self.cache.nonEmptyRows(self.filePath, u'test'),
+                         None)
+        self.cache.setNonEmptyRows(self.filePath, u'test', 2)
+        self.assertEqual(self.cache.nonEmptyRows(self.filePath, u'test'), 2)
+
+    def test_fields(self):
+        fields = [{'src': u'field_1', 'name': u'préfecture', 'type': 4}]
+        self.cache.setSheets(self.filePath, 'CSV', [(u'test', 2)])
+        self.cache.setFields(self.filePath, u'test', 1, 0, fields)
+        self.assertEqual(self.cache.fields(self.filePath, u'test', 1, 0),
+                         fields)
+        self.assertEqual(self.cache.fields(self.filePath, u'test', 0, 0),
+                         None)
+
+    def test_fileChanged(self):
+        self.cache.setSheets(self.filePath, 'CSV', [(u'test', 1)])
+        with open(self.filePath, 'ab') as f:
+            f.write('3,4\n')
+        self.assertEqual(self.cache.sheets(self.filePath), None)
+
+    def test_missingFile(self):
+        self.assertEqual(self.cache.sheets(self.path('missing.csv')), None)
+
+    def test_prune(self):
+        self.cache.maxFiles = 1
+        otherPath = self.writeFile('other.csv', 'a\n1\n')
+        self.cache.setSheets(self.filePath, 'CSV', [(u'test', 1)])
+        self.cache.setSheets(otherPath, 'CSV', [(u'other', 1)])
+        self.assertEqual(self.cache.sheets(self.filePath), None)
+        self.assertEqual(self.cache.sheets(otherPath),
+                         ('CSV', [(u'other', 1)]))
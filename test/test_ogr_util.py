@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+from osgeo import ogr
+
+from SpreadsheetLayers.test.utilities import TemporaryDirectoryTestCase
+from SpreadsheetLayers.util.csv_util import csvOpenOptions, sniffCsv
+from SpreadsheetLayers.util.gdal_util import openDataSource
+from SpreadsheetLayers.util.ogr_util import (OgrSample,
+                                             countNonEmptyRows,
+                                             readFields)
+from SpreadsheetLayers.util.type_inference import inferFieldTypes
+
+
+class OgrUtilTest(TemporaryDirectoryTestCase):
+    '''Tests reading CSV files with the GDAL CSV driver, without header.'''
+
+    def openCsv(self, content, encoding='UTF-8'):
+        path = self.writeFile('test.csv', content.encode(encoding))
+        csvOptions = sniffCsv(path)
+        self.assertEqual(csvOptions['encoding'], encoding)
+        self.dataSource = openDataSource(path, csvOpenOptions(csvOptions))
+        self.assertIsNotNone(self.dataSource)
+        return self.dataSource.GetLayer(0)
+
+    def test_readFieldsCp1252Headers(self):
+        layer = self.openCsv(u'préfecture;état\nRennes;1\nBrest;2\n',
+                             'CP1252')
+        fields = readFields(layer, 1, True, 'CP1252')
+        self.assertEqual([field['name'] for field in fields],
+                         [u'préfecture', u'état'])
+        self.assertEqual([field['src'] for field in fields],
+                         [u'field_1', u'field_2'])
+
+    def test_readFieldsWithoutHeader(self):
+        layer = self.openCsv(u'a,b\n1,2\n')
+        fields = readFields(layer, 0, False)
+        self.assertEqual([field['name'] for field in fields],
+                         [u'field_1', u'field_2'])
+
+    def test_sampleCp1252(self):
+        layer = self.openCsv(u'name;value\nSaint-Étienne;1\nNîmes;2\n',
+                             'CP1252')
+        sample = OgrSample(layer, encoding='CP1252')
+        self.assertEqual(sample.rowCount, 3)
+        self.assertEqual(sample.values[0].value(1), u'Saint-Étienne')
+        self.assertEqual(sample.values[0].value(2), u'Nîmes')
+
+    def test_sampleIgnoredColumns(self):
+        layer = self.openCsv(u'a,b,c\n1,2,3\n')
+        sample = OgrSample(layer, firstColumn=1, maxColumnCount=1)
+        self.assertEqual(sample.headers, [u'field_2'])
+        self.assertEqual(sample.values[0].value(1), u'2')
+
+        sample = OgrSample(layer, ignoredColumns=[0, 2])
+        self.assertEqual(sample.ignoredColumns, set([0, 2]))
+        self.assertEqual(sample.values[0].value(1), None)
+        self.assertEqual(sample.values[1].value(1), u'2')
+
+    def test_countNonEmptyRows(self):
+        layer = self.openCsv(u'a,b\n1,2\n,\n3,\n,\n,\n')
+        self.assertEqual(countNonEmptyRows(layer), 4)
+        self.assertEqual(countNonEmptyRows(layer, blockSize=2), 4)
+
+    def test_inferFieldTypes(self):
+        layer = self.openCsv(u'a,b,c,d\n1,1.5,x,2020-01-31\n2,2,y,\n')
+        self.assertEqual(inferFieldTypes(layer, offset=1),
+                         [ogr.OFTInteger, ogr.OFTReal, ogr.OFTString,
+                          ogr.OFTDate])
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from SpreadsheetLayers.util.spreadsheet_layer import translateFilter
+
+
+FIELDS = [{'src': 'Field1', 'name': u'Région'},
+          {'src': 'Field2', 'name': u'Population'},
+          {'src': 'Field3', 'name': u'Order'},
+          {'src': 'Field4', 'name': u'count'},
+          {'src': 'Field5', 'name': u'and'},
+          {'src': 'Field6', 'name': u'Name "quoted"'}]
+
+
+class TranslateFilterTest(unittest.TestCase):
+
+    def test_identifiers(self):
+        self.assertEqual(
+            translateFilter(u'population > 1000 AND "Région" = \'Bretagne\'',
+                            FIELDS),
+            u'"Field2" > 1000 AND "Field1" = \'Bretagne\'')
+
+    def test_unknownIdentifier(self):
+        self.assertEqual(translateFilter(u'other = 1', FIELDS), u'other = 1')
+
+    def test_literals(self):
+        self.assertEqual(
+            translateFilter(u"population = 'population''s count'", FIELDS),
+            u"\"Field2\" = 'population''s count'")
+
+    def test_quotedIdentifier(self):
+        self.assertEqual(
+            translateFilter(u'"Name ""quoted""" IS NOT NULL', FIELDS),
+            u'"Field6" IS NOT NULL')
+
+    def test_keywordFieldName(self):
+        self.assertEqual(
+            translateFilter(u'"Order" > 1 AND "and" = 2 ORDER', FIELDS),
+            u'"Field3" > 1 AND "Field5" = 2 ORDER')
+        self.assertEqual(translateFilter(u'population > 1 and 1', FIELDS),
+                         u'"Field2" > 1 and 1')
+
+    def test_functionFieldName(self):
+        self.assertEqual(
+            translateFilter(u'count > 1 AND count (population) > 0', FIELDS),
+            u'"Field4" > 1 AND count ("Field2") > 0')
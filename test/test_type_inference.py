@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import unittest
+from osgeo import ogr
+
+from SpreadsheetLayers.util.type_inference import (OFTInteger64,
+                                                   batchType,
+                                                   inferValueTypes,
+                                                   integerType,
+                                                   mergeTypes)
+
+
+class TypeInferenceTest(unittest.TestCase):
+
+    def test_integerType(self):
+        self.assertEqual(integerType(-10, 10), ogr.OFTInteger)
+        self.assertEqual(integerType(0, 2 ** 31), OFTInteger64)
+
+    def test_mergeTypes(self):
+        self.assertEqual(mergeTypes(None, ogr.OFTReal), ogr.OFTReal)
+        self.assertEqual(mergeTypes(ogr.OFTInteger, None), ogr.OFTInteger)
+        self.assertEqual(mergeTypes(ogr.OFTInteger, ogr.OFTReal),
+                         ogr.OFTReal)
+        self.assertEqual(mergeTypes(ogr.OFTDate, ogr.OFTDateTime),
+                         ogr.OFTDateTime)
+        self.assertEqual(mergeTypes(ogr.OFTDate, ogr.OFTInteger),
+                         ogr.OFTString)
+
+    def test_batchTypeStrings(self):
+        self.assertEqual(batchType([], ogr.OFTString), None)
+        self.assertEqual(batchType([u'1', u'-2', u'+3'], ogr.OFTString),
+                         ogr.OFTInteger)
+        self.assertEqual(batchType([u'1', u'2.5', u'1e3'], ogr.OFTString),
+                         ogr.OFTReal)
+        self.assertEqual(batchType([u'2020-01-31', u'2020/2/1'],
+                                   ogr.OFTString),
+                         ogr.OFTDate)
+        self.assertEqual(batchType([u'2020-01-31 12:00', u'2020-02-01'],
+                                   ogr.OFTString),
+                         ogr.OFTDateTime)
+        self.assertEqual(batchType([u'1', u'a'], ogr.OFTString),
+                         ogr.OFTString)
+
+    def test_batchTypeMultiline(self):
+        self.assertEqual(batchType([u'1\n2'], ogr.OFTString), ogr.OFTString)
+
+    def test_batchTypeNumbers(self):
+        self.assertEqual(batchType([1.0, 2.0], ogr.OFTReal), ogr.OFTInteger)
+        self.assertEqual(batchType([1.0, 2.5], ogr.OFTReal), ogr.OFTReal)
+        self.assertEqual(batchType([2 ** 40], ogr.OFTInteger), OFTInteger64)
+
+    def test_inferValueTypes(self):
+        rows = [[1, 1.5, u'a', datetime.date(2020, 1, 1), None, u'3'],
+                [2, 2, u'b', datetime.date(2020, 1, 2), None, 4],
+                [None, u' ', 1, None, None, u'5.5']]
+        self.assertEqual(inferValueTypes(rows, 6),
+                         [ogr.OFTInteger,
+                          ogr.OFTReal,
+                          ogr.OFTString,
+                          ogr.OFTDate,
+                          ogr.OFTString,
+                          ogr.OFTReal])
+
+    def test_inferValueTypesBatches(self):
+        rows = [[1]] * 5 + [[1.5]]
+        self.assertEqual(inferValueTypes(rows, 1, batchSize=2),
+                         [ogr.OFTReal])
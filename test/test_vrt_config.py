@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+
+import os
+from osgeo import ogr
+
+from SpreadsheetLayers.test.utilities import TemporaryDirectoryTestCase
+from SpreadsheetLayers.util.materialize import vrtSourcePaths, vrtSources
+from SpreadsheetLayers.util.spreadsheet_layer import metadataComment
+from SpreadsheetLayers.util.vrt_config import (VrtConfigError,
+                                               readVrtConfig,
+                                               readVrtLayers,
+                                               refreshVrt)
+
+
+# Written by plugin versions without metadata
+LEGACY_VRT = u'''<?xml version="1.0" encoding="UTF-8"?>
+<OGRVRTDataSource>
+    <OGRVRTLayer name="Stations">
+        <SrcDataSource relativeToVRT="1">stations.xlsx</SrcDataSource>
+        <!--Header=True-->
+        <SrcSql dialect="sqlite">SELECT * FROM 'Feuille 1' LIMIT 10 OFFSET 3</SrcSql>
+        <Field name="x" src="Field1" type="Real"/>
+        <Field name="y" src="Field2" type="Real"/>
+        <GeometryType>wkbPoint</GeometryType>
+        <LayerSRS>EPSG:4326</LayerSRS>
+        <GeometryField encoding="PointFromColumns" x="Field1" y="Field2"/>
+    </OGRVRTLayer>
+</OGRVRTDataSource>
+'''
+
+LEGACY_VRT_SRC_LAYER = u'''<?xml version="1.0" encoding="UTF-8"?>
+<OGRVRTDataSource>
+    <OGRVRTLayer name="Stations">
+        <SrcDataSource>/data/stations.ods</SrcDataSource>
+        <!--Header=False-->
+        <SrcLayer>Sheet1</SrcLayer>
+    </OGRVRTLayer>
+</OGRVRTDataSource>
+'''
+
+LEGACY_VRT_OPEN_OPTIONS = u'''<?xml version="1.0" encoding="UTF-8"?>
+<OGRVRTDataSource>
+    <OGRVRTLayer name="Stations">
+        <SrcDataSource relativeToVRT="1">stations.xlsx</SrcDataSource>
+        <OpenOptions><OOI key="HEADERS">FORCE</OOI></OpenOptions>
+        <!--Header=True-->
+        <SrcSql dialect="sqlite">SELECT * FROM 'Data' OFFSET 2</SrcSql>
+    </OGRVRTLayer>
+</OGRVRTDataSource>
+'''
+
+METADATA = {'version': 1,
+            'sheet': u'Données',
+            'header': True,
+            'linesToIgnore': 2,
+            'eofDetection': True,
+            'xField': u'Field1',
+            'yField': u'Field2',
+            'crs': u'EPSG:2154',
+            'showGeometryFields': False,
+            'filter': u'"Order" > 1 -- comment',
+            'csvOptions': None,
+            'fields': [{'src': u'Field1', 'name': u'x',
+                        'type': 'Real', 'include': True},
+                       {'src': u'Field2', 'name': u'y',
+                        'type': 'Real', 'include': True},
+                       {'src': u'Field3', 'name': u'Order',
+                        'type': 'Integer', 'include': False},
+                       {'src': u'Field4', 'name': u'blob',
+                        'type': 'Unknown', 'include': True}]}
+
+UNION_LAYER = u'''
+        <OGRVRTLayer name="{name}">
+            <SrcDataSource relativeToVRT="1">{file}</SrcDataSource>
+            <OpenOptions><OOI key="HEADERS">DISABLE</OOI></OpenOptions>
+            {comment}
+            <SrcLayer>{sheet}</SrcLayer>
+        </OGRVRTLayer>'''
+
+UNION_VRT = u'''<?xml version="1.0" encoding="UTF-8"?>
+<OGRVRTDataSource>
+    <OGRVRTUnionLayer name="All">{layers}
+        <SourceLayerFieldName>source</SourceLayerFieldName>
+        <FieldStrategy>Union</FieldStrategy>
+    </OGRVRTUnionLayer>
+</OGRVRTDataSource>
+'''
+
+
+class VrtConfigTest(TemporaryDirectoryTestCase):
+
+    def writeVrt(self, content, name='test.vrt'):
+        return self.writeFile(name, content.encode('UTF-8'))
+
+    def test_legacySql(self):
+        vrtPath = self.writeVrt(LEGACY_VRT)
+        spec = readVrtConfig(vrtPath)
+        self.assertEqual(spec.filePath,
+                         os.path.join(self.directory, u'stations.xlsx'))
+        self.assertEqual(spec.layerName, u'Stations')
+        self.assertEqual(spec.sheet, u'Feuille 1')
+        self.assertTrue(spec.header)
+        self.assertEqual(spec.linesToIgnore, 2)
+        self.assertEqual(spec.eofDetection, None)
+        self.assertEqual(spec.fields, None)
+        self.assertEqual(spec.xField, u'Field1')
+        self.assertEqual(spec.yField, u'Field2')
+        self.assertEqual(spec.crs, u'EPSG:4326')
+
+    def test_legacySrcLayer(self):
+        spec = readVrtConfig(self.writeVrt(LEGACY_VRT_SRC_LAYER))
+        self.assertEqual(spec.filePath, u'/data/stations.ods')
+        self.assertEqual(spec.sheet, u'Sheet1')
+        self.assertFalse(spec.header)
+        self.assertEqual(spec.linesToIgnore, 0)
+        self.assertEqual(spec.xField, None)
+
+    def test_legacyOpenOptions(self):
+        # Header line read by the driver is not part of the SQL offset
+        spec = readVrtConfig(self.writeVrt(LEGACY_VRT_OPEN_OPTIONS))
+        self.assertTrue(spec.header)
+        self.assertEqual(spec.sheet, u'Data')
+        self.assertEqual(spec.linesToIgnore, 2)
+
+    def test_metadata(self):
+        content = LEGACY_VRT.replace(u'<!--Header=True-->',
+                                     metadataComment(METADATA))
+        spec = readVrtConfig(self.writeVrt(content))
+        self.assertEqual(spec.sheet, u'Données')
+        self.assertTrue(spec.header)
+        self.assertEqual(spec.linesToIgnore, 2)
+        self.assertTrue(spec.eofDetection)
+        self.assertEqual(spec.crs, u'EPSG:2154')
+        self.assertEqual(spec.filter, u'"Order" > 1 -- comment')
+        self.assertEqual([field['type'] for field in spec.fields],
+                         [ogr.OFTReal, ogr.OFTReal, ogr.OFTInteger, None])
+        self.assertEqual([field['include'] for field in spec.fields],
+                         [True, True, False, True])
+
+    def test_invalidMetadata(self):
+        content = LEGACY_VRT.replace(u'<!--Header=True-->',
+                                     u'<!--SpreadsheetLayers {invalid-->')
+        self.assertRaises(VrtConfigError,
+                          readVrtConfig, self.writeVrt(content))
+
+    def test_invalidFile(self):
+        self.assertRaises(VrtConfigError, readVrtConfig,
+                          self.writeVrt(u'<OGRVRTDataSource>'))
+        self.assertRaises(VrtConfigError, readVrtConfig,
+                          self.writeVrt(u'<OGRVRTDataSource/>'))
+
+    def unionVrt(self):
+        metadata = dict(METADATA, sheet=u'Sheet2', fields=None)
+        layers = [UNION_LAYER.format(name=u'a_Sheet1', file=u'a.xlsx',
+                                     sheet=u'Sheet1',
+                                     comment=u'<!--Header=False-->'),
+                  UNION_LAYER.format(name=u'b_Sheet2', file=u'b.xlsx',
+                                     sheet=u'Sheet2',
+                                     comment=metadataComment(metadata))]
+        return self.writeVrt(UNION_VRT.format(layers=u''.join(layers)))
+
+    def test_union(self):
+        specs, union = readVrtLayers(self.unionVrt())
+        self.assertTrue(union)
+        self.assertEqual([spec.layerName for spec in specs],
+                         [u'a_Sheet1', u'b_Sheet2'])
+        self.assertEqual([spec.filePath for spec in specs],
+                         [os.path.join(self.directory, name)
+                          for name in (u'a.xlsx', u'b.xlsx')])
+        self.assertEqual([spec.sheet for spec in specs],
+                         [u'Sheet1', u'Sheet2'])
+        self.assertEqual(readVrtConfig(self.unionVrt()).layerName,
+                         u'a_Sheet1')
+
+    def test_unionNotRefreshed(self):
+        vrtPath = self.unionVrt()
+        with open(vrtPath, 'rb') as f:
+            content = f.read()
+        self.assertEqual(refreshVrt(vrtPath), [])
+        with open(vrtPath, 'rb') as f:
+            self.assertEqual(f.read(), content)
+
+    def test_unionSources(self):
+        vrtPath = self.unionVrt()
+        paths = [os.path.join(self.directory, name)
+                 for name in (u'a.xlsx', u'b.xlsx')]
+        self.assertEqual(vrtSourcePaths(vrtPath), paths)
+        self.assertEqual(vrtSources(vrtPath),
+                         [(path, [u'HEADERS=DISABLE']) for path in paths])
+
+    def test_cachedCopy(self):
+        vrtPath = self.writeVrt(LEGACY_VRT)
+        spec = readVrtConfig(vrtPath)
+        spec.sheet = u'Modified'
+        self.assertEqual(readVrtConfig(vrtPath).sheet, u'Feuille 1')
+
+    def test_changedFile(self):
+        vrtPath = self.writeVrt(LEGACY_VRT)
+        self.assertEqual(readVrtConfig(vrtPath).sheet, u'Feuille 1')
+        self.writeVrt(LEGACY_VRT.replace(u'Feuille 1', u'Feuille 2 bis'))
+        self.assertEqual(readVrtConfig(vrtPath).sheet, u'Feuille 2 bis')
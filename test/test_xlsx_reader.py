@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+import zipfile
+
+from SpreadsheetLayers.test.utilities import (TemporaryDirectoryTestCase,
+                                              writeXlsx)
+from SpreadsheetLayers.util.xlsx_reader import (XlsxError,
+                                                XlsxReader,
+                                                columnIndex,
+                                                formatKind)
+
+
+class XlsxReaderTest(TemporaryDirectoryTestCase):
+
+    def reader(self, lines, **kwargs):
+        path = writeXlsx(self.path('test.xlsx'), lines, **kwargs)
+        reader = XlsxReader(path)
+        self.addCleanup(reader.close)
+        return reader
+
+    def test_columnIndex(self):
+        self.assertEqual(columnIndex('A'), 0)
+        self.assertEqual(columnIndex('Z'), 25)
+        self.assertEqual(columnIndex('AA'), 26)
+
+    def test_formatKind(self):
+        self.assertEqual(formatKind('yyyy-mm-dd'), 'date')
+        self.assertEqual(formatKind('hh:mm'), 'time')
+        self.assertEqual(formatKind('dd/mm/yyyy hh:mm'), 'datetime')
+        self.assertEqual(formatKind('0.00" days"'), None)
+
+    def test_header(self):
+        reader = self.reader([[u'name', u'value'],
+                              [u'a', 1],
+                              [u'b', 2.5]])
+        self.assertEqual(reader.sheetNames(), ['Data'])
+        self.assertTrue(reader.hasHeaderLine('Data'))
+        self.assertEqual(reader.fieldNames('Data'), [u'name', u'value'])
+        self.assertEqual(list(reader.rows('Data')),
+                         [[u'a', 1], [u'b', 2.5]])
+        self.assertEqual(reader.stats('Data'), (2, 2, 2))
+
+    def test_noHeader(self):
+        reader = self.reader([[u'a', u'b'],
+                              [u'c', u'd']])
+        self.assertFalse(reader.hasHeaderLine('Data'))
+        self.assertEqual(reader.fieldNames('Data'), [u'Field1', u'Field2'])
+        self.assertEqual(list(reader.rows('Data', start=1)), [[u'c', u'd']])
+
+    def test_frozenHeader(self):
+        reader = self.reader([[u'a', u'b'],
+                              [u'c', u'd']],
+                             frozenHeader=True)
+        self.assertTrue(reader.hasHeaderLine('Data'))
+
+    def test_headersOption(self):
+        path = writeXlsx(self.path('test.xlsx'), [[u'name', u'value'],
+                                                  [u'a', 1]])
+        reader = XlsxReader(path, headers='DISABLE')
+        self.addCleanup(reader.close)
+        self.assertFalse(reader.hasHeaderLine('Data'))
+
+    def test_largerDimension(self):
+        # Formatted empty cells make the dimension larger than the data
+        reader = self.reader([[u'a', u'b'],
+                              [1, 2],
+                              [3, 4]],
+                             dimension='A1:F100')
+        self.assertEqual(reader.dimension('Data'), (100, 6))
+        self.assertEqual(reader.estimatedFeatureCount('Data'), 99)
+        self.assertEqual(reader.columnCount('Data'), 2)
+        self.assertEqual(reader.fieldNames('Data'), [u'a', u'b'])
+        self.assertEqual(list(reader.rows('Data')), [[1, 2], [3, 4]])
+
+    def test_largerDimensionBeyondProbe(self):
+        lines = [[u'a', u'b']] + [[i, i] for i in xrange(0, 10)]
+        lines.append([0, 0, 1])
+        reader = self.reader(lines, dimension='A1:F12')
+        self.assertEqual(reader.columnCount('Data', probeLines=5), 3)
+
+    def test_missingLines(self):
+        reader = self.reader([[u'a', u'b'],
+                              [1, 2],
+                              [],
+                              [3, None]])
+        self.assertEqual(list(reader.rows('Data')),
+                         [[1, 2], [None, None], [3, None]])
+        self.assertEqual(reader.stats('Data'), (3, 3, 2))
+
+    def test_invalidFile(self):
+        path = self.writeFile('test.xlsx', 'not a zip file')
+        self.assertRaises(XlsxError, XlsxReader, path)
+
+    def test_invalidWorkbookClosesZip(self):
+        path = self.path('test.xlsx')
+        with zipfile.ZipFile(path, 'w') as z:
+            z.writestr('xl/workbook.xml', '<workbook/>')
+        closed = []
+        close = zipfile.ZipFile.close
+
+        def trackClose(zipFile):
+            closed.append(zipFile)
+            close(zipFile)
+
+        zipfile.ZipFile.close = trackClose
+        try:
+            self.assertRaises(XlsxError, XlsxReader, path)
+        finally:
+            zipfile.ZipFile.close = close
+        self.assertEqual(len(closed), 1)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+'''Small files generated for the tests, in temporary directories.'''
+
+import os
+import shutil
+import zipfile
+import tempfile
+import unittest
+from xml.sax.saxutils import escape
+
+from SpreadsheetLayers.benchmarks.fixtures import XLSX_FILES, columnName
+
+
+class TemporaryDirectoryTestCase(unittest.TestCase):
+    '''TestCase writing its files in a directory removed after each test.'''
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def writeFile(self, name, content):
+        path = self.path(name)
+        with open(path, 'wb') as f:
+            f.write(content)
+        return path
+
+
+def writeXlsx(path, lines, dimension=None, frozenHeader=False):
+    '''Write a one sheet XLSX file named Data.
+
+    lines are lists of values, unicode strings, numbers or None for empty
+    cells. dimension is the ref of the dimension element, computed from
+    lines by default.
+    '''
+    rows = []
+    columns = 0
+    for line, values in enumerate(lines):
+        cells = []
+        for column, value in enumerate(values):
+            if value is None:
+                continue
+            ref = '{}{}'.format(columnName(column), line + 1)
+            if isinstance(value, unicode):
+                cells.append(u'<c r="{}" t="inlineStr"><is><t>{}</t></is></c>'
+                             .format(ref, escape(value)))
+            else:
+                cells.append(u'<c r="{}"><v>{!r}</v></c>'.format(ref, value))
+            columns = max(columns, column + 1)
+        rows.append(u'<row r="{}">{}</row>'.format(line + 1, u''.join(cells)))
+
+    if dimension is None:
+        dimension = 'A1:{}{}'.format(columnName(max(0, columns - 1)),
+                                     max(1, len(lines)))
+    pane = ''
+    if frozenHeader:
+        pane = ('<sheetViews><sheetView workbookViewId="0">'
+                '<pane ySplit="1" topLeftCell="A2" state="frozen"/>'
+                '</sheetView></sheetViews>')
+    sheet = (u'<?xml version="1.0" encoding="UTF-8"?>\n'
+             u'<worksheet xmlns="http://schemas.openxmlformats.org/'
+             u'spreadsheetml/2006/main">'
+             u'<dimension ref="{}"/>{}<sheetData>{}</sheetData></worksheet>'
+             ).format(dimension, pane, u''.join(rows))
+    sst = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+           '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/'
+           '2006/main" count="0" uniqueCount="0"></sst>')
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        for name, content in sorted(XLSX_FILES.items()):
+            z.writestr(name, content)
+        z.writestr('xl/sharedStrings.xml', sst)
+        z.writestr('xl/worksheets/sheet1.xml', sheet.encode('UTF-8'))
+    return path
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+'''Write VRT files of spreadsheet layers without QGIS.
+
+Usage: python -m SpreadsheetLayers.util.batch [options] FILE [FILE ...]
+
+Each file, or each sheet with --all-sheets, gets a VRT file next to the
+spreadsheet, as written by the plugin dialog, files being processed in
+parallel by a pool of processes. With --merge, all sheets are merged into a
+single VRT file instead, files being read by a pool of threads.
+'''
+
+import os
+import sys
+import argparse
+import multiprocessing
+
+from SpreadsheetLayers.util.spreadsheet_layer import (SpreadsheetLayerSpec,
+                                                      writeFileVrts,
+                                                      writeUnionVrt)
+
+
+def buildVrt(task):
+    '''Write VRT files for one spreadsheet, see writeFileVrts.
+
+    task is a (filePath, options, allSheets, inferenceRows) tuple, options
+    being SpreadsheetLayerSpec keyword arguments. Return a list of
+    (filePath, vrtPath, error) tuples.
+    '''
+    filePath, options, allSheets, inferenceRows = task
+    try:
+        results = writeFileVrts(SpreadsheetLayerSpec(filePath, **options),
+                                allSheets,
+                                inferenceRows)
+    except Exception as e:
+        return [(filePath, None, unicode(e))]
+    return [(filePath, vrtPath, error) for spec, vrtPath, error in results]
+
+
+def fieldType(value):
+    name, sep, typeName = value.rpartition('=')
+    if not sep or not name:
+        raise argparse.ArgumentTypeError(
+            'expected FIELD=TYPE, got {}'.format(value))
+    return name.decode('UTF-8'), typeName
+
+
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(
+        prog='python -m SpreadsheetLayers.util.batch',
+        description='Write VRT files of spreadsheet layers.')
+    parser.add_argument('files', metavar='FILE', nargs='+',
+                        help='spreadsheet file')
+    parser.add_argument('--sheet',
+                        help='sheet name (default: first sheet)')
+    parser.add_argument('--all-sheets', action='store_true',
+                        help='write one VRT file by sheet, named'
+                             ' FILE.SHEET.vrt')
+    parser.add_argument('--merge', metavar='VRT',
+                        help='merge all sheets into one layer, written to'
+                             ' VRT and named after it')
+    parser.add_argument('--source-field',
+                        help='with --merge, field holding the name of the'
+                             ' sheet layer of each row')
+    parser.add_argument('--header', action='store_true',
+                        help='use first line as field names')
+    parser.add_argument('--lines-to-ignore', type=int, default=0,
+                        help='number of lines to ignore at top of sheet')
+    parser.add_argument('--eof-detection', action='store_true',
+                        help='ignore empty lines at end of sheet')
+    parser.add_argument('--x-field',
+                        help='x field for point geometry')
+    parser.add_argument('--y-field',
+                        help='y field for point geometry')
+    parser.add_argument('--crs',
+                        help='layer CRS, like EPSG:4326')
+    parser.add_argument('--show-geometry-fields', action='store_true',
+                        help='keep x and y fields as attributes')
+    parser.add_argument('--type', metavar='FIELD=TYPE', dest='types',
+                        type=fieldType, action='append', default=[],
+                        help='force type of a field, like Integer or Date')
+    parser.add_argument('--filter', metavar='EXPRESSION',
+                        help='SQLite expression on field names, only'
+                             ' matching rows are part of the layer')
+    parser.add_argument('--exclude', metavar='FIELD', dest='excluded',
+                        action='append', default=[],
+                        help='leave a field out of the layer')
+    parser.add_argument('--type-inference-rows', type=int, default=10000,
+                        help='number of data rows used to detect field types'
+                             ', 0 for the whole sheet, -1 to keep types'
+                             ' detected by GDAL (default: 10000)')
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=multiprocessing.cpu_count(),
+                        help='number of parallel processes'
+                             ' (default: number of CPUs)')
+    args = parser.parse_args(argv)
+    if bool(args.x_field) != bool(args.y_field):
+        parser.error('--x-field and --y-field must be given together')
+    return args
+
+
+def main(argv=None):
+    args = parseArgs(argv)
+
+    def decode(value):
+        if value is None:
+            return None
+        return value.decode(sys.getfilesystemencoding() or 'UTF-8')
+
+    options = {'sheet': decode(args.sheet),
+               'header': args.header,
+               'linesToIgnore': args.lines_to_ignore,
+               'eofDetection': args.eof_detection,
+               'xField': decode(args.x_field),
+               'yField': decode(args.y_field),
+               'crs': args.crs,
+               'showGeometryFields': args.show_geometry_fields,
+               'fieldTypes': dict(args.types),
+               'excludedFields': [decode(name) for name in args.excluded],
+               'filter': decode(args.filter)}
+    tasks = [(decode(filePath), options, args.all_sheets,
+              args.type_inference_rows)
+             for filePath in args.files]
+
+    if args.merge:
+        vrtPath = decode(args.merge)
+        pool = None
+        specs = [SpreadsheetLayerSpec(task[0], **options) for task in tasks]
+        if len(specs) > 1:
+            # Tell sheets of different files apart
+            for spec in specs:
+                spec.layerName = os.path.splitext(
+                    os.path.basename(spec.filePath))[0]
+        results = [[(spec.filePath, path, error)
+                    for spec, path, error in writeUnionVrt(
+                        specs,
+                        vrtPath,
+                        os.path.splitext(os.path.basename(vrtPath))[0],
+                        args.all_sheets,
+                        decode(args.source_field),
+                        args.type_inference_rows,
+                        args.jobs)]]
+    elif args.jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(tasks)))
+        results = pool.imap_unordered(buildVrt, tasks)
+    else:
+        pool = None
+        results = (buildVrt(task) for task in tasks)
+
+    errors = 0
+    try:
+        for fileResults in results:
+            for filePath, vrtPath, error in fileResults:
+                if error is None:
+                    sys.stdout.write(u'{}\n'.format(vrtPath).encode('UTF-8'))
+                else:
+                    errors += 1
+                    sys.stderr.write(u'{}: {}\n'.format(filePath, error)
+                                     .encode('UTF-8'))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import codecs
+from collections import OrderedDict
+
+
+CSV_EXTENSIONS = ('.csv', '.tsv')
+
+# CSV driver SEPARATOR open option values
+SEPARATORS = OrderedDict([(',', 'COMMA'),
+                          (';', 'SEMICOLON'),
+                          ('\t', 'TAB'),
+                          ('|', 'PIPE'),
+                          (' ', 'SPACE')])
+
+
+def isCsv(path):
+    return os.path.splitext(path)[1].lower() in CSV_EXTENSIONS
+
+
+def sniffCsv(path, maxBytes=64 * 1024):
+    '''Guess separator, encoding and header line of a CSV file.
+
+    Only the first maxBytes bytes are read. Return a dict with separator,
+    a CSV driver SEPARATOR open option value, encoding, UTF-8 unless the
+    prefix is not valid UTF-8, and header, True when the first line looks
+    like field names.
+    '''
+    with open(path, 'rb') as f:
+        data = f.read(maxBytes)
+
+    encoding = 'UTF-8'
+    if data.startswith(codecs.BOM_UTF8):
+        data = data[len(codecs.BOM_UTF8):]
+    try:
+        data.decode('UTF-8')
+    except UnicodeDecodeError as e:
+        # A character may be cut at the end of the prefix
+        if e.start < len(data) - 3:
+            encoding = 'CP1252'
+
+    # Drop last line, which may be incomplete
+    if len(data) == maxBytes and '\n' in data:
+        data = data[:data.rfind('\n') + 1]
+
+    default = '\t' if path.lower().endswith('.tsv') else ','
+    sniffer = csv.Sniffer()
+    try:
+        delimiter = sniffer.sniff(data, ''.join(SEPARATORS)).delimiter
+    except csv.Error:
+        delimiter = default
+    try:
+        header = sniffer.has_header(data)
+    except csv.Error:
+        header = False
+
+    return {'separator': SEPARATORS.get(delimiter, SEPARATORS[default]),
+            'encoding': encoding,
+            'header': header}
+
+
+def csvOpenOptions(csvOptions, header=False):
+    '''Return CSV driver open options, reading header line when header.'''
+    return ['SEPARATOR={}'.format(csvOptions['separator']),
+            'HEADERS={}'.format('YES' if header else 'NO')]
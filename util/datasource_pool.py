@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import os
+from collections import OrderedDict
+
+from SpreadsheetLayers.util.gdal_util import openDataSource
+
+
+class DataSourcePool(object):
+    '''DataSourcePool keeps OGR datasources opened for reuse.
+
+    Datasources are keyed on path, open options and modification time, so
+    a datasource is never reused once its file has changed. acquire() and
+    release() count references, released datasources stay open and the
+    least recently used ones are closed when the estimated memory of
+    unreferenced datasources exceeds maxMemory bytes. Memory used by a
+    datasource is estimated from its file size.
+
+    Datasources are opened in shared mode, so VRT files declaring a shared
+    SrcDataSource reuse them when opened from the same thread. As OGR
+    datasources are not thread safe, a pool must only be used from one
+    thread.
+    '''
+
+    # Zipped XML spreadsheets take much more memory than their file size
+    expansionFactor = 10
+
+    def __init__(self, maxMemory=256 * 1024 * 1024):
+        self.maxMemory = maxMemory
+        # (path, mtime, openOptions) -> [dataSource, references, estimated memory]
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def acquire(self, path, openOptions=None):
+        '''Return an opened datasource for path, or None.
+
+        openOptions is a list of driver open options, see
+        gdal_util.openDataSource.
+        '''
+        st = os.stat(path)
+        key = (path, st.st_mtime, tuple(openOptions or ()))
+
+        # Drop unreferenced datasources of previous file versions
+        for oldKey, entry in self._entries.items():
+            if (oldKey[0] == path
+                and oldKey[1] != key[1]
+                and entry[1] == 0
+            ):
+                del self._entries[oldKey]
+
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            dataSource = openDataSource(path, openOptions, shared=True)
+            if dataSource is None:
+                return None
+            entry = [dataSource, 0, st.st_size * self.expansionFactor]
+        entry[1] += 1
+        # Most recently used entries are kept at end
+        self._entries[key] = entry
+        self._evict()
+        return entry[0]
+
+    def release(self, dataSource):
+        for entry in self._entries.values():
+            if entry[0] is dataSource:
+                entry[1] = max(0, entry[1] - 1)
+                break
+        self._evict()
+
+    def clear(self):
+        '''Close all unreferenced datasources.'''
+        for key, entry in self._entries.items():
+            if entry[1] == 0:
+                del self._entries[key]
+
+    def _evict(self):
+        unused = [key for key, entry in self._entries.items()
+                  if entry[1] == 0]
+        memory = sum(self._entries[key][2] for key in unused)
+        for key in unused:
+            if memory <= self.maxMemory:
+                break
+            memory -= self._entries.pop(key)[2]
@@ -1,17 +1,21 @@
 # -*- coding: utf-8 -*-
 
 import os
-import tempfile
-from osgeo import ogr
+import uuid
+from osgeo import gdal, ogr
+
+
+# Drivers with a HEADERS open option, by file extension
+HEADERS_OPTION_EXTENSIONS = ('.ods', '.xlsx')
+
 
 def testGdal():
     # Inspired from gdal test ogr_vrt_34
     # https://github.com/OSGeo/gdal/commit/82074ed5bd67d2efbfbcea50c5416856d9c5826d
-    path = os.path.join(tempfile.gettempdir(), 'gdal_test.csv')
-    f = open(path, 'wb')
-    f.write('x,y\n'.encode('ascii'))
-    f.write('2,49\n'.encode('ascii'))
-    f.close()
+    # Test file is written in memory, in a unique directory, so concurrent
+    # QGIS instances do not share it.
+    path = '/vsimem/{}/gdal_test.csv'.format(uuid.uuid4().hex)
+    gdal.FileFromMemBuffer(path, 'x,y\n2,49\n')
 
     vrt_xml = """
 <OGRVRTDataSource>
@@ -24,22 +28,64 @@ def testGdal():
     </OGRVRTLayer>
 </OGRVRTDataSource>"""
 
-    ds = ogr.Open( vrt_xml )
-
-    lyr = ds.GetLayer(0)
-    lyr.SetIgnoredFields(['x', 'y'])
-    f = lyr.GetNextFeature()
     result = True
-    if f is None:
-        result = False
-    elif f.GetGeometryRef().ExportToWkt() != 'POINT (2 49)':
+    ds = ogr.Open( vrt_xml )
+    if ds is None:
         result = False
+    else:
+        lyr = ds.GetLayer(0)
+        lyr.SetIgnoredFields(['x', 'y'])
+        f = lyr.GetNextFeature()
+        if f is None:
+            result = False
+        elif f.GetGeometryRef().ExportToWkt() != 'POINT (2 49)':
+            result = False
 
     f = None
     lyr = None
     ds = None
-    os.unlink(path)
+    gdal.Unlink(path)
 
     return result
 
-GDAL_COMPAT = testGdal()
+
+def openOptionsSupported():
+    """Tell whether GDAL supports driver open options (GDAL >= 2.0)."""
+    return hasattr(gdal, 'OpenEx') and int(gdal.VersionInfo()) >= 2000000
+
+
+def openDataSource(path, openOptions=None, shared=False):
+    '''Open a vector datasource read only, with driver open options.
+
+    Without open options, this is ogr.Open() or ogr.OpenShared(). Open
+    options need GDAL >= 2.0, see openOptionsSupported().
+    '''
+    if not openOptions:
+        if shared:
+            return ogr.OpenShared(path, 0)
+        return ogr.Open(path, 0)
+    flags = gdal.OF_VECTOR
+    if shared:
+        flags |= gdal.OF_SHARED
+    return gdal.OpenEx(path, flags, open_options=openOptions)
+
+
+def spreadsheetOpenOptions(path, header=False):
+    '''Return ODS or XLSX driver open options, None for other files.
+
+    The first line is read as field names when header is set, as a feature
+    otherwise, whatever OGR_ODS_HEADERS and OGR_XLSX_HEADERS are.
+    '''
+    if (os.path.splitext(path)[1].lower() not in HEADERS_OPTION_EXTENSIONS
+        or not openOptionsSupported()
+    ):
+        return None
+    return ['HEADERS={}'.format('FORCE' if header else 'DISABLE')]
+
+
+def dataSourceDriverName(dataSource):
+    """Return short driver name of an OGR or GDAL datasource."""
+    driver = dataSource.GetDriver()
+    if hasattr(driver, 'ShortName'):
+        return driver.ShortName
+    return driver.GetName()
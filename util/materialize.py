@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+from collections import OrderedDict
+from xml.etree import ElementTree
+from osgeo import ogr
+
+
+# Formats layers can be materialized in, by OGR driver name. Formats
+# without multiLayer hold a single layer and are rewritten as a whole.
+FORMATS = OrderedDict([
+    ('GPKG', {'name': 'GeoPackage',
+              'extension': '.gpkg',
+              'layerOptions': ['SPATIAL_INDEX=YES'],
+              'multiLayer': True}),
+    ('FlatGeobuf', {'name': 'FlatGeobuf',
+                    'extension': '.fgb',
+                    'layerOptions': ['SPATIAL_INDEX=YES'],
+                    'multiLayer': False}),
+])
+
+
+def isFormatSupported(driverName):
+    return ogr.GetDriverByName(driverName) is not None
+
+
+def supportedFormats():
+    """Return driver names of formats supported by the GDAL in use."""
+    return [driverName for driverName in FORMATS
+            if isFormatSupported(driverName)]
+
+
+def materializedPath(vrtPath, driverName='GPKG'):
+    '''Return path of the file materializing a VRT file in a format.'''
+    return u'{}{}'.format(os.path.splitext(vrtPath)[0],
+                          FORMATS[driverName]['extension'])
+
+
+def pathFormat(path):
+    '''Return driver name of a materialized file, from its extension.'''
+    extension = os.path.splitext(path)[1].lower()
+    for driverName, options in FORMATS.iteritems():
+        if options['extension'] == extension:
+            return driverName
+    return 'GPKG'
+
+
+def vrtSourcePaths(vrtPath):
+    '''Return paths of the spreadsheet files read by a VRT file.'''
+    try:
+        sources = ElementTree.parse(vrtPath).iter('SrcDataSource')
+    except (IOError, ElementTree.ParseError):
+        return [os.path.splitext(vrtPath)[0]]
+    paths = []
+    for source in sources:
+        if not source.text:
+            continue
+        if source.get('relativeToVRT') == '1':
+            paths.append(os.path.join(os.path.dirname(vrtPath), source.text))
+        else:
+            paths.append(source.text)
+    return paths
+
+
+def vrtSources(vrtPath):
+    '''Return (path, openOptions) of the layer sources of a VRT file.
+
+    openOptions is the list of driver open options of the source, see
+    gdal_util.openDataSource, None when the layer has none.
+    '''
+    try:
+        layers = list(ElementTree.parse(vrtPath).iter('OGRVRTLayer'))
+    except (IOError, ElementTree.ParseError):
+        return []
+    sources = []
+    for layer in layers:
+        source = layer.find('SrcDataSource')
+        if source is None or not source.text:
+            continue
+        path = source.text
+        if source.get('relativeToVRT') == '1':
+            path = os.path.join(os.path.dirname(vrtPath), path)
+        openOptions = [u'{}={}'.format(option.get('key'), option.text or u'')
+                       for option in layer.iter('OOI')]
+        sources.append((os.path.abspath(path), openOptions or None))
+    return sources
+
+
+def sharedVrtContent(vrtPath):
+    '''Return XML content of a VRT file whose sources are opened shared.
+
+    Source paths are made absolute, so the content can be opened from
+    memory. Sources already opened in shared mode by the calling thread,
+    like the ones of a DataSourcePool, are then reused.
+    '''
+    root = ElementTree.parse(vrtPath).getroot()
+    for source in root.iter('SrcDataSource'):
+        if source.get('relativeToVRT') == '1':
+            source.text = os.path.abspath(
+                os.path.join(os.path.dirname(vrtPath), source.text or u''))
+            del source.attrib['relativeToVRT']
+        source.set('shared', '1')
+    return ElementTree.tostring(root)
+
+
+def fileDigest(path, blockSize=1024 * 1024):
+    """Return SHA-1 hex digest of a file content."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def isMaterializationOutdated(vrtPath, outPath=None):
+    '''Return True if materialized file is missing or older than sources.'''
+    if outPath is None:
+        outPath = materializedPath(vrtPath)
+    if not os.path.exists(outPath):
+        return True
+    mtime = os.path.getmtime(outPath)
+    for path in [vrtPath] + vrtSourcePaths(vrtPath):
+        if os.path.exists(path) and os.path.getmtime(path) > mtime:
+            return True
+    return False
+
+
+def materializeVrt(vrtPath, outPath=None, progress=None,
+                   sharedSources=False):
+    '''Copy the first layer of a VRT file into a GeoPackage or FlatGeobuf.
+
+    Format is given by outPath extension, see FORMATS, a GeoPackage next to
+    the VRT file by default. The layer has the same name, typed fields and
+    geometry as the VRT layer, and a spatial index. In a GeoPackage, an
+    existing layer with the same name is replaced, other layers are kept,
+    and the layer is replaced and filled in a single transaction. Single
+    layer formats are written to a temporary file which replaces outPath
+    once complete.
+    Either way, outPath is left unchanged when progress raises.
+    With sharedSources, sources are opened in shared mode, see
+    sharedVrtContent().
+    '''
+    if outPath is None:
+        outPath = materializedPath(vrtPath)
+    driverName = pathFormat(outPath)
+    options = FORMATS[driverName]
+    driver = ogr.GetDriverByName(driverName)
+    if driver is None:
+        raise IOError(u'GDAL does not support {} format'
+                      .format(options['name']))
+
+    if sharedSources:
+        try:
+            src = ogr.Open(sharedVrtContent(vrtPath), 0)
+        except (IOError, ElementTree.ParseError):
+            src = None
+    else:
+        src = ogr.Open(vrtPath, 0)
+    if src is None:
+        raise IOError(u'Could not open {}'.format(vrtPath))
+    srcLayer = src.GetLayer(0)
+    layerName = srcLayer.GetName()
+
+    dstPath = outPath
+    if not options['multiLayer']:
+        root, extension = os.path.splitext(outPath)
+        dstPath = u'{}.tmp{}'.format(root, extension)
+        if os.path.exists(dstPath):
+            driver.DeleteDataSource(dstPath)
+
+    if os.path.exists(dstPath):
+        dst = ogr.Open(dstPath, 1)
+    else:
+        dst = driver.CreateDataSource(dstPath)
+    if dst is None:
+        raise IOError(u'Could not open {}'.format(outPath))
+
+    # In a GeoPackage, the existing layer is replaced in the transaction, so
+    # it is kept as is when the copy is interrupted
+    transaction = dst.TestCapability(ogr.ODsCTransactions)
+    if transaction:
+        dst.StartTransaction()
+    dstLayer = None
+    try:
+        for i in xrange(0, dst.GetLayerCount()):
+            if dst.GetLayer(i).GetName() == layerName:
+                dst.DeleteLayer(i)
+                break
+
+        dstLayer = dst.CreateLayer(layerName,
+                                   srcLayer.GetSpatialRef(),
+                                   srcLayer.GetGeomType(),
+                                   options['layerOptions'])
+        if dstLayer is None:
+            raise IOError(u'Could not create layer in {}'.format(outPath))
+
+        srcDefn = srcLayer.GetLayerDefn()
+        for iField in xrange(0, srcDefn.GetFieldCount()):
+            dstLayer.CreateField(srcDefn.GetFieldDefn(iField))
+        dstDefn = dstLayer.GetLayerDefn()
+
+        featureCount = srcLayer.GetFeatureCount()
+        srcLayer.ResetReading()
+        row = 0
+        feature = srcLayer.GetNextFeature()
+        while feature is not None:
+            if progress is not None:
+                progress(row, featureCount)
+            dstFeature = ogr.Feature(dstDefn)
+            dstFeature.SetFrom(feature)
+            dstLayer.CreateFeature(dstFeature)
+            feature = srcLayer.GetNextFeature()
+            row += 1
+        if transaction:
+            dst.CommitTransaction()
+    except Exception:
+        if transaction:
+            dst.RollbackTransaction()
+        dstLayer = None
+        dst = None
+        if dstPath != outPath:
+            driver.DeleteDataSource(dstPath)
+        raise
+
+    # Closing datasource writes pending data, like FlatGeobuf index
+    dstLayer = None
+    dst = None
+    if dstPath != outPath:
+        if os.path.exists(outPath):
+            driver.DeleteDataSource(outPath)
+        os.rename(dstPath, outPath)
+    return outPath
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import sqlite3
+import functools
+
+
+# Version 3: files are read without header line through open options
+SCHEMA_VERSION = 3
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    accessed REAL NOT NULL,
+    driver TEXT
+);
+CREATE TABLE IF NOT EXISTS sheets (
+    path TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    feature_count INTEGER NOT NULL,
+    non_empty_rows INTEGER,
+    PRIMARY KEY (path, name)
+);
+CREATE TABLE IF NOT EXISTS fields (
+    path TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    row_offset INTEGER NOT NULL,
+    inference_rows INTEGER NOT NULL,
+    fields TEXT NOT NULL,
+    PRIMARY KEY (path, sheet, row_offset, inference_rows)
+);
+'''
+
+
+def ignoreErrors(method):
+    '''Make cache operations behave as cache misses on database errors.'''
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except (sqlite3.Error, OSError, ValueError):
+            return None
+    return wrapper
+
+
+class MetadataCache(object):
+    '''MetadataCache stores spreadsheet files metadata in a SQLite database.
+
+    Entries are keyed on file path, size and modification time, they are
+    dropped as soon as the file changes. Stored metadata are the sheets
+    list with their feature counts, the number of non empty rows and the
+    fields, with their inferred types, read for a given offset.
+    Database errors are not fatal, the cache then behaves as if it was
+    empty. Only the maxFiles most recently used files are kept.
+    '''
+
+    maxFiles = 500
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+
+    def connection(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            # Worker threads create the connection, the dialog closes it
+            # once the worker thread is finished.
+            self._connection = sqlite3.connect(self.path,
+                                               timeout=5,
+                                               check_same_thread=False)
+            self._upgrade(self._connection)
+        return self._connection
+
+    def _upgrade(self, connection):
+        '''Create tables, dropping cached data of older schema versions.'''
+        version = connection.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            with connection:
+                for table in ('files', 'sheets', 'fields'):
+                    connection.execute('DROP TABLE IF EXISTS {}'.format(table))
+            connection.execute('PRAGMA user_version = {}'.format(SCHEMA_VERSION))
+        connection.executescript(SCHEMA)
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def _stat(self, filePath):
+        st = os.stat(filePath)
+        return st.st_size, st.st_mtime
+
+    def _delete(self, connection, filePath):
+        for table in ('files', 'sheets', 'fields'):
+            connection.execute('DELETE FROM {} WHERE path = ?'.format(table),
+                               (filePath,))
+
+    def _isValid(self, connection, filePath):
+        '''Check cached entries of filePath, drop them if outdated.'''
+        row = connection.execute(
+            'SELECT size, mtime FROM files WHERE path = ?',
+            (filePath,)).fetchone()
+        if row is None:
+            return False
+        if tuple(row) != self._stat(filePath):
+            with connection:
+                self._delete(connection, filePath)
+            return False
+        return True
+
+    def _prune(self, connection):
+        rows = connection.execute(
+            'SELECT path FROM files ORDER BY accessed DESC LIMIT -1 OFFSET ?',
+            (self.maxFiles,)).fetchall()
+        for row in rows:
+            self._delete(connection, row[0])
+
+    @ignoreErrors
+    def sheets(self, filePath):
+        '''Return (driverName, [(sheetName, featureCount), ...]) or None.'''
+        connection = self.connection()
+        if not self._isValid(connection, filePath):
+            return None
+        with connection:
+            connection.execute('UPDATE files SET accessed = ? WHERE path = ?',
+                               (time.time(), filePath))
+        driverName = connection.execute(
+            'SELECT driver FROM files WHERE path = ?',
+            (filePath,)).fetchone()[0]
+        sheets = connection.execute(
+            'SELECT name, feature_count FROM sheets'
+            ' WHERE path = ? ORDER BY position',
+            (filePath,)).fetchall()
+        if driverName is None or len(sheets) == 0:
+            return None
+        return driverName, [(name, count) for name, count in sheets]
+
+    @ignoreErrors
+    def setSheets(self, filePath, driverName, sheets):
+        connection = self.connection()
+        size, mtime = self._stat(filePath)
+        with connection:
+            self._delete(connection, filePath)
+            connection.execute(
+                'INSERT INTO files (path, size, mtime, accessed, driver)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (filePath, size, mtime, time.time(), driverName))
+            for position, (name, featureCount) in enumerate(sheets):
+                connection.execute(
+                    'INSERT INTO sheets (path, position, name, feature_count)'
+                    ' VALUES (?, ?, ?, ?)',
+                    (filePath, position, name, featureCount))
+            self._prune(connection)
+
+    @ignoreErrors
+    def nonEmptyRows(self, filePath, sheet):
+        connection = self.connection()
+        if not self._isValid(connection, filePath):
+            return None
+        row = connection.execute(
+            'SELECT non_empty_rows FROM sheets WHERE path = ? AND name = ?',
+            (filePath, sheet)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    @ignoreErrors
+    def setNonEmptyRows(self, filePath, sheet, nonEmptyRows):
+        connection = self.connection()
+        if not self._isValid(connection, filePath):
+            return
+        with connection:
+            connection.execute(
+                'UPDATE sheets SET non_empty_rows = ?'
+                ' WHERE path = ? AND name = ?',
+                (nonEmptyRows, filePath, sheet))
+
+    @ignoreErrors
+    def fields(self, filePath, sheet, offset, inferenceRows):
+        '''Return fields read with given offset, see ogr_util.readFields.
+
+        inferenceRows is the number of rows used for types inference, 0 for
+        the whole sheet and -1 when types have not been inferred.
+        '''
+        connection = self.connection()
+        if not self._isValid(connection, filePath):
+            return None
+        row = connection.execute(
+            'SELECT fields FROM fields'
+            ' WHERE path = ? AND sheet = ? AND row_offset = ?'
+            ' AND inference_rows = ?',
+            (filePath, sheet, offset, inferenceRows)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    @ignoreErrors
+    def setFields(self, filePath, sheet, offset, inferenceRows, fields):
+        connection = self.connection()
+        if not self._isValid(connection, filePath):
+            return
+        with connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO fields'
+                ' (path, sheet, row_offset, inference_rows, fields)'
+                ' VALUES (?, ?, ?, ?, ?)',
+                (filePath, sheet, offset, inferenceRows, json.dumps(fields)))
@@ -0,0 +1,325 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+from array import array
+from osgeo import ogr
+
+
+# Drivers whose GetFeature() reads a row directly, although their layers
+# do not advertise OLCRandomRead
+FAST_GET_FEATURE_DRIVERS = ('XLS',)
+
+
+class Cancelled(Exception):
+    '''Raised by progress callbacks to interrupt a long OGR operation.'''
+
+
+class OgrColumn(object):
+    '''OgrColumn stores decoded values of one OGR field.
+
+    Integer and Real values are stored in typed arrays, other values in a
+    list. Null values are tracked in a separate bytearray mask. String
+    values are decoded with encoding, the one of the source file.
+    '''
+    def __init__(self, fieldType, encoding='UTF-8'):
+        self.fieldType = fieldType
+        self.encoding = encoding
+        self.nulls = bytearray()
+
+        if fieldType == ogr.OFTInteger:
+            self.values = array('i')
+            self.default = 0
+        elif fieldType == ogr.OFTReal:
+            self.values = array('d')
+            self.default = 0.0
+        else:
+            self.values = []
+            self.default = None
+
+    def __len__(self):
+        return len(self.nulls)
+
+    def append(self, feature, iField):
+        if not feature.IsFieldSet(iField):
+            self.values.append(self.default)
+            self.nulls.append(1)
+            return
+
+        if self.fieldType == ogr.OFTDate:
+            value = datetime.date(*feature.GetFieldAsDateTime(iField)[:3])
+        elif self.fieldType == ogr.OFTInteger:
+            value = feature.GetFieldAsInteger(iField)
+        elif self.fieldType == ogr.OFTReal:
+            value = feature.GetFieldAsDouble(iField)
+        else:
+            # Wrongly encoded files must not break the sample view
+            value = feature.GetFieldAsString(iField).decode(self.encoding,
+                                                            'replace')
+        self.values.append(value)
+        self.nulls.append(0)
+
+    def appendValue(self, value):
+        """Append a value read without OGR, converted to column type."""
+        try:
+            if value is None or value == u'':
+                raise ValueError()
+            if self.fieldType == ogr.OFTDate:
+                if isinstance(value, basestring):
+                    value = datetime.datetime.strptime(
+                        value[:10].replace(u'/', u'-'), '%Y-%m-%d')
+                value = datetime.date(value.year, value.month, value.day)
+            elif self.fieldType == ogr.OFTInteger:
+                value = int(float(value))
+            elif self.fieldType == ogr.OFTReal:
+                value = float(value)
+            else:
+                value = valueText(value)
+            # Integers out of the typed array range raise OverflowError
+            self.values.append(value)
+        except (AttributeError, TypeError, ValueError, OverflowError):
+            self.values.append(self.default)
+            self.nulls.append(1)
+            return
+        self.nulls.append(0)
+
+    def value(self, row):
+        if self.nulls[row]:
+            return None
+        return self.values[row]
+
+
+class OgrSample(object):
+    '''OgrSample holds the first rows of an OGR layer.
+
+    Features are read once, in order, and every column is taken from the
+    same feature. Only fields in the window starting at firstColumn and
+    limited to maxColumnCount columns are decoded. Fields whose index is in
+    ignoredColumns are kept in the window but not decoded, their values
+    being null. String values are decoded with encoding.
+    No reference to any OGR related object is kept, so a sample can be
+    read in a worker thread and displayed from the GUI thread.
+    '''
+    def __init__(self, layer=None, maxRowCount=None,
+                 firstColumn=0, maxColumnCount=None, progress=None,
+                 ignoredColumns=(), encoding='UTF-8'):
+        self.columns = []
+        self.headers = []
+        self.values = []
+        self.ignoredColumns = set()
+        self.rowCount = 0
+        if layer is not None:
+            self.read(layer, maxRowCount, firstColumn, maxColumnCount,
+                      progress, ignoredColumns, encoding)
+
+    def read(self, layer, maxRowCount=None,
+             firstColumn=0, maxColumnCount=None, progress=None,
+             ignoredColumns=(), encoding='UTF-8'):
+        layerDefn = layer.GetLayerDefn()
+
+        rows = layer.GetFeatureCount()
+        if maxRowCount is not None:
+            rows = min(rows, maxRowCount)
+        fieldCount = layerDefn.GetFieldCount()
+        lastColumn = fieldCount
+        if maxColumnCount is not None:
+            lastColumn = min(firstColumn + maxColumnCount, fieldCount)
+        self.columns = range(min(firstColumn, fieldCount), lastColumn)
+        self.ignoredColumns = set(ignoredColumns)
+
+        # Headers and column storage
+        for iField in self.columns:
+            fieldDefn = layerDefn.GetFieldDefn(iField)
+            self.headers.append(fieldDefn.GetNameRef().decode('UTF-8'))
+            self.values.append(OgrColumn(fieldDefn.GetType(), encoding))
+
+        # Do not decode fields outside of the window or ignored
+        ignoredFields = []
+        for iField in xrange(0, fieldCount):
+            if iField not in self.columns or iField in ignoredColumns:
+                fieldDefn = layerDefn.GetFieldDefn(iField)
+                ignoredFields.append(fieldDefn.GetNameRef())
+        layer.SetIgnoredFields(ignoredFields)
+
+        # Lines
+        try:
+            layer.ResetReading()
+            for row in xrange(0, rows):
+                if progress is not None:
+                    progress(row, rows)
+                feature = layer.GetNextFeature()
+                if feature is None:
+                    break
+                for column, iField in enumerate(self.columns):
+                    self.values[column].append(feature, iField)
+                self.rowCount += 1
+        finally:
+            layer.SetIgnoredFields([])
+
+    def readRows(self, headers, fieldTypes, rows, maxRowCount=None,
+                 progress=None, ignoredColumns=()):
+        """Read values of rows read without OGR, see xlsx_reader."""
+        self.columns = range(0, len(headers))
+        self.headers = list(headers)
+        self.values = [OgrColumn(fieldType) for fieldType in fieldTypes]
+        self.ignoredColumns = set(ignoredColumns)
+        for row, values in enumerate(rows):
+            if maxRowCount is not None and row >= maxRowCount:
+                break
+            if progress is not None:
+                progress(row, maxRowCount or 0)
+            for column, value in enumerate(values):
+                if column in ignoredColumns:
+                    value = None
+                self.values[column].appendValue(value)
+            self.rowCount += 1
+
+
+def valueText(value):
+    '''Return text of a value read without OGR, formatted like OGR does.'''
+    if value is None:
+        return u''
+    if isinstance(value, float) and value.is_integer():
+        return unicode(int(value))
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y/%m/%d %H:%M:%S').decode('ascii')
+    if isinstance(value, datetime.date):
+        return value.strftime('%Y/%m/%d').decode('ascii')
+    if isinstance(value, datetime.time):
+        return value.strftime('%H:%M:%S').decode('ascii')
+    return unicode(value)
+
+
+def isEmptyFeature(feature, fieldCount):
+    '''Return True if no field of feature is set.'''
+    for iField in xrange(0, fieldCount):
+        if feature.IsFieldSet(iField):
+            return False
+    return True
+
+
+def countNonEmptyRows(layer, progress=None, blockSize=1000,
+                      driverName=None):
+    '''Return the number of rows up to the last one with a non null field.
+
+    Each row is only tested up to its first non null field.
+    When the driver supports fast random access, the layer is read
+    backward, by blocks of blockSize rows with SetNextByIndex() or row by
+    row with GetFeature(), and reading stops at the last non empty row.
+    driverName is the short name of the layer driver, XLS layers being
+    read with GetFeature(), see FAST_GET_FEATURE_DRIVERS.
+    Otherwise every row is read once, in order.
+    '''
+    featureCount = layer.GetFeatureCount()
+    fieldCount = layer.GetLayerDefn().GetFieldCount()
+
+    if layer.TestCapability(ogr.OLCFastSetNextByIndex):
+        return _countNonEmptyRowsByBlocks(layer, featureCount, fieldCount,
+                                          progress, blockSize)
+
+    if (layer.TestCapability(ogr.OLCRandomRead)
+        or driverName in FAST_GET_FEATURE_DRIVERS
+    ):
+        nonEmptyRows = _countNonEmptyRowsByFid(layer, featureCount,
+                                               fieldCount, progress)
+        if nonEmptyRows is not None:
+            return nonEmptyRows
+
+    return _countNonEmptyRowsForward(layer, featureCount, fieldCount,
+                                     progress)
+
+
+def _countNonEmptyRowsForward(layer, featureCount, fieldCount, progress):
+    nonEmptyRows = 0
+    layer.ResetReading()
+    feature = layer.GetNextFeature()
+    current_row = 1
+    while feature is not None:
+        if progress is not None:
+            progress(current_row, featureCount)
+
+        if not isEmptyFeature(feature, fieldCount):
+            nonEmptyRows = current_row
+
+        feature = layer.GetNextFeature()
+        current_row += 1
+
+    return nonEmptyRows
+
+
+def _countNonEmptyRowsByBlocks(layer, featureCount, fieldCount,
+                               progress, blockSize):
+    end = featureCount
+    while end > 0:
+        start = max(0, end - blockSize)
+        if progress is not None:
+            progress(featureCount - start, featureCount)
+
+        nonEmptyRows = 0
+        layer.SetNextByIndex(start)
+        for row in xrange(start, end):
+            feature = layer.GetNextFeature()
+            if feature is None:
+                break
+            if not isEmptyFeature(feature, fieldCount):
+                nonEmptyRows = row + 1
+        if nonEmptyRows > 0:
+            return nonEmptyRows
+
+        end = start
+
+    return 0
+
+
+def _countNonEmptyRowsByFid(layer, featureCount, fieldCount, progress):
+    '''Read layer backward with GetFeature().
+
+    This assumes contiguous feature ids and returns None when this does not
+    hold, so the caller can fall back to a sequential scan.
+    '''
+    layer.ResetReading()
+    feature = layer.GetNextFeature()
+    if feature is None:
+        return 0
+    firstFid = feature.GetFID()
+
+    for row in xrange(featureCount - 1, -1, -1):
+        if progress is not None:
+            progress(featureCount - row, featureCount)
+
+        fid = firstFid + row
+        feature = layer.GetFeature(fid)
+        if feature is None or feature.GetFID() != fid:
+            return None
+        if not isEmptyFeature(feature, fieldCount):
+            return row + 1
+
+    return 0
+
+
+def readFields(layer, offset, header, encoding='UTF-8'):
+    '''Return fields definitions of layer as a list of dicts.
+
+    When header is set or some lines are ignored, field names are read from
+    the line just before the first data line, and decoded with encoding,
+    the one of the source file.
+    '''
+    feature = None
+    if header or offset >= 1:
+        layer.SetNextByIndex(offset - 1)
+        feature = layer.GetNextFeature()
+
+    fields = []
+    layerDefn = layer.GetLayerDefn()
+    for iField in xrange(0, layerDefn.GetFieldCount()):
+        fieldDefn = layerDefn.GetFieldDefn(iField)
+        src = fieldDefn.GetNameRef().decode('UTF-8')
+        name = src
+        if feature is not None:
+            name = (feature.GetFieldAsString(iField).decode(encoding,
+                                                            'replace')
+                    or name)
+        fields.append({'src': src,
+                       'name': name,
+                       'type': fieldDefn.GetType()
+                       })
+    return fields
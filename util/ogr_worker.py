@@ -0,0 +1,594 @@
+# -*- coding: utf-8 -*-
+
+import os
+import functools
+import itertools
+from osgeo import gdal, ogr
+from PyQt4 import QtCore
+
+from SpreadsheetLayers.util.csv_util import csvOpenOptions, isCsv, sniffCsv
+from SpreadsheetLayers.util.datasource_pool import DataSourcePool
+from SpreadsheetLayers.util.gdal_util import (dataSourceDriverName,
+                                              openOptionsSupported,
+                                              spreadsheetOpenOptions)
+from SpreadsheetLayers.util.materialize import (fileDigest,
+                                                isMaterializationOutdated,
+                                                materializeVrt,
+                                                materializedPath,
+                                                vrtSources)
+from SpreadsheetLayers.util.metadata_cache import MetadataCache
+from SpreadsheetLayers.util.profiling import Stage
+from SpreadsheetLayers.util.spreadsheet_layer import writeUnionVrt, writeVrts
+from SpreadsheetLayers.util.ogr_util import (Cancelled,
+                                             OgrSample,
+                                             countNonEmptyRows,
+                                             readFields,
+                                             valueText)
+from SpreadsheetLayers.util.type_inference import (inferFieldTypes,
+                                                   inferValueTypes)
+from SpreadsheetLayers.util.vrt_config import refreshVrt
+from SpreadsheetLayers.util.xlsx_reader import (XlsxError,
+                                                XlsxReader,
+                                                isStreamable)
+
+
+def job(method):
+    '''Decorate OgrWorker slots handling one request.
+
+    Requests which are no longer current are dropped without running,
+    Cancelled exceptions are silently ignored and other errors are reported
+    through the failed signal. With profiling, completed requests are
+    timed and their record is emitted through the profiled signal.
+    '''
+    @functools.wraps(method)
+    def wrapper(self, requestId, *args):
+        if requestId != self.currentRequestId:
+            return
+        if self.profiling:
+            self.stage = Stage(method.__name__)
+        try:
+            if self.stage is None:
+                method(self, requestId, *args)
+            else:
+                with self.stage:
+                    method(self, requestId, *args)
+                self.stage.record['detail'] = self.filePath
+                self.profiled.emit(requestId, self.stage.record)
+        except Cancelled:
+            pass
+        except Exception as e:
+            self.failed.emit(requestId, unicode(e))
+        finally:
+            self.stage = None
+    return wrapper
+
+
+class OgrWorker(QtCore.QObject):
+    '''OgrWorker runs OGR operations outside of the GUI thread.
+
+    The worker is meant to be moved to a QThread, its slots being invoked
+    through queued signals. Every request carries an id and results are
+    emitted with the id of the request they answer.
+    Setting currentRequestId from the GUI thread cancels running requests
+    with another id at their next progress step.
+    The worker owns its OGR datasources, no OGR object is shared with the
+    GUI thread. Datasources are taken from a pool, so files opened again
+    by later requests, or by later dialogs using the shared worker, are not
+    parsed again while unchanged. When a metadata cache path is given, sheets, non empty rows
+    and fields are read from the cache when possible and the file is only
+    opened with OGR when needed.
+    XLSX files opened with streaming enabled are read by an XlsxReader
+    instead, which only parses the rows it needs. Filtered rows, which
+    need the SQLite dialect, are still read through OGR.
+    Setting profiling from the GUI thread times next requests, along with
+    the features they read and the seeks they do.
+    '''
+
+    dataSourceOpened = QtCore.pyqtSignal(int, object, object, object, object)
+    nonEmptyRowsCounted = QtCore.pyqtSignal(int, int)
+    filteredRowsCounted = QtCore.pyqtSignal(int, int, object)
+    fieldsRead = QtCore.pyqtSignal(int, object)
+    sampleRead = QtCore.pyqtSignal(int, object)
+    materialized = QtCore.pyqtSignal(int, object)
+    vrtsWritten = QtCore.pyqtSignal(int, object)
+    vrtsRefreshed = QtCore.pyqtSignal(int, object)
+    progress = QtCore.pyqtSignal(int, int, int)
+    failed = QtCore.pyqtSignal(int, object)
+    profiled = QtCore.pyqtSignal(int, object)
+
+    progressStep = 100
+
+    # Non empty rows counts by (file path, sheet, size, modification time),
+    # shared by all workers, in front of the on disk metadata cache
+    nonEmptyRowsCache = {}
+
+    def __init__(self, cachePath=None, poolMemory=None, parent=None):
+        super(OgrWorker, self).__init__(parent)
+        self.currentRequestId = 0
+        self.profiling = False
+        self.stage = None
+        self.dataSource = None
+        self.filePath = None
+        self.openOptions = None
+        self.encoding = 'UTF-8'
+        self.featureCounts = {}
+        self.reader = None
+        # Source path -> SHA-1 digest of its last refreshed content
+        self.digests = {}
+        self.pool = DataSourcePool()
+        if poolMemory is not None:
+            self.pool.maxMemory = poolMemory
+        self.cache = None
+        if cachePath is not None:
+            self.cache = MetadataCache(cachePath)
+
+    def close(self):
+        self.closeDataSource()
+        self.pool.clear()
+        if self.cache is not None:
+            self.cache.close()
+
+    @QtCore.pyqtSlot()
+    def closeDataSource(self):
+        """Give current datasource back to the pool."""
+        if self.dataSource is not None:
+            self.pool.release(self.dataSource)
+        if self.reader is not None:
+            self.reader.close()
+        self.dataSource = None
+        self.reader = None
+        self.filePath = None
+        self.openOptions = None
+        self.encoding = 'UTF-8'
+        self.featureCounts = {}
+
+    def ogrDataSource(self):
+        '''Return OGR datasource, taking it from the pool on first use.
+
+        Pooled datasources are opened in shared mode, so sample VRTs using a
+        shared SrcDataSource reuse them instead of parsing the file again.
+        '''
+        if self.dataSource is None and self.filePath is not None:
+            try:
+                self.dataSource = self.pool.acquire(self.filePath,
+                                                   self.openOptions)
+            except OSError:
+                self.dataSource = None
+        return self.dataSource
+
+    def progressCallback(self, requestId, step=None):
+        if step is None:
+            step = self.progressStep
+        lastValue = [None]
+
+        def progress(value, maximum):
+            if requestId != self.currentRequestId:
+                raise Cancelled()
+            if lastValue[0] is None or abs(value - lastValue[0]) >= step:
+                lastValue[0] = value
+                self.progress.emit(requestId, value, maximum)
+        return progress
+
+    def counted(self, layer):
+        """Return layer, counting its reads when profiling."""
+        if self.stage is None:
+            return layer
+        return self.stage.layer(layer)
+
+    def layer(self, sheet):
+        dataSource = self.ogrDataSource()
+        if dataSource is None:
+            return None
+        return self.counted(dataSource.GetLayerByName(sheet.encode('UTF-8')))
+
+    @QtCore.pyqtSlot(int, object, bool)
+    @job
+    def openDataSource(self, requestId, filePath, streaming):
+        '''Open filePath, with an XlsxReader if streaming is set.
+
+        Files which are not XLSX, or which the reader fails to open, are
+        opened with OGR. Files are opened without header line when drivers
+        support it, CSV files with the sniffed separator, sniffed options
+        being emitted with the sheets.
+        '''
+        self.closeDataSource()
+        self.progress.emit(requestId, 0, 0)
+        self.filePath = filePath
+
+        csvOptions = None
+        if isCsv(filePath) and openOptionsSupported():
+            csvOptions = sniffCsv(filePath)
+            self.openOptions = csvOpenOptions(csvOptions)
+            self.encoding = csvOptions['encoding']
+        else:
+            self.openOptions = spreadsheetOpenOptions(filePath)
+
+        if streaming and isStreamable(filePath):
+            headers = None
+            if self.openOptions is not None:
+                headers = 'DISABLE'
+            try:
+                self.reader = XlsxReader(filePath, headers)
+            except (IOError, XlsxError):
+                self.reader = None
+
+        cached = None
+        if self.cache is not None:
+            cached = self.cache.sheets(filePath)
+
+        if cached is not None:
+            driverName, sheets = cached
+        elif self.reader is not None:
+            # Estimated counts, not stored in cache
+            driverName = 'XLSX'
+            sheets = [(sheet, self.reader.estimatedFeatureCount(sheet))
+                      for sheet in self.reader.sheetNames()]
+        else:
+            dataSource = self.ogrDataSource()
+            if dataSource is None:
+                self.closeDataSource()
+                self.failed.emit(requestId,
+                                 u'Could not open {}'.format(filePath))
+                return
+
+            sheets = []
+            for i in xrange(0, dataSource.GetLayerCount()):
+                layer = dataSource.GetLayer(i)
+                sheets.append((layer.GetName().decode('UTF-8'),
+                               layer.GetFeatureCount()))
+            driverName = dataSourceDriverName(dataSource)
+
+            if self.cache is not None:
+                self.cache.setSheets(filePath, driverName, sheets)
+
+        self.featureCounts = dict(sheets)
+        self.dataSourceOpened.emit(requestId, filePath, driverName, sheets,
+                                   csvOptions)
+
+    @QtCore.pyqtSlot(int, object, bool)
+    @job
+    def countNonEmptyRows(self, requestId, sheet, eofDetection):
+        if not eofDetection:
+            count = self.featureCounts.get(sheet)
+            if count is not None:
+                self.nonEmptyRowsCounted.emit(requestId, count)
+            return
+
+        st = os.stat(self.filePath)
+        key = (self.filePath, sheet, st.st_size, st.st_mtime)
+        count = self.nonEmptyRowsCache.get(key)
+        if count is None and self.cache is not None:
+            count = self.cache.nonEmptyRows(self.filePath, sheet)
+        if count is None and self.reader is not None:
+            count = self.reader.stats(sheet,
+                                      self.progressCallback(requestId))[1]
+        if count is None:
+            layer = self.layer(sheet)
+            if layer is None:
+                self.failed.emit(requestId,
+                                 u'Could not open sheet {}'.format(sheet))
+                return
+            count = countNonEmptyRows(
+                layer,
+                self.progressCallback(requestId),
+                driverName=dataSourceDriverName(self.ogrDataSource()))
+            if self.cache is not None:
+                self.cache.setNonEmptyRows(self.filePath, sheet, count)
+        self.nonEmptyRowsCache[key] = count
+        self.nonEmptyRowsCounted.emit(requestId, count)
+
+    @QtCore.pyqtSlot(int, object)
+    @job
+    def countFilteredRows(self, requestId, sql):
+        '''Count rows with an SQLite dialect COUNT query on datasource.
+
+        This also checks the query, the count being -1 with the GDAL error
+        message when it is invalid.
+        '''
+        dataSource = self.ogrDataSource()
+        if dataSource is None:
+            self.failed.emit(requestId,
+                             u'Could not open {}'.format(self.filePath))
+            return
+        gdal.ErrorReset()
+        result = dataSource.ExecuteSQL(sql.encode('UTF-8'), dialect='SQLITE')
+        if result is None:
+            error = gdal.GetLastErrorMsg().decode('UTF-8', 'replace')
+            self.filteredRowsCounted.emit(requestId, -1,
+                                          error or u'Invalid query')
+            return
+        try:
+            feature = result.GetNextFeature()
+            count = feature.GetFieldAsInteger(0) if feature is not None else 0
+        finally:
+            dataSource.ReleaseResultSet(result)
+        self.filteredRowsCounted.emit(requestId, count, None)
+
+    @QtCore.pyqtSlot(int, object, int, bool, int)
+    @job
+    def readFields(self, requestId, sheet, offset, header, inferenceRows):
+        '''Read fields names and types.
+
+        Types are inferred from the inferenceRows first data rows, the whole
+        sheet for 0, or kept as detected by GDAL for -1.
+        '''
+        # Header flag implies an offset, so fields only depend on offset
+        fields = None
+        if self.cache is not None:
+            fields = self.cache.fields(self.filePath, sheet, offset,
+                                       inferenceRows)
+        if fields is None and self.reader is not None and inferenceRows >= 0:
+            # Types detected by GDAL are only known through OGR
+            fields = self.readerFields(requestId, sheet, offset, header,
+                                       inferenceRows)
+        if fields is None:
+            layer = self.layer(sheet)
+            if layer is None:
+                self.failed.emit(requestId,
+                                 u'Could not open sheet {}'.format(sheet))
+                return
+            fields = readFields(layer, offset, header, self.encoding)
+            if inferenceRows >= 0:
+                types = inferFieldTypes(
+                    layer,
+                    offset,
+                    inferenceRows or None,
+                    progress=self.progressCallback(requestId),
+                    encoding=self.encoding)
+                for field, fieldType in zip(fields, types):
+                    field['type'] = fieldType
+            if self.cache is not None:
+                self.cache.setFields(self.filePath, sheet, offset,
+                                     inferenceRows, fields)
+        self.fieldsRead.emit(requestId, fields)
+
+    def readerFields(self, requestId, sheet, offset, header, inferenceRows):
+        """Read fields like readFields, with XlsxReader."""
+        names = self.reader.fieldNames(sheet)
+        headers = None
+        if header or offset >= 1:
+            headers = next(self.reader.rows(sheet, offset - 1, 1), None)
+        types = inferValueTypes(self.reader.rows(sheet,
+                                                 offset,
+                                                 inferenceRows or None),
+                                len(names),
+                                inferenceRows or None,
+                                progress=self.progressCallback(requestId))
+        fields = []
+        for iField, (src, fieldType) in enumerate(zip(names, types)):
+            name = src
+            if headers is not None:
+                name = valueText(headers[iField]) or name
+            fields.append({'src': src,
+                           'name': name,
+                           'type': fieldType})
+        return fields
+
+    @QtCore.pyqtSlot(int, object, int, object, object)
+    @job
+    def readSample(self, requestId, content, maxRowCount, ignoredColumns,
+                   source):
+        '''Read sample through a VRT given as XML content.
+
+        Fields whose index is in ignoredColumns are not decoded. source is
+        None or the SpreadsheetLayerBuilder.sampleSource() of the VRT, used
+        to read the sample with XlsxReader instead when the file is
+        streamed.
+        '''
+        if (self.reader is not None
+            and source is not None
+            and self.readerSample(requestId, source, maxRowCount,
+                                  ignoredColumns)
+        ):
+            return
+
+        # Keep source datasource opened for next samples
+        self.ogrDataSource()
+
+        dataSource = ogr.Open(content, 0)
+        if dataSource is None:
+            self.failed.emit(requestId, u'Could not open sample VRT')
+            return
+
+        sample = OgrSample()
+        for i in xrange(0, dataSource.GetLayerCount()):
+            sample = OgrSample(self.counted(dataSource.GetLayer(i)),
+                               maxRowCount,
+                               progress=self.progressCallback(requestId),
+                               ignoredColumns=ignoredColumns,
+                               encoding=self.encoding)
+        self.sampleRead.emit(requestId, sample)
+
+    def readerSample(self, requestId, source, maxRowCount, ignoredColumns):
+        '''Read sample like readSample, with XlsxReader.
+
+        Return False when fields do not match the ones of the reader, like
+        fields read by OGR before a change of OGR_XLSX_HEADERS.
+        '''
+        names = self.reader.fieldNames(source['sheet'])
+        if any(field['src'] not in names for field in source['fields']):
+            return False
+        columns = [names.index(field['src']) for field in source['fields']]
+        rows = self.reader.rows(source['sheet'],
+                                source['offset'],
+                                min(maxRowCount, source['limit']))
+        sample = OgrSample()
+        sample.readRows([field['name'] for field in source['fields']],
+                        [field['type'] for field in source['fields']],
+                        ([values[i] for i in columns] for values in rows),
+                        maxRowCount,
+                        self.progressCallback(requestId),
+                        ignoredColumns)
+        self.sampleRead.emit(requestId, sample)
+        return True
+
+    def materializePooled(self, vrtPath, outPath, progress):
+        '''Run materialize.materializeVrt(), sources of the VRT file being
+        taken from the pool, so files already parsed are not parsed again.
+        '''
+        dataSources = []
+        for path, openOptions in vrtSources(vrtPath):
+            try:
+                dataSource = self.pool.acquire(path, openOptions)
+            except OSError:
+                continue
+            if dataSource is not None:
+                dataSources.append(dataSource)
+        try:
+            return materializeVrt(vrtPath, outPath, progress,
+                                  sharedSources=True)
+        finally:
+            for dataSource in dataSources:
+                self.pool.release(dataSource)
+
+    @QtCore.pyqtSlot(int, object, object)
+    @job
+    def materialize(self, requestId, vrtPath, outPath):
+        """Copy VRT layer into outPath, format given by its extension."""
+        self.materializePooled(vrtPath, outPath,
+                               self.progressCallback(requestId))
+        self.materialized.emit(requestId, outPath)
+
+    @QtCore.pyqtSlot(int, object, bool, object, object)
+    @job
+    def writeVrts(self, requestId, specs, allSheets, materialize, union):
+        '''Write VRT files of several files or sheets with the same options.
+
+        Results are (spec, vrtPath, error) tuples, see
+        spreadsheet_layer.writeVrts. union is None, or a dict with vrtPath,
+        layerName and sourceField keys to write a single merged layer, see
+        spreadsheet_layer.writeUnionVrt. materialize is None, or the driver
+        name of the format written VRT files are then materialized in.
+        Files are read by several threads to write VRT files, each opening
+        its own datasources, only materialization takes them from the pool.
+        '''
+        progress = self.progressCallback(requestId, step=1)
+        if union is None:
+            results = writeVrts(specs, allSheets, progress=progress)
+        else:
+            results = writeUnionVrt(specs,
+                                    union['vrtPath'],
+                                    union['layerName'],
+                                    allSheets,
+                                    union['sourceField'],
+                                    progress=progress)
+        if materialize is not None:
+            for i, (spec, vrtPath, error) in enumerate(results):
+                if error is not None:
+                    continue
+                try:
+                    self.materializePooled(
+                        vrtPath,
+                        materializedPath(vrtPath, materialize),
+                        self.progressCallback(requestId))
+                except IOError as e:
+                    results[i] = (spec, None, unicode(e))
+        self.vrtsWritten.emit(requestId, results)
+
+    @QtCore.pyqtSlot(object)
+    def seedDigests(self, paths):
+        """Store digests of source files not known yet."""
+        for path in paths:
+            if path in self.digests:
+                continue
+            try:
+                self.digests[path] = fileDigest(path)
+            except (IOError, OSError):
+                pass
+
+    @QtCore.pyqtSlot(object)
+    def forgetDigests(self, paths):
+        for path in paths:
+            self.digests.pop(path, None)
+
+    @QtCore.pyqtSlot(int, object, int)
+    @job
+    def refreshVrts(self, requestId, entries, inferenceRows):
+        '''Update VRT files, and their converted files, after sources changed.
+
+        entries are dicts with vrtPath, outPath and sourcePaths keys,
+        outPath being the converted file or None. Sources are hashed and
+        entries whose sources all have their known digest, see
+        seedDigests(), are skipped, as their files were only touched.
+        Results are copies of refreshed entries with mismatches, the fields
+        whose values no longer fit their type, see vrt_config.refreshVrt(),
+        and error keys. Digests are only stored once all entries are
+        refreshed, so cancelled requests are checked again.
+        '''
+        progress = self.progressCallback(requestId)
+        digests = {}
+        for entry in entries:
+            for path in entry['sourcePaths']:
+                if path in digests:
+                    continue
+                try:
+                    digests[path] = fileDigest(path)
+                except (IOError, OSError):
+                    digests[path] = None
+
+        results = []
+        for entry in entries:
+            if all(digests[path] is not None
+                   and digests[path] == self.digests.get(path)
+                   for path in entry['sourcePaths']):
+                continue
+            result = dict(entry, mismatches=[], error=None)
+            try:
+                result['mismatches'] = refreshVrt(entry['vrtPath'],
+                                                  inferenceRows,
+                                                  progress)
+                outPath = entry['outPath']
+                if (outPath is not None
+                    and isMaterializationOutdated(entry['vrtPath'], outPath)
+                ):
+                    self.materializePooled(entry['vrtPath'], outPath,
+                                           progress)
+            except Cancelled:
+                raise
+            except Exception as e:
+                result['error'] = unicode(e)
+            results.append(result)
+        self.digests.update((path, digest)
+                            for path, digest in digests.iteritems()
+                            if digest is not None)
+        self.vrtsRefreshed.emit(requestId, results)
+
+
+_requestIds = itertools.count(1)
+_sharedThread = None
+_sharedWorker = None
+
+
+def nextRequestId():
+    """Return a new request id, unique among all users of shared worker."""
+    return next(_requestIds)
+
+
+def sharedWorker(cachePath=None, poolMemory=None):
+    '''Return the OgrWorker shared by all dialogs, starting it if needed.
+
+    Running all OGR operations in one long lived thread lets datasources
+    pooled by the worker be reused from one dialog to the next, as OGR
+    shared datasources are only shared within a thread. Arguments are only
+    used when the worker is started.
+    '''
+    global _sharedThread, _sharedWorker
+    if _sharedWorker is None:
+        _sharedThread = QtCore.QThread()
+        _sharedWorker = OgrWorker(cachePath, poolMemory)
+        _sharedWorker.moveToThread(_sharedThread)
+        _sharedThread.start()
+    return _sharedWorker
+
+
+def stopSharedWorker():
+    """Stop shared worker thread, closing all its datasources."""
+    global _sharedThread, _sharedWorker
+    if _sharedWorker is None:
+        return
+    _sharedWorker.currentRequestId = 0
+    _sharedThread.quit()
+    _sharedThread.wait()
+    _sharedWorker.close()
+    _sharedThread = None
+    _sharedWorker = None
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import timeit
+import datetime
+from collections import OrderedDict
+
+
+def peakMemory():
+    '''Return peak resident memory of the process in bytes, None if unknown.
+
+    Only available where the resource module is, not on Windows.
+    '''
+    try:
+        import resource
+    except ImportError:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return usage
+    return usage * 1024
+
+
+class CountingLayer(object):
+    '''CountingLayer wraps an OGR layer to count features read and seeks.
+
+    Counts are added to the features and seeks keys of record, any other
+    attribute is the one of the wrapped layer.
+    '''
+
+    def __init__(self, layer, record):
+        self._layer = layer
+        self._record = record
+
+    def __getattr__(self, name):
+        return getattr(self._layer, name)
+
+    def GetNextFeature(self):
+        feature = self._layer.GetNextFeature()
+        if feature is not None:
+            self._record['features'] += 1
+        return feature
+
+    def GetFeature(self, fid):
+        self._record['seeks'] += 1
+        feature = self._layer.GetFeature(fid)
+        if feature is not None:
+            self._record['features'] += 1
+        return feature
+
+    def SetNextByIndex(self, index):
+        self._record['seeks'] += 1
+        return self._layer.SetNextByIndex(index)
+
+    def ResetReading(self):
+        self._record['seeks'] += 1
+        return self._layer.ResetReading()
+
+
+class Stage(object):
+    '''Stage records the cost of one step, used as a context manager.
+
+    The record holds the duration in seconds, the features read and seeks
+    done through layers returned by layer(), and the increase of the peak
+    memory of the process in bytes, None when unknown.
+    '''
+
+    def __init__(self, name, detail=None):
+        self.record = OrderedDict([('stage', name),
+                                   ('detail', detail),
+                                   ('seconds', None),
+                                   ('features', 0),
+                                   ('seeks', 0),
+                                   ('memory', None)])
+
+    def __enter__(self):
+        self._memory = peakMemory()
+        self._start = timeit.default_timer()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.record['seconds'] = timeit.default_timer() - self._start
+        memory = peakMemory()
+        if memory is not None and self._memory is not None:
+            self.record['memory'] = memory - self._memory
+        return False
+
+    def layer(self, layer):
+        if layer is None:
+            return None
+        return CountingLayer(layer, self.record)
+
+
+def formatRecord(record):
+    '''Return a one line summary of a stage record.'''
+    text = u'{:<20} {:>9.1f} ms {:>8} features {:>6} seeks'.format(
+        record['stage'],
+        record['seconds'] * 1000,
+        record['features'],
+        record['seeks'])
+    if record['memory'] is not None:
+        text += u' {:>+8.1f} MB'.format(record['memory'] / 1024.0 / 1024.0)
+    if record['detail']:
+        text += u'  {}'.format(record['detail'])
+    return text
+
+
+def appendTrace(path, record):
+    '''Append record to a JSON trace file, one JSON object per line.'''
+    record = OrderedDict(record)
+    record['time'] = datetime.datetime.now().isoformat()
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
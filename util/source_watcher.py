@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+
+import os
+from PyQt4 import QtCore
+
+from SpreadsheetLayers.util.materialize import vrtSourcePaths
+from SpreadsheetLayers.util.ogr_worker import OgrWorker, nextRequestId
+
+
+class SourceWatcher(QtCore.QObject):
+    '''SourceWatcher updates spreadsheet layers whose source file changes.
+
+    Layers are registered with watch() by id, along with their VRT file
+    and converted file, if any. Source files read by the VRT files are
+    watched with a QFileSystemWatcher. Changes are collected during
+    refreshDelay milliseconds, as files are often written in several
+    steps, then layers of sources whose size or modification time changed
+    are sent to a dedicated OgrWorker thread, see OgrWorker.refreshVrts().
+    The worker hashes sources and compares them with their content when
+    watching started, so files which are only touched do not trigger
+    anything, and refreshes VRT files of changed sources.
+    layersRefreshed is emitted once with the results of all refreshed
+    layers, each result having a layerIds key.
+    '''
+
+    layersRefreshed = QtCore.pyqtSignal(object)
+    refreshRequested = QtCore.pyqtSignal(int, object, int)
+    digestsRequested = QtCore.pyqtSignal(object)
+    digestsDropped = QtCore.pyqtSignal(object)
+
+    refreshDelay = 1000
+
+    def __init__(self, inferenceRows=0, parent=None):
+        super(SourceWatcher, self).__init__(parent)
+        self.inferenceRows = inferenceRows
+        # layerId -> (vrtPath, outPath, sourcePaths)
+        self.layers = {}
+        # source path -> (size, mtime)
+        self.signatures = {}
+        self.pending = set()
+        # vrtPath -> entry of the running refresh
+        self.running = {}
+        self.requestId = 0
+        self.thread = None
+        self.worker = None
+
+        self.fileWatcher = QtCore.QFileSystemWatcher(self)
+        self.fileWatcher.fileChanged.connect(self.onFileChanged)
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.refreshDelay)
+        self.timer.timeout.connect(self.processChanges)
+
+    def startWorker(self):
+        if self.worker is not None:
+            return
+        self.thread = QtCore.QThread()
+        self.worker = OgrWorker()
+        self.worker.moveToThread(self.thread)
+        self.refreshRequested.connect(self.worker.refreshVrts)
+        self.digestsRequested.connect(self.worker.seedDigests)
+        self.digestsDropped.connect(self.worker.forgetDigests)
+        self.worker.vrtsRefreshed.connect(self.onVrtsRefreshed)
+        self.worker.failed.connect(self.onFailed)
+        self.thread.start()
+
+    def stop(self):
+        """Stop watching and stop the worker thread."""
+        self.timer.stop()
+        paths = self.fileWatcher.files()
+        if paths:
+            self.fileWatcher.removePaths(paths)
+        self.layers = {}
+        self.signatures = {}
+        self.pending = set()
+        self.running = {}
+        if self.worker is None:
+            return
+        self.worker.currentRequestId = 0
+        self.thread.quit()
+        self.thread.wait()
+        self.worker.close()
+        self.thread = None
+        self.worker = None
+
+    def signature(self, path):
+        st = os.stat(path)
+        return st.st_size, st.st_mtime
+
+    def watch(self, layerId, vrtPath, outPath=None):
+        """Watch source files of the VRT file of a layer."""
+        sourcePaths = [path for path in vrtSourcePaths(vrtPath)
+                       if os.path.exists(path)]
+        self.layers[layerId] = (vrtPath, outPath, sourcePaths)
+        newPaths = [path for path in sourcePaths
+                    if path not in self.signatures]
+        for path in newPaths:
+            self.signatures[path] = self.signature(path)
+            self.fileWatcher.addPath(path)
+        if newPaths:
+            # Sources are hashed by the worker, before any later refresh
+            self.startWorker()
+            self.digestsRequested.emit(newPaths)
+
+    def unwatch(self, layerId):
+        if self.layers.pop(layerId, None) is None:
+            return
+        watched = set(path for vrtPath, outPath, sourcePaths
+                      in self.layers.itervalues()
+                      for path in sourcePaths)
+        removed = [path for path in self.signatures
+                   if path not in watched]
+        for path in removed:
+            del self.signatures[path]
+            self.pending.discard(path)
+            self.fileWatcher.removePath(path)
+        if removed and self.worker is not None:
+            self.digestsDropped.emit(removed)
+
+    def onFileChanged(self, path):
+        self.pending.add(path)
+        self.timer.start()
+
+    def hasChanged(self, path):
+        """Tell whether size or modification time of path changed since
+        last check, content is compared by the worker.
+        """
+        signature = self.signature(path)
+        if signature == self.signatures[path]:
+            return False
+        self.signatures[path] = signature
+        return True
+
+    def processChanges(self):
+        """Refresh layers of changed sources, in one worker request."""
+        changed = set()
+        for path in list(self.pending):
+            if path not in self.signatures:
+                self.pending.discard(path)
+                continue
+            if not os.path.exists(path):
+                # Replaced file, wait for the new one
+                continue
+            self.pending.discard(path)
+            # Files replaced by a new one are no longer watched
+            if path not in self.fileWatcher.files():
+                self.fileWatcher.addPath(path)
+            try:
+                if self.hasChanged(path):
+                    changed.add(path)
+            except (IOError, OSError):
+                self.pending.add(path)
+        if self.pending:
+            self.timer.start()
+
+        if not changed:
+            return
+
+        # A new request cancels the running one, its layers are included
+        entries = dict(self.running)
+        for layerId, (vrtPath, outPath, sourcePaths) in self.layers.items():
+            if not changed.intersection(sourcePaths):
+                continue
+            entry = entries.setdefault(vrtPath, {'vrtPath': vrtPath,
+                                                 'outPath': outPath,
+                                                 'sourcePaths': sourcePaths,
+                                                 'layerIds': []})
+            if layerId not in entry['layerIds']:
+                entry['layerIds'].append(layerId)
+            if outPath is not None:
+                entry['outPath'] = outPath
+        if not entries:
+            return
+
+        self.running = entries
+        self.startWorker()
+        self.requestId = nextRequestId()
+        self.worker.currentRequestId = self.requestId
+        # Entries are copied, the worker thread must not see later changes
+        copies = [dict(entry,
+                       layerIds=list(entry['layerIds']),
+                       sourcePaths=list(entry['sourcePaths']))
+                  for entry in entries.values()]
+        self.refreshRequested.emit(self.requestId,
+                                   copies,
+                                   self.inferenceRows)
+
+    @QtCore.pyqtSlot(int, object)
+    def onVrtsRefreshed(self, requestId, results):
+        if requestId != self.requestId:
+            return
+        self.running = {}
+        # Empty when sources were only touched
+        if results:
+            self.layersRefreshed.emit(results)
+
+    @QtCore.pyqtSlot(int, object)
+    def onFailed(self, requestId, msg):
+        if requestId != self.requestId:
+            return
+        results = [dict(entry, mismatches=[], error=msg)
+                   for entry in self.running.values()]
+        self.running = {}
+        self.layersRefreshed.emit(results)
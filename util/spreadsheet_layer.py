@@ -0,0 +1,701 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import copy
+import json
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+from xml.sax.saxutils import escape
+from osgeo import ogr
+
+from SpreadsheetLayers.util.csv_util import csvOpenOptions, isCsv, sniffCsv
+from SpreadsheetLayers.util.gdal_util import (dataSourceDriverName,
+                                              openDataSource,
+                                              openOptionsSupported,
+                                              spreadsheetOpenOptions)
+from SpreadsheetLayers.util.ogr_util import (Cancelled,
+                                             countNonEmptyRows,
+                                             readFields)
+from SpreadsheetLayers.util.type_inference import inferFieldTypes, mergeTypes
+
+
+# Written in the comment holding the options of generated VRT layers
+METADATA_PREFIX = u'SpreadsheetLayers '
+METADATA_VERSION = 1
+
+
+def _attribute(value):
+    return escape(value, {'"': '&quot;'})
+
+
+def metadataComment(metadata):
+    '''Return an XML comment holding metadata as JSON, see vrt_config.'''
+    text = json.dumps(metadata, sort_keys=True)
+    # "--" is not allowed in comments, it can only appear in JSON strings
+    return u'<!--{}{}-->'.format(METADATA_PREFIX,
+                                 text.replace('--', '-\\u002d'))
+
+
+def fieldTypeFromName(typeName):
+    '''Return OGR field type from its name as written in VRT files.'''
+    for constant in dir(ogr):
+        if constant.startswith('OFT'):
+            fieldType = getattr(ogr, constant)
+            if ogr.GetFieldTypeName(fieldType) == typeName:
+                return fieldType
+    raise ValueError(u'Unknown field type {}'.format(typeName))
+
+
+FILTER_TOKEN_RE = re.compile(r"""('(?:[^']|'')*')"""   # string literal
+                             r'|("(?:[^"]|"")*")'       # quoted identifier
+                             r'|([^\W\d]\w*)'           # identifier
+                             r'(\s*\()?',               # function call
+                             re.UNICODE)
+
+# SQLite keywords of expressions, they never name a field unless quoted
+FILTER_KEYWORDS = frozenset([
+    'all', 'and', 'as', 'asc', 'between', 'by', 'case', 'cast', 'collate',
+    'current_date', 'current_time', 'current_timestamp', 'desc', 'distinct',
+    'else', 'end', 'escape', 'exists', 'from', 'glob', 'group', 'having',
+    'in', 'is', 'isnull', 'like', 'limit', 'match', 'not', 'notnull', 'null',
+    'offset', 'or', 'order', 'regexp', 'select', 'then', 'when', 'where'])
+
+
+def translateFilter(expression, fields):
+    '''Return SQL expression with field names replaced by source names.
+
+    Identifiers, quoted or not, matching a field name case insensitively
+    are replaced by the quoted source field name. String literals, function
+    names and SQL keywords, see FILTER_KEYWORDS, are left untouched, fields
+    named like them have to be quoted.
+    '''
+    sources = {}
+    for field in fields:
+        sources.setdefault(field['name'].lower(), field['src'])
+
+    def replace(match):
+        literal, quoted, identifier, call = match.groups()
+        if literal is not None:
+            return literal
+        if quoted is not None:
+            name = quoted[1:-1].replace('""', '"')
+        elif call is not None or identifier.lower() in FILTER_KEYWORDS:
+            return match.group(0)
+        else:
+            name = identifier
+        src = sources.get(name.lower())
+        if src is None:
+            return match.group(0)
+        return u'"{}"'.format(src.replace('"', '""'))
+
+    return FILTER_TOKEN_RE.sub(replace, expression)
+
+
+class SpreadsheetLayerSpec(object):
+    '''SpreadsheetLayerSpec holds the options of a spreadsheet layer.
+
+    Options are the ones of the dialog: source file and sheet, header line,
+    lines to ignore, end of file detection, point geometry from x and y
+    fields with an optional CRS, and fields.
+    fields is a list of dicts with src, name and type keys as returned by
+    ogr_util.readFields, None to read them from the sheet. Fields with a
+    False include key are left out of the layer. fieldTypes maps field
+    names to OGR type names, overriding read or inferred types, and fields
+    named in excludedFields are left out of the layer.
+    filter is an SQLite expression on field names, only data rows matching
+    it are part of the layer.
+    csvOptions is the csv_util.sniffCsv() dict of CSV files, None for
+    spreadsheets. Files are read without header line, the header line
+    being handled by the driver in the final layer when possible, see
+    SpreadsheetLayerBuilder.nativeHeader().
+    '''
+
+    def __init__(self, filePath, sheet=None, layerName=None, header=False,
+                 linesToIgnore=0, eofDetection=False, xField=None,
+                 yField=None, crs=None, showGeometryFields=False,
+                 fields=None, fieldTypes=None, excludedFields=None,
+                 filter=None, csvOptions=None):
+        self.filePath = filePath
+        self.sheet = sheet
+        self.layerName = layerName
+        self.header = header
+        self.linesToIgnore = linesToIgnore
+        self.eofDetection = eofDetection
+        self.xField = xField
+        self.yField = yField
+        self.crs = crs
+        self.showGeometryFields = showGeometryFields
+        self.fields = fields
+        self.fieldTypes = fieldTypes or {}
+        self.excludedFields = excludedFields or []
+        self.filter = filter
+        self.csvOptions = csvOptions
+
+    def offset(self):
+        offset = self.linesToIgnore
+        if self.header:
+            offset += 1
+        return offset
+
+    def geometry(self):
+        return bool(self.xField and self.yField)
+
+    def vrtPath(self):
+        return u'{}.vrt'.format(self.filePath)
+
+    def encoding(self):
+        """Return encoding of string values of the source file."""
+        if self.csvOptions is not None:
+            return self.csvOptions['encoding']
+        return 'UTF-8'
+
+    def openOptions(self, header=False):
+        '''Return driver open options of the source file, None if none apply.
+
+        The plugin reads files without header line, header is set for final
+        layers whose header line is read by the driver.
+        '''
+        if self.csvOptions is not None:
+            return csvOpenOptions(self.csvOptions, header)
+        return spreadsheetOpenOptions(self.filePath, header)
+
+    def open(self):
+        '''Open source file with OGR, as read by the plugin.
+
+        CSV options are sniffed from the file when not set.
+        '''
+        if (self.csvOptions is None
+            and isCsv(self.filePath)
+            and openOptionsSupported()
+        ):
+            self.csvOptions = sniffCsv(self.filePath)
+        return openDataSource(self.filePath, self.openOptions())
+
+
+class SpreadsheetLayerBuilder(object):
+    '''SpreadsheetLayerBuilder writes the VRT file of a spreadsheet layer.
+
+    featureCount and nonEmptyRows are the number of features of the sheet
+    and the number of rows up to the last non empty one. When they are not
+    given, prepare() reads them from the file, along with the sheet, layer
+    name and fields left unset in spec.
+    '''
+
+    def __init__(self, spec, featureCount=None, nonEmptyRows=None):
+        self.spec = spec
+        self.featureCount = featureCount
+        self.nonEmptyRows = nonEmptyRows
+
+    def prepare(self, dataSource=None, inferenceRows=-1, progress=None):
+        '''Read from file what spec and counts do not provide.
+
+        Field types are inferred from the inferenceRows first data rows, the
+        whole sheet for 0, or kept as detected by GDAL for -1.
+        '''
+        spec = self.spec
+        if dataSource is None:
+            dataSource = spec.open()
+        if dataSource is None:
+            raise IOError(u'Could not open {}'.format(spec.filePath))
+
+        if spec.sheet is None:
+            layer = dataSource.GetLayer(0)
+            if layer is not None:
+                spec.sheet = layer.GetName().decode('UTF-8')
+        else:
+            layer = dataSource.GetLayerByName(spec.sheet.encode('UTF-8'))
+        if layer is None:
+            raise ValueError(u'Could not open sheet {}'.format(spec.sheet))
+
+        if spec.layerName is None:
+            spec.layerName = os.path.splitext(
+                os.path.basename(spec.filePath))[0]
+
+        if self.featureCount is None:
+            self.featureCount = layer.GetFeatureCount()
+
+        if self.nonEmptyRows is None:
+            if spec.eofDetection:
+                self.nonEmptyRows = countNonEmptyRows(
+                    layer,
+                    progress,
+                    driverName=dataSourceDriverName(dataSource))
+            else:
+                self.nonEmptyRows = self.featureCount
+
+        if spec.fields is not None:
+            # Fields given for another sheet with the same layout
+            layerDefn = layer.GetLayerDefn()
+            spec.fields = [field for field in spec.fields
+                           if layerDefn.GetFieldIndex(
+                               field['src'].encode('UTF-8')) != -1]
+        else:
+            spec.fields = readFields(layer,
+                                     spec.offset(),
+                                     spec.header,
+                                     spec.encoding())
+            if inferenceRows >= 0:
+                types = inferFieldTypes(layer,
+                                        spec.offset(),
+                                        inferenceRows or None,
+                                        progress=progress,
+                                        encoding=spec.encoding())
+                for field, fieldType in zip(spec.fields, types):
+                    field['type'] = fieldType
+
+    def limit(self):
+        return self.nonEmptyRows - self.spec.offset()
+
+    def nativeHeader(self, sample=False):
+        '''Tell whether the driver reads field names from header line.
+
+        This is the case for final layers of files whose driver has a
+        HEADERS open option, CSV, ODS and XLSX, with a header line and no
+        ignored lines, when header names are unique and not empty, as the
+        driver would change them otherwise. Source fields are then named
+        after the header line, and the layer needs no SQL offset.
+        CSV files which are not UTF-8 are excluded, as the driver does not
+        recode header names, so they would not match VRT source names.
+        '''
+        spec = self.spec
+        if (sample
+            or spec.openOptions() is None
+            or spec.encoding().upper() not in ('UTF-8', 'UTF8')
+            or not spec.header
+            or spec.linesToIgnore > 0
+        ):
+            return False
+        names = [field['name'].lower() for field in spec.fields or []]
+        return all(names) and len(set(names)) == len(names)
+
+    def sqlOffset(self, sample=False):
+        """Return number of lines to skip with SQL."""
+        if self.nativeHeader(sample):
+            return self.spec.offset() - 1
+        return self.spec.offset()
+
+    def sourceName(self, src, sample=False):
+        """Return name of source field src in the source layer."""
+        if self.nativeHeader(sample):
+            for field in self.spec.fields:
+                if field['src'] == src:
+                    return field['name']
+        return src
+
+    def sql(self, columns=None, sample=False):
+        '''Return SQL query reading data rows of columns, all by default.
+
+        Rows are filtered after header and ignored lines are skipped.
+        '''
+        if columns is None:
+            projection = '*'
+        else:
+            projection = u', '.join(u'"{}"'.format(column.replace('"', '""'))
+                                    for column in columns)
+        sql = (u'SELECT {} FROM \'{}\''
+               u' LIMIT {} OFFSET {}'
+               ).format(projection if not self.spec.filter else '*',
+                        self.spec.sheet,
+                        self.limit(),
+                        self.sqlOffset(sample))
+        if self.spec.filter:
+            sql = u'SELECT {} FROM ({}) WHERE ({})'.format(
+                projection, sql, self.sourceFilter(sample))
+        return sql
+
+    def sourceFilter(self, sample=False):
+        return translateFilter(self.spec.filter, self.fields(sample))
+
+    def countSql(self):
+        '''Return SQL query counting data rows matching the filter.
+
+        The query is run on the source datasource as opened by the plugin,
+        like sample VRTs.
+        '''
+        return u'SELECT COUNT(*) FROM ({})'.format(self.sql(sample=True))
+
+    def fields(self, sample=False):
+        '''Return fields with types overridden by spec.fieldTypes.
+
+        Returned fields have an include key telling whether they are part
+        of the layer, and src is the name of the field in the source layer,
+        see nativeHeader().
+        '''
+        fields = []
+        for field in self.spec.fields or []:
+            field = dict(field)
+            field['src'] = self.sourceName(field['src'], sample)
+            typeName = self.spec.fieldTypes.get(field['name'])
+            if typeName is not None:
+                field['type'] = fieldTypeFromName(typeName)
+            field['include'] = (
+                field.get('include', True)
+                and field['name'] not in self.spec.excludedFields)
+            fields.append(field)
+        return fields
+
+    def projection(self):
+        '''Return source fields to read, None when all fields are included.
+
+        Excluded x and y fields are still read to build geometries.
+        '''
+        fields = self.fields()
+        if all(field['include'] for field in fields):
+            return None
+        geometryFields = ()
+        if self.spec.geometry():
+            geometryFields = (self.sourceName(self.spec.xField),
+                              self.sourceName(self.spec.yField))
+        return [field['src'] for field in fields
+                if field['include'] or field['src'] in geometryFields]
+
+    def layerLines(self, sample=False, withoutFields=False, vrtDirectory=None,
+                   indent=u'    '):
+        '''Return lines of the OGRVRTLayer element of the layer.
+
+        Source file path is written relative to vrtDirectory when given, or
+        as a file of the VRT directory. Excluded fields are not read, except
+        by samples which keep all fields to display them.
+        '''
+        spec = self.spec
+        geometry = spec.geometry() and not sample
+        inner = indent + u'    '
+        projection = None if sample else self.projection()
+
+        lines = [indent + u'<OGRVRTLayer name="{}">'.format(
+            _attribute(spec.layerName))]
+
+        if sample:
+            # Reuse datasource already opened in shared mode by the worker
+            lines.append(inner + u'<SrcDataSource shared="1">{}'
+                         u'</SrcDataSource>'.format(escape(spec.filePath)))
+        else:
+            if vrtDirectory is None:
+                path = os.path.basename(spec.filePath)
+            else:
+                path = os.path.relpath(spec.filePath, vrtDirectory)
+            lines.append(inner + u'<SrcDataSource relativeToVRT="1">{}'
+                         u'</SrcDataSource>'.format(escape(path)))
+
+        openOptions = spec.openOptions(self.nativeHeader(sample))
+        if openOptions is not None:
+            lines.append(inner + u'<OpenOptions>')
+            for option in openOptions:
+                key, value = option.split('=', 1)
+                lines.append(inner + u'    <OOI key="{}">{}</OOI>'
+                             .format(key, value))
+            lines.append(inner + u'</OpenOptions>')
+
+        if not sample:
+            lines.append(inner + metadataComment(self.metadata()))
+
+        # Excluded fields are left out of Field elements, the projection
+        # alone is not worth an SQL layer
+        if (self.sqlOffset(sample) > 0
+            or self.nonEmptyRows != self.featureCount
+            or spec.filter
+        ):
+            lines.append(inner + u'<SrcSql dialect="sqlite">{}</SrcSql>'
+                         .format(escape(self.sql(projection, sample))))
+        else:
+            lines.append(inner + u'<SrcLayer>{}</SrcLayer>'
+                         .format(escape(spec.sheet)))
+
+        xField = self.sourceName(spec.xField, sample)
+        yField = self.sourceName(spec.yField, sample)
+        if not withoutFields:
+            for field in self.fields(sample):
+                if not sample and not field['include']:
+                    continue
+                if geometry and not spec.showGeometryFields:
+                    if field['src'] in (xField, yField):
+                        continue
+                lines.append(inner + u'<Field name="{}" src="{}" type="{}"/>'
+                             .format(_attribute(field['name']),
+                                     _attribute(field['src']),
+                                     ogr.GetFieldTypeName(field['type'])))
+
+        if geometry:
+            lines.extend(inner + line for line in geometryLines(spec))
+            lines.append(inner + u'<GeometryField encoding="PointFromColumns"'
+                         u' x="{}" y="{}"/>'.format(_attribute(xField),
+                                                    _attribute(yField)))
+
+        lines.append(indent + u'</OGRVRTLayer>')
+        return lines
+
+    def vrt(self, sample=False, withoutFields=False):
+        '''Return VRT file content as an UTF-8 encoded string.
+
+        Sample VRTs use the absolute path of a shared source datasource and
+        have no geometry.
+        '''
+        return vrtContent(self.layerLines(sample, withoutFields))
+
+    def typeMismatches(self, layer, inferenceRows=0, progress=None):
+        '''Return names of included fields whose values exceed their type.
+
+        Types are inferred from the inferenceRows first data rows of layer,
+        read without header line, the whole sheet for 0. A field mismatches
+        when its type can't hold the values of the inferred type, like an
+        Integer field with decimal or text values.
+        '''
+        types = inferFieldTypes(layer,
+                                self.spec.offset(),
+                                inferenceRows or None,
+                                progress=progress,
+                                encoding=self.spec.encoding())
+        layerDefn = layer.GetLayerDefn()
+        names = []
+        for field in self.fields(sample=True):
+            if not field['include']:
+                continue
+            index = layerDefn.GetFieldIndex(field['src'].encode('UTF-8'))
+            if index == -1 or types[index] is None:
+                continue
+            if mergeTypes(field['type'], types[index]) != field['type']:
+                names.append(field['name'])
+        return names
+
+    def metadata(self):
+        '''Return options of the layer as a JSON serializable dict.
+
+        They are the spec options, with fields named as read by the plugin
+        and their final type and inclusion, written in VRT files so the
+        dialog restores them, see vrt_config.readVrtConfig().
+        '''
+        spec = self.spec
+        fields = [{'src': field['src'],
+                   'name': field['name'],
+                   'type': ogr.GetFieldTypeName(field['type']),
+                   'include': field['include']}
+                  for field in self.fields(sample=True)]
+        return {'version': METADATA_VERSION,
+                'sheet': spec.sheet,
+                'header': spec.header,
+                'linesToIgnore': spec.linesToIgnore,
+                'eofDetection': spec.eofDetection,
+                'xField': spec.xField,
+                'yField': spec.yField,
+                'crs': spec.crs,
+                'showGeometryFields': spec.showGeometryFields,
+                'filter': spec.filter,
+                'csvOptions': spec.csvOptions,
+                'fields': fields}
+
+    def sampleSource(self):
+        '''Return what the sample VRT reads, for readers other than OGR.
+
+        Return a dict with sheet, offset, limit and fields keys, or None
+        when rows are filtered, as filters need the SQLite dialect.
+        '''
+        if self.spec.filter:
+            return None
+        return {'sheet': self.spec.sheet,
+                'offset': self.spec.offset(),
+                'limit': self.limit(),
+                'fields': self.fields()}
+
+    def write(self, vrtPath=None):
+        '''Write VRT file, next to the spreadsheet file by default.'''
+        if vrtPath is None:
+            vrtPath = self.spec.vrtPath()
+        with open(vrtPath, 'wb') as f:
+            f.write(self.vrt())
+        return vrtPath
+
+
+def geometryLines(spec):
+    lines = [u'<GeometryType>wkbPoint</GeometryType>']
+    if spec.crs:
+        lines.append(u'<LayerSRS>{}</LayerSRS>'.format(escape(spec.crs)))
+    return lines
+
+
+def vrtContent(layerLines):
+    lines = [u'<?xml version="1.0" encoding="UTF-8"?>',
+             u'<OGRVRTDataSource>']
+    lines.extend(layerLines)
+    lines.append(u'</OGRVRTDataSource>')
+    return (u'\n'.join(lines) + u'\n').encode('UTF-8')
+
+
+def sheetVrtPath(filePath, sheet):
+    """Return path of the VRT file of one sheet among all sheets of a file."""
+    return u'{}.{}.vrt'.format(filePath, sheet)
+
+
+def fileBuilders(spec, allSheets=False, inferenceRows=-1, progress=None):
+    '''Return prepared builders for sheets of one spreadsheet file.
+
+    With allSheets, every sheet gets a builder with spec options and a
+    layer named after the sheet, prefixed by spec.layerName when set.
+    Otherwise only spec.sheet is prepared. Sheets are read from a single
+    datasource.
+    Return a list of (builder, error) tuples, one by sheet, builders which
+    could not be prepared coming with an error message.
+    '''
+    dataSource = spec.open()
+    if dataSource is None:
+        return [(SpreadsheetLayerBuilder(spec),
+                 u'Could not open {}'.format(spec.filePath))]
+
+    if allSheets:
+        sheets = [dataSource.GetLayer(i).GetName().decode('UTF-8')
+                  for i in xrange(0, dataSource.GetLayerCount())]
+    else:
+        sheets = [spec.sheet]
+
+    builders = []
+    for sheet in sheets:
+        sheetSpec = copy.deepcopy(spec)
+        if allSheets:
+            sheetSpec.sheet = sheet
+            sheetSpec.layerName = sheet
+            if spec.layerName:
+                sheetSpec.layerName = u'{} - {}'.format(spec.layerName, sheet)
+        builder = SpreadsheetLayerBuilder(sheetSpec)
+        try:
+            builder.prepare(dataSource, inferenceRows, progress)
+        except Cancelled:
+            raise
+        except Exception as e:
+            builders.append((builder, unicode(e)))
+            continue
+        builders.append((builder, None))
+    return builders
+
+
+def writeFileVrts(spec, allSheets=False, inferenceRows=-1, progress=None):
+    '''Write VRT files of one spreadsheet file, see fileBuilders.
+
+    Sheets are written to spec.vrtPath(), or to sheetVrtPath() with
+    allSheets.
+    Return a list of (spec, vrtPath, error) tuples, one by sheet.
+    '''
+    results = []
+    for builder, error in fileBuilders(spec, allSheets, inferenceRows,
+                                       progress):
+        vrtPath = None
+        if error is None:
+            vrtPath = spec.vrtPath()
+            if allSheets:
+                vrtPath = sheetVrtPath(spec.filePath, builder.spec.sheet)
+            try:
+                builder.write(vrtPath)
+            except (IOError, OSError) as e:
+                error = unicode(e)
+        if error is not None:
+            vrtPath = None
+        results.append((builder.spec, vrtPath, error))
+    return results
+
+
+def _runConcurrently(function, specs, jobs, progress):
+    '''Return concatenated results of function(spec, check) for all specs.
+
+    Specs are processed concurrently by jobs threads, the number of CPUs by
+    default. progress is called from the calling thread with the number of
+    specs done and the number of specs, and may raise Cancelled to stop
+    all threads: check, to be used as progress callback by function, then
+    raises Cancelled.
+    '''
+    if jobs is None:
+        jobs = multiprocessing.cpu_count()
+    jobs = max(1, min(jobs, len(specs)))
+    cancelled = threading.Event()
+
+    def check(value, maximum):
+        if cancelled.is_set():
+            raise Cancelled()
+
+    pool = ThreadPool(jobs)
+    results = []
+    try:
+        iterator = pool.imap_unordered(lambda spec: function(spec, check),
+                                       specs)
+        done = 0
+        while done < len(specs):
+            if progress is not None:
+                progress(done, len(specs))
+            try:
+                results.extend(iterator.next(timeout=0.1))
+            except multiprocessing.TimeoutError:
+                continue
+            done += 1
+    except Cancelled:
+        cancelled.set()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+def writeVrts(specs, allSheets=False, inferenceRows=-1, jobs=None,
+              progress=None):
+    '''Write VRT files of several spreadsheet files, see writeFileVrts.
+
+    Files are processed concurrently, see _runConcurrently.
+    Return the list of (spec, vrtPath, error) tuples of all sheets.
+    '''
+    return _runConcurrently(
+        lambda spec, check: writeFileVrts(spec, allSheets, inferenceRows,
+                                          check),
+        specs, jobs, progress)
+
+
+def writeUnionVrt(specs, vrtPath, layerName, allSheets=False,
+                  sourceField=None, inferenceRows=-1, jobs=None,
+                  progress=None):
+    '''Write a single VRT file merging sheets of several files.
+
+    Sheets, chosen as in fileBuilders, are merged in an OGRVRTUnionLayer
+    named layerName with the union of their fields. When sourceField is
+    set, this field of the merged layer holds the name of the sheet layer
+    each feature comes from. Files are processed concurrently, see
+    _runConcurrently.
+    Return a list of (spec, vrtPath, error) tuples: the merged layer spec
+    and written path, then sheets which could not be read.
+    '''
+    results = _runConcurrently(
+        lambda spec, check: fileBuilders(spec, allSheets, inferenceRows,
+                                         check),
+        specs, jobs, progress)
+    builders = [builder for builder, error in results if error is None]
+    errors = [(builder.spec, None, error)
+              for builder, error in results if error is not None]
+    if len(builders) == 0:
+        return errors
+
+    # Keep sheets order as given, whatever files processing order
+    order = [spec.filePath for spec in specs]
+    builders.sort(key=lambda builder: order.index(builder.spec.filePath))
+
+    unionSpec = copy.copy(specs[0])
+    unionSpec.sheet = None
+    unionSpec.layerName = layerName
+    unionSpec.fields = None
+
+    indent = u'        '
+    vrtDirectory = os.path.dirname(vrtPath)
+    lines = [u'    <OGRVRTUnionLayer name="{}">'.format(_attribute(layerName))]
+    for builder in builders:
+        lines.extend(builder.layerLines(vrtDirectory=vrtDirectory,
+                                        indent=indent))
+    if sourceField:
+        lines.append(indent + u'<SourceLayerFieldName>{}'
+                     u'</SourceLayerFieldName>'.format(escape(sourceField)))
+    lines.append(indent + u'<FieldStrategy>Union</FieldStrategy>')
+    if unionSpec.geometry():
+        lines.extend(indent + line for line in geometryLines(unionSpec))
+    lines.append(u'    </OGRVRTUnionLayer>')
+
+    try:
+        with open(vrtPath, 'wb') as f:
+            f.write(vrtContent(lines))
+    except (IOError, OSError) as e:
+        return [(unionSpec, None, unicode(e))] + errors
+    return [(unionSpec, vrtPath, None)] + errors
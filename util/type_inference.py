@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+
+import re
+import datetime
+from osgeo import ogr
+
+
+# OFTInteger64 is only available with GDAL >= 2.0
+OFTInteger64 = getattr(ogr, 'OFTInteger64', None)
+
+INT32_MIN = -2 ** 31
+INT32_MAX = 2 ** 31 - 1
+
+NUMERIC_TYPES = [t for t in (ogr.OFTInteger, OFTInteger64, ogr.OFTReal)
+                 if t is not None]
+INFERABLE_TYPES = NUMERIC_TYPES + [ogr.OFTString,
+                                   ogr.OFTDate,
+                                   ogr.OFTDateTime]
+
+
+def _allLines(pattern):
+    '''Compile a regex matching a text whose every line matches pattern.'''
+    return re.compile(r'\A{0}(?:\n{0})*\Z'.format(pattern), re.UNICODE)
+
+
+DATE_PATTERN = r'\d{4}[-/]\d{1,2}[-/]\d{1,2}'
+
+INTEGER_RE = _allLines(r'[+-]?\d+')
+REAL_RE = _allLines(r'[+-]?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?')
+DATE_RE = _allLines(DATE_PATTERN)
+DATETIME_RE = _allLines(DATE_PATTERN +
+                        r'(?:[T ]\d{1,2}:\d{2}(?::\d{2}(?:\.\d+)?)?'
+                        r'(?:Z|[+-]\d{2}(?::?\d{2})?)?)?')
+
+
+def integerType(minimum, maximum):
+    '''Return the smallest OGR integer type holding values in range.'''
+    if minimum >= INT32_MIN and maximum <= INT32_MAX:
+        return ogr.OFTInteger
+    if OFTInteger64 is not None:
+        return OFTInteger64
+    return ogr.OFTReal
+
+
+def mergeTypes(a, b):
+    '''Return the narrowest OGR type able to store values of types a and b.
+
+    None means no value at all.
+    '''
+    if a is None:
+        return b
+    if b is None or a == b:
+        return a
+    if a in NUMERIC_TYPES and b in NUMERIC_TYPES:
+        return max(a, b, key=NUMERIC_TYPES.index)
+    if set([a, b]) == set([ogr.OFTDate, ogr.OFTDateTime]):
+        return ogr.OFTDateTime
+    return ogr.OFTString
+
+
+def batchType(values, sourceType):
+    '''Return the narrowest OGR type for a batch of non null values.
+
+    values were read from a field of type sourceType: numbers for numeric
+    fields, stripped unicode strings for String fields, and anything for
+    Date and DateTime fields.
+    String values are joined and tested at once against one regex per
+    candidate type.
+    '''
+    if len(values) == 0:
+        return None
+
+    if sourceType in (ogr.OFTInteger, OFTInteger64):
+        return integerType(min(values), max(values))
+
+    if sourceType == ogr.OFTReal:
+        if all(map(float.is_integer, values)):
+            return integerType(min(values), max(values))
+        return ogr.OFTReal
+
+    if sourceType != ogr.OFTString:
+        return sourceType
+
+    text = u'\n'.join(values)
+    if text.count(u'\n') != len(values) - 1:
+        # Multiline values
+        return ogr.OFTString
+    if INTEGER_RE.match(text):
+        integers = map(int, values)
+        return integerType(min(integers), max(integers))
+    if REAL_RE.match(text):
+        return ogr.OFTReal
+    if DATE_RE.match(text):
+        return ogr.OFTDate
+    if DATETIME_RE.match(text):
+        return ogr.OFTDateTime
+    return ogr.OFTString
+
+
+def _valueGetter(sourceType, encoding='UTF-8'):
+    if sourceType == ogr.OFTInteger:
+        return lambda feature, iField: feature.GetFieldAsInteger(iField)
+    if sourceType == OFTInteger64:
+        return lambda feature, iField: feature.GetFieldAsInteger64(iField)
+    if sourceType == ogr.OFTReal:
+        return lambda feature, iField: feature.GetFieldAsDouble(iField)
+    if sourceType == ogr.OFTString:
+        return lambda feature, iField: (
+            feature.GetFieldAsString(iField).decode(encoding,
+                                                    'replace').strip())
+    return lambda feature, iField: True
+
+
+def inferFieldTypes(layer, offset=0, maxRowCount=None,
+                    batchSize=10000, progress=None, encoding='UTF-8'):
+    '''Propose an OGR field type for each field of layer.
+
+    Data rows are read from offset, so header and ignored lines do not
+    take part in the detection, up to maxRowCount rows or up to the end of
+    layer. Values are classified by batches of batchSize rows, and fields
+    are no longer decoded once they are known to be String.
+    Fields without any value, and fields of types which can't be inferred
+    (lists, binary, time), keep the type detected by the driver.
+    String values are decoded from encoding, invalid bytes being replaced.
+    '''
+    layerDefn = layer.GetLayerDefn()
+    fieldCount = layerDefn.GetFieldCount()
+    names = []
+    sourceTypes = []
+    for iField in xrange(0, fieldCount):
+        fieldDefn = layerDefn.GetFieldDefn(iField)
+        names.append(fieldDefn.GetNameRef())
+        sourceTypes.append(fieldDefn.GetType())
+    getters = [_valueGetter(t, encoding) for t in sourceTypes]
+
+    types = [None] * fieldCount
+    active = [i for i in xrange(0, fieldCount)
+              if sourceTypes[i] in INFERABLE_TYPES]
+
+    rows = max(0, layer.GetFeatureCount() - offset)
+    if maxRowCount is not None:
+        rows = min(rows, maxRowCount)
+
+    row = 0
+    try:
+        layer.SetNextByIndex(offset)
+        while row < rows and len(active) > 0:
+            # Only decode fields with a type still to narrow
+            layer.SetIgnoredFields([names[i] for i in xrange(0, fieldCount)
+                                    if i not in active])
+            batch = [[] for i in active]
+            for n in xrange(0, min(batchSize, rows - row)):
+                if progress is not None:
+                    progress(row, rows)
+                feature = layer.GetNextFeature()
+                if feature is None:
+                    rows = row
+                    break
+                for values, iField in zip(batch, active):
+                    if feature.IsFieldSet(iField):
+                        value = getters[iField](feature, iField)
+                        if value != u'':
+                            values.append(value)
+                row += 1
+
+            for values, iField in zip(batch, active):
+                types[iField] = mergeTypes(types[iField],
+                                           batchType(values,
+                                                     sourceTypes[iField]))
+            active = [i for i in active if types[i] != ogr.OFTString]
+    finally:
+        layer.SetIgnoredFields([])
+
+    return [sourceTypes[i] if types[i] is None else types[i]
+            for i in xrange(0, fieldCount)]
+
+
+def _valueType(value):
+    '''Return the OGR type of a value read without OGR.'''
+    if isinstance(value, datetime.datetime):
+        return ogr.OFTDateTime
+    if isinstance(value, datetime.date):
+        return ogr.OFTDate
+    if isinstance(value, datetime.time):
+        return ogr.OFTTime
+    if isinstance(value, (int, long)):
+        return ogr.OFTInteger
+    if isinstance(value, float):
+        return ogr.OFTReal
+    return ogr.OFTString
+
+
+def inferValueTypes(rows, fieldCount, rowCount=None,
+                    batchSize=10000, progress=None):
+    '''Propose an OGR field type for each column of rows.
+
+    rows are lists of Python values, as read by xlsx_reader.XlsxReader.
+    Values of a batch are grouped by their own type, each group being
+    classified by batchType as values of an OGR field of that type, so a
+    column mixing numbers and numeric strings is still numeric. Columns
+    without any value are String, like GDAL does.
+    '''
+    types = [None] * fieldCount
+    active = range(0, fieldCount)
+    batch = [{} for i in active]
+
+    def mergeBatch():
+        for iField in active:
+            for sourceType, values in batch[iField].iteritems():
+                types[iField] = mergeTypes(types[iField],
+                                           batchType(values, sourceType))
+            batch[iField] = {}
+        return [i for i in active if types[i] != ogr.OFTString]
+
+    for row, values in enumerate(rows):
+        if len(active) == 0:
+            break
+        if progress is not None:
+            progress(row, rowCount or 0)
+        for iField in active:
+            value = values[iField]
+            if isinstance(value, basestring):
+                value = value.strip()
+                if value == u'':
+                    continue
+            elif value is None:
+                continue
+            batch[iField].setdefault(_valueType(value), []).append(value)
+        if (row + 1) % batchSize == 0:
+            active = mergeBatch()
+    mergeBatch()
+
+    return [ogr.OFTString if t is None else t for t in types]
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import copy
+import json
+import threading
+from xml.dom import minidom
+from xml.parsers.expat import ExpatError
+
+from SpreadsheetLayers.util.spreadsheet_layer import (METADATA_PREFIX,
+                                                      SpreadsheetLayerBuilder,
+                                                      SpreadsheetLayerSpec,
+                                                      fieldTypeFromName)
+
+
+class VrtConfigError(Exception):
+    '''Raised when a VRT file can't be read as a spreadsheet layer.'''
+
+
+# (vrtPath, size, mtime) -> (specs, union), used by the GUI and the worker
+# threads
+_cache = {}
+_cacheLock = threading.Lock()
+
+
+def _children(element, name=None):
+    return [node for node in element.childNodes
+            if node.nodeType == node.ELEMENT_NODE
+            and (name is None or node.tagName == name)]
+
+
+def _text(element):
+    return u''.join(node.data for node in element.childNodes
+                    if node.nodeType in (node.TEXT_NODE,
+                                         node.CDATA_SECTION_NODE))
+
+
+def readMetadata(layerElement):
+    '''Return metadata dict of an OGRVRTLayer element, None if it has none.
+
+    Metadata is the JSON comment written by the plugin, see
+    spreadsheet_layer.metadataComment().
+    '''
+    for node in layerElement.childNodes:
+        if (node.nodeType == node.COMMENT_NODE
+            and node.data.startswith(METADATA_PREFIX)
+        ):
+            return json.loads(node.data[len(METADATA_PREFIX):])
+    return None
+
+
+def specFromMetadata(filePath, layerName, metadata):
+    '''Return a SpreadsheetLayerSpec from VRT metadata.
+
+    Fields keep their type and inclusion, fields whose type is unknown to
+    the GDAL in use keep the type read from the file.
+    '''
+    fields = []
+    for field in metadata.get('fields') or []:
+        field = dict(field)
+        try:
+            field['type'] = fieldTypeFromName(field['type'])
+        except ValueError:
+            field['type'] = None
+        fields.append(field)
+    return SpreadsheetLayerSpec(
+        filePath,
+        sheet=metadata.get('sheet'),
+        layerName=layerName,
+        header=bool(metadata.get('header')),
+        linesToIgnore=metadata.get('linesToIgnore') or 0,
+        eofDetection=bool(metadata.get('eofDetection')),
+        xField=metadata.get('xField'),
+        yField=metadata.get('yField'),
+        crs=metadata.get('crs'),
+        showGeometryFields=bool(metadata.get('showGeometryFields')),
+        fields=fields,
+        filter=metadata.get('filter'),
+        csvOptions=metadata.get('csvOptions'))
+
+
+def legacySpec(filePath, layerName, layerElement):
+    '''Return a SpreadsheetLayerSpec from a VRT written without metadata.
+
+    Header comes from the Header comment of older plugin versions, lines to
+    ignore from the SQL offset. End of file detection is unknown and left
+    to None, as fields.
+    '''
+    spec = SpreadsheetLayerSpec(filePath, layerName=layerName)
+    spec.eofDetection = None
+    for node in layerElement.childNodes:
+        if node.nodeType == node.COMMENT_NODE:
+            if node.data.strip() == u'Header=True':
+                spec.header = True
+
+    offset = 0
+    for element in _children(layerElement, 'OpenOptions'):
+        for option in _children(element, 'OOI'):
+            if (option.getAttribute('key') == 'HEADERS'
+                and _text(option) in ('YES', 'FORCE')
+            ):
+                # Header line read by the driver is not in the offset
+                offset += 1
+    for element in _children(layerElement, 'SrcLayer'):
+        spec.sheet = _text(element)
+    for element in _children(layerElement, 'SrcSql'):
+        sql = _text(element)
+        match = re.search(r"FROM '(.+?)'", sql)
+        if match:
+            spec.sheet = match.group(1)
+        match = re.search(r'OFFSET (\d+)', sql)
+        if match:
+            offset += int(match.group(1))
+    spec.linesToIgnore = max(0, offset - (1 if spec.header else 0))
+
+    if _children(layerElement, 'GeometryType'):
+        for element in _children(layerElement, 'GeometryField'):
+            spec.xField = element.getAttribute('x')
+            spec.yField = element.getAttribute('y')
+    for element in _children(layerElement, 'LayerSRS'):
+        spec.crs = _text(element)
+    return spec
+
+
+def parseVrtConfig(vrtPath):
+    '''Parse the spreadsheet layers of a VRT file, see readVrtLayers().'''
+    try:
+        document = minidom.parse(vrtPath)
+    except (ExpatError, IOError) as e:
+        raise VrtConfigError(u'Could not read {}: {}'.format(vrtPath, e))
+    root = document.documentElement
+    layers = []
+    union = False
+    if root.tagName == 'OGRVRTDataSource':
+        layers = _children(root, 'OGRVRTLayer')
+        if not layers:
+            # Sheets merged by spreadsheet_layer.writeUnionVrt()
+            for element in _children(root, 'OGRVRTUnionLayer'):
+                layers = _children(element, 'OGRVRTLayer')
+                union = True
+                break
+    if not layers:
+        raise VrtConfigError(u'{} has no VRT layer'.format(vrtPath))
+    if not union:
+        layers = layers[:1]
+    return [parseVrtLayer(vrtPath, element) for element in layers], union
+
+
+def parseVrtLayer(vrtPath, layerElement):
+    '''Return a SpreadsheetLayerSpec from an OGRVRTLayer element.'''
+    layerName = layerElement.getAttribute('name')
+
+    filePath = None
+    for element in _children(layerElement, 'SrcDataSource'):
+        filePath = _text(element)
+        if element.getAttribute('relativeToVRT') == '1':
+            filePath = os.path.join(os.path.dirname(vrtPath), filePath)
+
+    try:
+        metadata = readMetadata(layerElement)
+    except ValueError as e:
+        raise VrtConfigError(u'Invalid metadata in {}: {}'.format(vrtPath, e))
+    if metadata is None:
+        return legacySpec(filePath, layerName, layerElement)
+    return specFromMetadata(filePath, layerName, metadata)
+
+
+def readVrtLayers(vrtPath):
+    '''Return (specs, union) of a VRT file written by the plugin.
+
+    Options of each layer are returned as a SpreadsheetLayerSpec, read from
+    the metadata comment of the layer or, for files of older plugin
+    versions, from its elements. union tells whether specs are the sheets
+    merged in an OGRVRTUnionLayer, otherwise specs only holds the first
+    layer. The file is parsed once for each of its versions, later calls
+    return a copy of the cached specs. The cache is shared by all threads.
+    Raise VrtConfigError if the file is not a valid VRT file.
+    '''
+    st = os.stat(vrtPath)
+    key = (vrtPath, st.st_size, st.st_mtime)
+    with _cacheLock:
+        config = _cache.get(key)
+    if config is None:
+        # Parsed without the lock, other threads may parse it too
+        config = parseVrtConfig(vrtPath)
+        with _cacheLock:
+            for oldKey in list(_cache):
+                if oldKey[0] == vrtPath:
+                    del _cache[oldKey]
+            _cache[key] = config
+    # Cached specs are never modified, they can be copied without the lock
+    return copy.deepcopy(config)
+
+
+def readVrtConfig(vrtPath):
+    '''Return the options of a VRT file written by the plugin.
+
+    Options are returned as a SpreadsheetLayerSpec, the one of the first
+    merged sheet for union VRT files, see readVrtLayers().
+    Raise VrtConfigError if the file is not a valid VRT file.
+    '''
+    specs, union = readVrtLayers(vrtPath)
+    return specs[0]
+
+
+def refreshVrt(vrtPath, inferenceRows=0, progress=None):
+    '''Rewrite a VRT file written by the plugin after its source changed.
+
+    End of file detection is run again, so the layer gets new rows, and
+    field types are checked against data rows, see
+    SpreadsheetLayerBuilder.typeMismatches(). Fields and their types are
+    kept as they are, the file is only written when its content changes.
+    Return names of mismatching fields.
+    VRT files without metadata, or which are not a single spreadsheet
+    layer, like union VRT files, are left unchanged.
+    '''
+    try:
+        specs, union = readVrtLayers(vrtPath)
+    except VrtConfigError:
+        return []
+    spec = specs[0]
+    if union or spec.fields is None:
+        return []
+
+    dataSource = spec.open()
+    if dataSource is None:
+        raise IOError(u'Could not open {}'.format(spec.filePath))
+    builder = SpreadsheetLayerBuilder(spec)
+    builder.prepare(dataSource, progress=progress)
+    layer = dataSource.GetLayerByName(spec.sheet.encode('UTF-8'))
+    mismatches = builder.typeMismatches(layer, inferenceRows, progress)
+
+    content = builder.vrt()
+    with open(vrtPath, 'rb') as f:
+        if f.read() == content:
+            return mismatches
+    builder.write(vrtPath)
+    return mismatches
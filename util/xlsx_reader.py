@@ -0,0 +1,423 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import zipfile
+import datetime
+import posixpath
+from collections import OrderedDict
+from xml.etree import cElementTree as ElementTree
+
+
+MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+DOC_REL_NS = ('{http://schemas.openxmlformats.org/officeDocument/2006/'
+              'relationships}')
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Built-in number formats of dates and times
+BUILTIN_FORMATS = {}
+BUILTIN_FORMATS.update((i, 'date') for i in xrange(14, 18))
+BUILTIN_FORMATS.update((i, 'time') for i in xrange(18, 22))
+BUILTIN_FORMATS.update((i, 'time') for i in xrange(45, 48))
+BUILTIN_FORMATS[22] = 'datetime'
+
+CELL_REF_RE = re.compile(r'([A-Z]+)(\d*)')
+FORMAT_LITERALS_RE = re.compile(r'"[^"]*"|\[[^\]]*\]|\\.')
+INTEGER_RE = re.compile(r'-?\d+\Z')
+
+
+class XlsxError(Exception):
+    '''Raised when a file can't be read as an XLSX workbook.'''
+
+
+def columnIndex(letters):
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord('A') + 1
+    return index - 1
+
+
+def formatKind(formatCode):
+    '''Return date, time, datetime or None for an Excel number format.'''
+    code = FORMAT_LITERALS_RE.sub('', formatCode).lower()
+    hasTime = 'h' in code or 's' in code
+    hasDate = 'd' in code or 'y' in code or ('m' in code and not hasTime)
+    if hasDate and hasTime:
+        return 'datetime'
+    if hasDate:
+        return 'date'
+    if hasTime:
+        return 'time'
+    return None
+
+
+class XlsxReader(object):
+    '''XlsxReader streams rows of XLSX sheets without loading whole sheets.
+
+    Sheet XML is read from the zip archive with an incremental parser, rows
+    are produced one at a time and reading stops as soon as the caller
+    stops iterating. Only shared strings and cell styles are loaded when
+    opening the workbook.
+    Header line detection, field names and row numbering follow the GDAL
+    XLSX driver rules, so rows match the features of the GDAL layer used by
+    VRT files. headers is the HEADERS open option the GDAL layer is opened
+    with, if any. Values are unicode strings, int, float, datetime.date,
+    datetime.datetime or datetime.time, None for empty cells.
+    '''
+
+    def __init__(self, path, headers=None):
+        self.headers = headers
+        self.zip = None
+        try:
+            self.zip = zipfile.ZipFile(path)
+            self.date1904 = False
+            self.sheets = self._readWorkbook()
+            self.sharedStrings = self._readSharedStrings()
+            self.styles = self._readStyles()
+        except (zipfile.BadZipfile, KeyError, ElementTree.ParseError,
+                ValueError) as e:
+            if self.zip is not None:
+                self.zip.close()
+            raise XlsxError(u'Could not read {}: {}'.format(path, e))
+        self._headers = {}
+        self._stats = {}
+        self._dimensions = {}
+        self._columnCounts = {}
+
+    def close(self):
+        self.zip.close()
+
+    def sheetNames(self):
+        return self.sheets.keys()
+
+    def _readWorkbook(self):
+        relationships = {}
+        root = ElementTree.fromstring(self.zip.read('xl/_rels/workbook.xml.rels'))
+        for rel in root.iter(PKG_REL_NS + 'Relationship'):
+            target = rel.get('Target')
+            if target.startswith('/'):
+                target = target[1:]
+            else:
+                target = posixpath.normpath(posixpath.join('xl', target))
+            relationships[rel.get('Id')] = target
+
+        sheets = OrderedDict()
+        root = ElementTree.fromstring(self.zip.read('xl/workbook.xml'))
+        workbookPr = root.find(MAIN_NS + 'workbookPr')
+        if workbookPr is not None:
+            self.date1904 = workbookPr.get('date1904') in ('1', 'true')
+        for sheet in root.iter(MAIN_NS + 'sheet'):
+            sheets[sheet.get('name')] = relationships[sheet.get(DOC_REL_NS + 'id')]
+        return sheets
+
+    def _readSharedStrings(self):
+        strings = []
+        if 'xl/sharedStrings.xml' not in self.zip.namelist():
+            return strings
+        with self.zip.open('xl/sharedStrings.xml') as f:
+            for event, elem in ElementTree.iterparse(f):
+                if elem.tag == MAIN_NS + 'si':
+                    strings.append(self._text(elem))
+                    elem.clear()
+        return strings
+
+    def _text(self, elem):
+        '''Return text of a string item, ignoring phonetic runs.'''
+        parts = []
+        for child in elem:
+            if child.tag == MAIN_NS + 't':
+                parts.append(child.text or u'')
+            elif child.tag == MAIN_NS + 'r':
+                t = child.find(MAIN_NS + 't')
+                if t is not None:
+                    parts.append(t.text or u'')
+        return u''.join(parts)
+
+    def _readStyles(self):
+        '''Return kind of date (see formatKind) of each cell style index.'''
+        if 'xl/styles.xml' not in self.zip.namelist():
+            return []
+        root = ElementTree.fromstring(self.zip.read('xl/styles.xml'))
+        formats = dict(BUILTIN_FORMATS)
+        numFmts = root.find(MAIN_NS + 'numFmts')
+        if numFmts is not None:
+            for numFmt in numFmts.iter(MAIN_NS + 'numFmt'):
+                formats[int(numFmt.get('numFmtId'))] = formatKind(
+                    numFmt.get('formatCode', ''))
+        styles = []
+        cellXfs = root.find(MAIN_NS + 'cellXfs')
+        if cellXfs is not None:
+            for xf in cellXfs.iter(MAIN_NS + 'xf'):
+                styles.append(formats.get(int(xf.get('numFmtId', 0))))
+        return styles
+
+    def _dateValue(self, number, kind):
+        if self.date1904:
+            epoch = datetime.datetime(1904, 1, 1)
+        else:
+            epoch = datetime.datetime(1899, 12, 30)
+        value = epoch + datetime.timedelta(days=number)
+        # Round to the second, as Excel does
+        if value.microsecond >= 500000:
+            value += datetime.timedelta(seconds=1)
+        value = value.replace(microsecond=0)
+        if kind == 'date':
+            return value.date()
+        if kind == 'time':
+            return value.time()
+        return value
+
+    def _cell(self, c):
+        '''Return (value, isString) of a cell element.'''
+        t = c.get('t', 'n')
+        if t == 'inlineStr':
+            inline = c.find(MAIN_NS + 'is')
+            if inline is None:
+                return None, False
+            return self._text(inline), True
+        v = c.find(MAIN_NS + 'v')
+        if v is None or v.text is None:
+            return None, False
+        text = v.text
+        if t == 's':
+            return self.sharedStrings[int(text)], True
+        if t in ('str', 'e'):
+            return text, True
+        if t == 'b':
+            return int(text), False
+        style = int(c.get('s', 0))
+        kind = self.styles[style] if style < len(self.styles) else None
+        if kind is not None:
+            return self._dateValue(float(text), kind), False
+        if INTEGER_RE.match(text):
+            return int(text), False
+        return float(text), False
+
+    def _parse(self, sheet, stop=None):
+        '''Yield (row index, cells) of a sheet, cells being a list of
+        (column index, value, isString) tuples, or ('pane', ySplit) items
+        for a frozen pane found before sheet data.
+        '''
+        try:
+            member = self.sheets[sheet]
+        except KeyError:
+            raise XlsxError(u'No sheet named {}'.format(sheet))
+        with self.zip.open(member) as f:
+            sheetData = None
+            nextRow = 0
+            for event, elem in ElementTree.iterparse(f, ('start', 'end')):
+                if event == 'start':
+                    if elem.tag == MAIN_NS + 'sheetData':
+                        sheetData = elem
+                    continue
+                if elem.tag == MAIN_NS + 'pane' and elem.get('state') == 'frozen':
+                    yield 'pane', int(float(elem.get('ySplit', 0)))
+                if elem.tag != MAIN_NS + 'row':
+                    continue
+                r = elem.get('r')
+                row = int(r) - 1 if r else nextRow
+                nextRow = row + 1
+                cells = []
+                nextColumn = 0
+                for c in elem.iter(MAIN_NS + 'c'):
+                    match = CELL_REF_RE.match(c.get('r', ''))
+                    column = nextColumn
+                    if match is not None:
+                        column = columnIndex(match.group(1))
+                    nextColumn = column + 1
+                    value, isString = self._cell(c)
+                    if value is not None:
+                        cells.append((column, value, isString))
+                # Rows are not kept in memory once read
+                elem.clear()
+                if sheetData is not None:
+                    sheetData.remove(elem)
+                yield row, cells
+
+    def _rawRows(self, sheet):
+        '''Yield cells of every line of sheet, including missing lines.'''
+        line = 0
+        for row, cells in self._parse(sheet):
+            if row == 'pane':
+                continue
+            while line < row:
+                yield []
+                line += 1
+            yield cells
+            line += 1
+
+    def _lineTypes(self, cells):
+        types = []
+        for column, value, isString in cells:
+            while len(types) < column:
+                types.append('')
+            types.append('string' if isString else 'other')
+        return types
+
+    def hasHeaderLine(self, sheet):
+        '''Tell whether GDAL uses the first line of sheet as field names.
+
+        Like GDAL, the HEADERS open option or OGR_XLSX_HEADERS environment
+        variable can force or disable it, otherwise the first line is a
+        header line when the sheet has a frozen first line, or when all its
+        cells are strings and the second line has values which are not all
+        strings.
+        '''
+        if sheet in self._headers:
+            return self._headers[sheet]
+
+        option = (self.headers
+                  or os.environ.get('OGR_XLSX_HEADERS', '')).upper()
+        lines = []
+        pane = None
+        for row, cells in self._parse(sheet):
+            if row == 'pane':
+                pane = cells
+                continue
+            lines.append((row, cells))
+            if len(lines) == 2:
+                break
+
+        header = False
+        if option == 'FORCE':
+            header = True
+        elif option == 'DISABLE':
+            header = False
+        elif pane == 1:
+            header = True
+        elif (len(lines) == 2
+              and lines[0][0] == 0
+              and lines[1][0] == 1):
+            firstTypes = self._lineTypes(lines[0][1])
+            secondTypes = self._lineTypes(lines[1][1])
+            header = (len(firstTypes) > 0
+                      and all(t == 'string' for t in firstTypes)
+                      and len(firstTypes) == len(secondTypes)
+                      and secondTypes.count('string') != len(firstTypes)
+                      and secondTypes.count('other') != 0)
+        self._headers[sheet] = header
+        return header
+
+    def stats(self, sheet, progress=None):
+        '''Return (featureCount, nonEmptyRows, columnCount) of sheet.
+
+        This reads the whole sheet once, results are kept for next calls.
+        progress is called with the number of lines read and 0.
+        '''
+        if sheet in self._stats:
+            return self._stats[sheet]
+        lines = 0
+        lastNonEmpty = 0
+        columns = 0
+        for cells in self._rawRows(sheet):
+            if progress is not None:
+                progress(lines, 0)
+            lines += 1
+            if len(cells) > 0:
+                lastNonEmpty = lines
+                columns = max(columns, cells[-1][0] + 1)
+        skip = 1 if self.hasHeaderLine(sheet) else 0
+        stats = (max(0, lines - skip), max(0, lastNonEmpty - skip), columns)
+        self._stats[sheet] = stats
+        return stats
+
+    def dimension(self, sheet):
+        '''Return (lineCount, columnCount) of the sheet dimension element.
+
+        The dimension is read from the start of the sheet, without reading
+        rows, and may include formatted empty cells. Return None for sheets
+        without dimension.
+        '''
+        if sheet not in self._dimensions:
+            dimension = None
+            with self.zip.open(self.sheets[sheet]) as f:
+                for event, elem in ElementTree.iterparse(f, ('start',)):
+                    if elem.tag == MAIN_NS + 'dimension':
+                        ref = elem.get('ref', '').split(':')[-1]
+                        match = CELL_REF_RE.match(ref)
+                        if match is not None and match.group(2):
+                            dimension = (int(match.group(2)),
+                                         columnIndex(match.group(1)) + 1)
+                        break
+                    if elem.tag == MAIN_NS + 'sheetData':
+                        break
+            self._dimensions[sheet] = dimension
+        return self._dimensions[sheet]
+
+    def estimatedFeatureCount(self, sheet):
+        '''Return feature count from sheet dimension, without reading rows.
+
+        The dimension may include formatted empty rows, so the count may be
+        greater than the GDAL one. Sheets without dimension are read.
+        '''
+        if sheet in self._stats:
+            return self._stats[sheet][0]
+        dimension = self.dimension(sheet)
+        if dimension is None:
+            return self.stats(sheet)[0]
+        skip = 1 if self.hasHeaderLine(sheet) else 0
+        return max(0, dimension[0] - skip)
+
+    def columnCount(self, sheet, probeLines=100):
+        '''Return number of fields of sheet, as counted by stats().
+
+        The sheet dimension may include formatted empty cells, it is only
+        an upper bound of the count: when the first probeLines lines
+        already have values in its last column, or hold the whole sheet,
+        the rest of the sheet is not read.
+        '''
+        if sheet in self._stats:
+            return self._stats[sheet][2]
+        if sheet in self._columnCounts:
+            return self._columnCounts[sheet]
+        dimension = self.dimension(sheet)
+        if dimension is None:
+            return self.stats(sheet)[2]
+        columns = 0
+        complete = True
+        for line, cells in enumerate(self._rawRows(sheet)):
+            if line >= probeLines:
+                complete = False
+                break
+            if len(cells) > 0:
+                columns = max(columns, cells[-1][0] + 1)
+        if not complete and columns < dimension[1]:
+            return self.stats(sheet)[2]
+        self._columnCounts[sheet] = columns
+        return columns
+
+    def fieldNames(self, sheet):
+        '''Return names of the fields of the GDAL layer of sheet.'''
+        columnCount = self.columnCount(sheet)
+        names = [u'Field{}'.format(i + 1) for i in xrange(0, columnCount)]
+        if self.hasHeaderLine(sheet):
+            for cells in self._rawRows(sheet):
+                for column, value, isString in cells:
+                    if column < columnCount and value != u'':
+                        names[column] = unicode(value)
+                break
+        return names
+
+    def rows(self, sheet, start=0, count=None):
+        '''Yield values of features of sheet, starting at feature start.
+
+        Rows are lists of values, one per field, None for empty cells.
+        '''
+        columnCount = self.columnCount(sheet)
+        skip = 1 if self.hasHeaderLine(sheet) else 0
+        produced = 0
+        for line, cells in enumerate(self._rawRows(sheet)):
+            if count is not None and produced >= count:
+                return
+            if line < skip + start:
+                continue
+            values = [None] * columnCount
+            for column, value, isString in cells:
+                if column < columnCount:
+                    values[column] = value
+            yield values
+            produced += 1
+
+
+def isStreamable(path):
+    return os.path.splitext(path)[1].lower() == '.xlsx'
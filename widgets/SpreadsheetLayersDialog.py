@@ -22,19 +22,57 @@
 """
 
 import os
-import datetime
-import re
-from tempfile import gettempdir
+import contextlib
+import functools
 from exceptions import NotImplementedError
-from osgeo import ogr
-from qgis.core import QgsVectorDataProvider
-from qgis.gui import QgsMessageBar, QgsGenericProjectionSelector
+from osgeo import gdal, ogr
+from qgis.core import QgsApplication, QgsMessageLog, QgsVectorDataProvider
+from qgis.gui import (QgsCollapsibleGroupBox,
+                      QgsMessageBar,
+                      QgsGenericProjectionSelector)
 from PyQt4 import QtCore, QtGui
 
-from SpreadsheetLayers.util.gdal_util import GDAL_COMPAT
+from SpreadsheetLayers.util.gdal_util import testGdal
+from SpreadsheetLayers.util.materialize import (FORMATS,
+                                                materializedPath,
+                                                supportedFormats)
+from SpreadsheetLayers.util.ogr_util import OgrSample
+from SpreadsheetLayers.util.ogr_worker import nextRequestId, sharedWorker
+from SpreadsheetLayers.util.profiling import Stage, appendTrace, formatRecord
+from SpreadsheetLayers.util.spreadsheet_layer import (SpreadsheetLayerBuilder,
+                                                      SpreadsheetLayerSpec,
+                                                      sheetVrtPath)
+from SpreadsheetLayers.util.type_inference import OFTInteger64
+from SpreadsheetLayers.util.vrt_config import VrtConfigError, readVrtConfig
 from SpreadsheetLayers.ui.ui_SpreadsheetLayersDialog import Ui_SpreadsheetLayersDialog
 
 
+_checkBoxPixmaps = {}
+
+
+def checkBoxPixmap(checked):
+    """Return a check box pixmap, as header views can't display them."""
+    if checked not in _checkBoxPixmaps:
+        style = QtGui.QApplication.style()
+        option = QtGui.QStyleOptionButton()
+        option.rect = QtCore.QRect(
+            0, 0,
+            style.pixelMetric(QtGui.QStyle.PM_IndicatorWidth),
+            style.pixelMetric(QtGui.QStyle.PM_IndicatorHeight))
+        option.state = QtGui.QStyle.State_Enabled
+        if checked:
+            option.state |= QtGui.QStyle.State_On
+        else:
+            option.state |= QtGui.QStyle.State_Off
+        pixmap = QtGui.QPixmap(option.rect.size())
+        pixmap.fill(QtCore.Qt.transparent)
+        painter = QtGui.QPainter(pixmap)
+        style.drawPrimitive(QtGui.QStyle.PE_IndicatorCheckBox, option, painter)
+        painter.end()
+        _checkBoxPixmaps[checked] = pixmap
+    return _checkBoxPixmaps[checked]
+
+
 class FieldsModel(QtCore.QAbstractListModel):
     '''FieldsModel provide a ListModel class to display fields in QComboBox.
     '''
@@ -53,92 +91,129 @@ class FieldsModel(QtCore.QAbstractListModel):
             return field['src']
 
 
-class OgrTableModel(QtGui.QStandardItemModel):
+class OgrTableModel(QtCore.QAbstractTableModel):
     '''OgrTableModel provide a TableModel class
     for displaying OGR layers data.
 
-    OGR layer is read at creation or by setLayer().
-    All data are stored in parent QtCore.QStandardItemModel object.
+    OGR layer is read at creation or by setLayer() into an OgrSample,
+    an already read OgrSample can also be displayed with setSample().
+    Display data is only built by data() for requested indexes, columns
+    which were not decoded, see OgrSample.ignoredColumns, are displayed
+    empty.
     No reference to any OGR related object is kept.
+    An extra last line is used to display column formats.
+    Horizontal header shows a check box telling whether the field is
+    included in the layer, excluded columns are displayed empty.
     '''
+
+    alignments = {
+        ogr.OFTDate: QtCore.Qt.AlignCenter,
+        ogr.OFTInteger: QtCore.Qt.AlignRight,
+        ogr.OFTReal: QtCore.Qt.AlignRight,
+        OFTInteger64: QtCore.Qt.AlignRight,
+    }
+
     def __init__(self, layer=None, fields=None, parent=None, maxRowCount=None):
         super(OgrTableModel, self).__init__(parent)
         self.maxRowCount = maxRowCount
+        self.sample = OgrSample()
+        self._nullFont = QtGui.QFont()
+        self._nullFont.setItalic(True)
         self.setLayer(layer)
         self.fields = fields
 
-    def setLayer(self, layer):
-        self.clear()
-        if layer is None:
-            return
+    def setLayer(self, layer, firstColumn=0, maxColumnCount=None):
+        """Load sample data from layer, see OgrSample."""
+        sample = OgrSample()
+        if layer is not None:
+            sample = OgrSample(layer,
+                               self.maxRowCount,
+                               firstColumn,
+                               maxColumnCount)
+        self.setSample(sample)
+
+    def setSample(self, sample):
+        self.beginResetModel()
+        self.sample = sample
+        self.endResetModel()
+
+    def field(self, column):
+        """Return field definition displayed in given model column."""
+        return self.fields[self.sample.columns[column]]
+
+    def isIncluded(self, column):
+        try:
+            return self.field(column).get('include', True)
+        except (IndexError, TypeError):
+            return True
+
+    def toggleColumn(self, column):
+        """Include or exclude field displayed in given model column."""
+        self.field(column)['include'] = not self.isIncluded(column)
+        self.headerDataChanged.emit(QtCore.Qt.Horizontal, column, column)
+        if self.sample.rowCount > 0:
+            self.dataChanged.emit(self.index(0, column),
+                                  self.index(self.sample.rowCount - 1, column))
 
-        layerDefn = layer.GetLayerDefn()
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        # Last line is used for column format
+        return self.sample.rowCount + 1
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.sample.columns)
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if (orientation == QtCore.Qt.Horizontal
+            and role == QtCore.Qt.DecorationRole
+        ):
+            return checkBoxPixmap(self.isIncluded(section))
+        if role != QtCore.Qt.DisplayRole:
+            return None
+        if orientation == QtCore.Qt.Horizontal:
+            return self.sample.headers[section]
+        # No header for column format line
+        if section >= self.sample.rowCount:
+            return u''
+        return unicode(section + 1)
 
-        rows = min(layer.GetFeatureCount(), self.maxRowCount)
-        columns = layerDefn.GetFieldCount()
+    def flags(self, index):
+        if index.row() >= self.sample.rowCount:
+            return QtCore.Qt.ItemIsEnabled | QtCore.Qt.ItemIsEditable
+        return QtCore.Qt.ItemIsEnabled
 
-        self.setRowCount(rows)
-        self.setColumnCount(columns)
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= self.sample.rowCount:
+            return None
 
-        # Headers
-        for column in xrange(0, columns):
-            fieldDefn = layerDefn.GetFieldDefn(column)
-            fieldName = fieldDefn.GetNameRef().decode('UTF-8')
-            item = QtGui.QStandardItem(fieldName)
-            self.setHorizontalHeaderItem(column, item)
+        if not self.isIncluded(index.column()):
+            return None
+        if self.sample.columns[index.column()] in self.sample.ignoredColumns:
+            return None
 
-        # Lines
-        for row in xrange(0, rows):
-            for column in xrange(0, columns):
-                layer.SetNextByIndex(row)
-                feature = layer.GetNextFeature()
-                item = self.createItem(layerDefn, feature, column)
-                self.setItem(row, column, item)
+        column = self.sample.values[index.column()]
+        value = column.value(index.row())
 
-        # No header for column format line
-        for column in xrange(0, columns):
-            item = QtGui.QStandardItem("")
-            self.setVerticalHeaderItem(rows, item)
-
-    def createItem(self, layerDefn, feature, iField):
-        fieldDefn = layerDefn.GetFieldDefn(iField)
-
-        value = None
-        if fieldDefn.GetType() == ogr.OFTDate:
-            if feature.IsFieldSet(iField):
-                value = datetime.date(*feature.GetFieldAsDateTime(iField)[:3])
-            hAlign = QtCore.Qt.AlignCenter
-
-        elif fieldDefn.GetType() == ogr.OFTInteger:
-            if feature.IsFieldSet(iField):
-                value = feature.GetFieldAsInteger(iField)
-            hAlign = QtCore.Qt.AlignRight
-
-        elif fieldDefn.GetType() == ogr.OFTReal:
-            if feature.IsFieldSet(iField):
-                value = feature.GetFieldAsDouble(iField)
-            hAlign = QtCore.Qt.AlignRight
-
-        elif fieldDefn.GetType() == ogr.OFTString:
-            if feature.IsFieldSet(iField):
-                value = feature.GetFieldAsString(iField).decode('UTF-8')
-            hAlign = QtCore.Qt.AlignLeft
+        if role == QtCore.Qt.DisplayRole:
+            if value is None:
+                return u'NULL'
+            return unicode(value)
 
-        else:
-            if feature.IsFieldSet(iField):
-                value = feature.GetFieldAsString(iField).decode('UTF-8')
-            hAlign = QtCore.Qt.AlignLeft
+        if role == QtCore.Qt.TextAlignmentRole:
+            hAlign = self.alignments.get(column.fieldType,
+                                         QtCore.Qt.AlignLeft)
+            return hAlign | QtCore.Qt.AlignVCenter
 
         if value is None:
-            item = QtGui.QStandardItem(u'NULL')
-            item.setForeground(QtGui.QBrush(QtCore.Qt.gray))
-            font = item.font()
-            font.setItalic(True)
-            item.setFont(font)
-        else:
-            item = QtGui.QStandardItem(unicode(value))
-        item.setTextAlignment(hAlign | QtCore.Qt.AlignVCenter)
-        return item
+            if role == QtCore.Qt.ForegroundRole:
+                return QtGui.QBrush(QtCore.Qt.gray)
+            if role == QtCore.Qt.FontRole:
+                return self._nullFont
+
+        return None
 
 
 ogrFieldTypes = []
@@ -155,9 +230,9 @@ for fieldType in [
     ogr.OFTDate,
     ogr.OFTTime,
     ogr.OFTDateTime]:
-    #ogr.OFTInteger64,
-    #ogr.OFTInteger64List
     ogrFieldTypes.append((fieldType, ogr.GetFieldTypeName(fieldType)))
+if OFTInteger64 is not None:
+    ogrFieldTypes.insert(1, (OFTInteger64, ogr.GetFieldTypeName(OFTInteger64)))
 
 
 class OgrFieldTypeDelegate(QtGui.QStyledItemDelegate):
@@ -174,38 +249,245 @@ class OgrFieldTypeDelegate(QtGui.QStyledItemDelegate):
     def setEditorData(self, editor, index):
         if not editor:
             return
-        type = index.model().fields[index.column()]['type']
+        type = index.model().field(index.column())['type']
         editor.setCurrentIndex(editor.findData(type))
 
     def setModelData(self, editor, model, index):
         if not editor:
             return
         type = editor.itemData(editor.currentIndex())
-        model.fields[index.column()]['type'] = type
+        model.field(index.column())['type'] = type
 
 
 class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
 
     pluginKey = 'SpreadsheetLayers'
     sampleRowCount = 20
+    # Columns decoded around the visible ones in the sample view
+    sampleColumnMargin = 20
+    refreshDelay = 250
+    spatialIndexMinRows = 10000
+    typeInferenceRowCount = 10000
+    dataSourcePoolSize = 256
+    _gdalCompat = None
+
+    # Requests sent to OgrWorker
+    openDataSourceRequested = QtCore.pyqtSignal(int, object, bool)
+    countNonEmptyRowsRequested = QtCore.pyqtSignal(int, object, bool)
+    countFilteredRowsRequested = QtCore.pyqtSignal(int, object)
+    readFieldsRequested = QtCore.pyqtSignal(int, object, int, bool, int)
+    readSampleRequested = QtCore.pyqtSignal(int, object, int, object, object)
+    materializeRequested = QtCore.pyqtSignal(int, object, object)
+    writeVrtsRequested = QtCore.pyqtSignal(int, object, bool, object, object)
+    closeDataSourceRequested = QtCore.pyqtSignal()
 
     def __init__(self, parent=None):
         """Constructor."""
         super(SpreadsheetLayersDialog, self).__init__(parent)
         self.setupUi(self)
 
-        self.dataSource = None
-        self.layer = None
+        self.driverName = None
+        self.csvOptions = None
         self.fields = None
-        self.sampleDatasource = None
+        self.pendingXField = ''
+        self.pendingYField = ''
+        self.pendingFields = None
+        self._non_empty_rows = 0
+        self.bulkResults = []
+        self.filteredRows = None
+        self.filterError = None
         self.ogrHeadersLabel.setText('')
 
         self.messageBar = QgsMessageBar(self)
         self.layout().insertWidget(0, self.messageBar)
 
+        self.sampleRowCount = QtCore.QSettings().value(
+            self.pluginKey + "/sampleRowCount", self.sampleRowCount, type=int)
+        self.spatialIndexMinRows = QtCore.QSettings().value(
+            self.pluginKey + "/spatialIndexMinRows",
+            self.spatialIndexMinRows, type=int)
+        self.typeInference = QtCore.QSettings().value(
+            self.pluginKey + "/typeInference", True, type=bool)
+        self.typeInferenceRowCount = QtCore.QSettings().value(
+            self.pluginKey + "/typeInferenceRowCount",
+            self.typeInferenceRowCount, type=int)
+        self.streamingXlsx = QtCore.QSettings().value(
+            self.pluginKey + "/streamingXlsx", False, type=bool)
+        self.profiling = QtCore.QSettings().value(
+            self.pluginKey + "/profiling", False, type=bool)
+        self.profilingTraceFile = QtCore.QSettings().value(
+            self.pluginKey + "/profilingTraceFile", '')
+        if self.profiling:
+            self.createProfilingPanel()
+        self.materializeToolTip = self.materializeBox.toolTip()
+        # User choice, restored when materialization is no longer forced
+        self.materializeChoice = self.materializeBox.isChecked()
+        self.materializeForced = False
+        for driverName in supportedFormats():
+            self.formatBox.addItem(FORMATS[driverName]['name'], driverName)
+        self.setMaterializeFormat(QtCore.QSettings().value(
+            self.pluginKey + "/materializeFormat", 'GPKG'))
         self.geometryBox.setChecked(False)
-        self.sampleRefreshDisabled = False
+        self.updateMaterialize()
         self.sampleView.setItemDelegate(OgrFieldTypeDelegate())
+        self.sampleView.horizontalHeader().setClickable(True)
+        self.sampleView.horizontalHeader().sectionClicked.connect(
+            self.onSampleHeaderClicked)
+        self.sampleView.horizontalScrollBar().valueChanged.connect(
+            self.onSampleScrolled)
+        # [first, last[ range of decoded sample columns
+        self.sampleWindow = (0, 0)
+
+        self.requestId = 0
+        self.dirty = set()
+        # Steps stopped or failed, run again on next refresh
+        self.interrupted = set()
+        self.refreshTimer = QtCore.QTimer(self)
+        self.refreshTimer.setSingleShot(True)
+        self.refreshTimer.setInterval(self.refreshDelay)
+        self.refreshTimer.timeout.connect(self.processRefresh)
+        self.showProgress(False)
+        self.startWorker()
+
+    @classmethod
+    def metadataCachePath(cls):
+        settings = QtCore.QSettings()
+        if not settings.value(cls.pluginKey + "/metadataCache", True, type=bool):
+            return None
+        return os.path.join(QgsApplication.qgisSettingsDirPath(),
+                            cls.pluginKey,
+                            'metadata.sqlite')
+
+    @classmethod
+    def openSharedWorker(cls):
+        """Return the worker shared by dialogs, started with settings."""
+        poolSize = QtCore.QSettings().value(
+            cls.pluginKey + "/dataSourcePoolSize",
+            cls.dataSourcePoolSize, type=int)
+        return sharedWorker(cls.metadataCachePath(), poolSize * 1024 * 1024)
+
+    def workerConnections(self):
+        return [
+            (self.openDataSourceRequested, self.worker.openDataSource),
+            (self.countNonEmptyRowsRequested, self.worker.countNonEmptyRows),
+            (self.countFilteredRowsRequested, self.worker.countFilteredRows),
+            (self.readFieldsRequested, self.worker.readFields),
+            (self.readSampleRequested, self.worker.readSample),
+            (self.materializeRequested, self.worker.materialize),
+            (self.writeVrtsRequested, self.worker.writeVrts),
+            (self.closeDataSourceRequested, self.worker.closeDataSource),
+            (self.worker.dataSourceOpened, self.onDataSourceOpened),
+            (self.worker.nonEmptyRowsCounted, self.onNonEmptyRowsCounted),
+            (self.worker.filteredRowsCounted, self.onFilteredRowsCounted),
+            (self.worker.fieldsRead, self.onFieldsRead),
+            (self.worker.sampleRead, self.onSampleRead),
+            (self.worker.materialized, self.onMaterialized),
+            (self.worker.vrtsWritten, self.onVrtsWritten),
+            (self.worker.progress, self.onProgress),
+            (self.worker.failed, self.onFailed),
+            (self.worker.profiled, self.onProfiled)]
+
+    def startWorker(self):
+        """Connect to the worker shared with other dialogs."""
+        self.worker = self.openSharedWorker()
+        self.worker.profiling = self.profiling
+        for signal, slot in self.workerConnections():
+            signal.connect(slot)
+
+    def stopWorker(self):
+        """Cancel pending requests and give datasource back to the pool."""
+        if self.worker is None:
+            return
+        self.refreshTimer.stop()
+        self.newRequest()
+        self.closeDataSourceRequested.emit()
+        self.worker.profiling = False
+        for signal, slot in self.workerConnections():
+            signal.disconnect(slot)
+        self.worker = None
+
+    def newRequest(self):
+        """Start a new request, results of previous ones will be dropped."""
+        self.requestId = nextRequestId()
+        self.worker.currentRequestId = self.requestId
+        return self.requestId
+
+    def isLoading(self):
+        return len(self.dirty) > 0
+
+    def interruptLoading(self):
+        """Stop waiting for pending steps, next refresh runs them again."""
+        self.refreshTimer.stop()
+        self.interrupted |= self.dirty
+        self.dirty = set()
+        self.showProgress(False)
+
+    def showProgress(self, visible):
+        self.progressBar.setRange(0, 0)
+        self.progressBar.setVisible(visible)
+        self.stopButton.setVisible(visible)
+
+    @QtCore.pyqtSlot(int, int, int)
+    def onProgress(self, requestId, value, maximum):
+        if requestId != self.requestId:
+            return
+        self.progressBar.setRange(0, maximum)
+        self.progressBar.setValue(value)
+
+    def createProfilingPanel(self):
+        """Add a collapsed panel listing timings of dialog stages."""
+        self.profilingBox = QgsCollapsibleGroupBox(self.tr(u"Timings"), self)
+        layout = QtGui.QVBoxLayout(self.profilingBox)
+        self.profilingView = QtGui.QPlainTextEdit(self.profilingBox)
+        self.profilingView.setReadOnly(True)
+        self.profilingView.setMaximumBlockCount(500)
+        font = QtGui.QFont('Monospace')
+        font.setStyleHint(QtGui.QFont.TypeWriter)
+        self.profilingView.setFont(font)
+        layout.addWidget(self.profilingView)
+        self.profilingBox.setCollapsed(True)
+        # Above buttons line
+        self.layout().insertWidget(self.layout().count() - 1, self.profilingBox)
+
+    @contextlib.contextmanager
+    def profiledStage(self, name):
+        """Time a step run in the GUI thread when profiling."""
+        if not self.profiling:
+            yield
+            return
+        stage = Stage(name, self.filePath())
+        with stage:
+            yield
+        self.addProfilingRecord(stage.record)
+
+    def addProfilingRecord(self, record):
+        """Show record in panel and export it to QGIS log or trace file."""
+        text = formatRecord(record)
+        self.profilingView.appendPlainText(text)
+        if self.profilingTraceFile:
+            try:
+                appendTrace(self.profilingTraceFile, record)
+            except IOError as e:
+                QgsMessageLog.logMessage(unicode(e), self.pluginKey)
+        else:
+            QgsMessageLog.logMessage(text, self.pluginKey)
+
+    @QtCore.pyqtSlot(int, object)
+    def onProfiled(self, requestId, record):
+        # Also show records of outdated requests, they took time too
+        self.addProfilingRecord(record)
+
+    @QtCore.pyqtSlot(int, object)
+    def onFailed(self, requestId, msg):
+        if requestId != self.requestId:
+            return
+        self.interruptLoading()
+        self.warning(msg)
+
+    @QtCore.pyqtSlot(name='on_stopButton_clicked')
+    def on_stopButton_clicked(self):
+        self.newRequest()
+        self.interruptLoading()
 
     def info(self, msg):
         self.messageBar.pushMessage(msg, QgsMessageBar.INFO, 5)
@@ -230,7 +512,7 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
             self,
             self.tr("Choose a spreadsheet file to open"),
             settings.value(self.pluginKey + "/directory", "./"),
-            self.tr("Spreadsheet files") + " (*.ods *.xls *.xlsx);;"
+            self.tr("Spreadsheet files") + " (*.ods *.xls *.xlsx *.csv *.tsv);;"
                 + self.tr("GDAL Virtual Format") + " (*.vrt);;"
                 + self.tr("All files") + " (* *.*)".format())
         if s == '':
@@ -241,14 +523,153 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
         self.afterOpenFile()
 
     def afterOpenFile(self):
-        self.sampleRefreshDisabled = True
-
         self.openDataSource()
-        self.updateSheetBox()
-        self.readVrt()
 
-        self.sampleRefreshDisabled = False
-        self.updateSampleView()
+    def allFiles(self):
+        return self.allFilesBox.isChecked()
+
+    def allSheets(self):
+        return self.allSheetsBox.isChecked()
+
+    def bulk(self):
+        """Return True when options apply to several sheets or files."""
+        return self.allFiles() or self.allSheets()
+
+    @QtCore.pyqtSlot(bool)
+    def on_allFilesBox_toggled(self, checked):
+        self.updateBulk()
+
+    @QtCore.pyqtSlot(bool)
+    def on_allSheetsBox_toggled(self, checked):
+        self.updateBulk()
+
+    @QtCore.pyqtSlot(bool)
+    def on_unionBox_toggled(self, checked):
+        self.updateBulk()
+
+    def updateBulk(self):
+        self.unionBox.setEnabled(self.bulk())
+        self.sourceFieldEdit.setEnabled(self.union())
+        # Layers are named after sheets when loading all sheets of a file
+        self.layerNameEdit.setEnabled(not self.allSheets()
+                                      or self.allFiles()
+                                      or self.union())
+
+    def union(self):
+        """Return True when sheets or files are merged into one layer."""
+        return self.bulk() and self.unionBox.isChecked()
+
+    def unionOptions(self):
+        """Return merged layer options for the worker, None when not merging."""
+        if not self.union():
+            return None
+        vrtPath = self.vrtPath()
+        if self.allFiles():
+            vrtPath = os.path.join(os.path.dirname(self.filePath()),
+                                   u'{}.vrt'.format(self.layerName()))
+        return {'vrtPath': vrtPath,
+                'layerName': self.layerName(),
+                'sourceField': self.sourceFieldEdit.text() or None}
+
+    def bulkFilePaths(self):
+        """Return spreadsheet files to load in bulk mode."""
+        filePath = self.filePath()
+        if not self.allFiles():
+            return [filePath]
+        directory, name = os.path.split(filePath)
+        extension = os.path.splitext(name)[1].lower()
+        return sorted(os.path.join(directory, f)
+                      for f in os.listdir(directory)
+                      if os.path.splitext(f)[1].lower() == extension)
+
+    def bulkSpecs(self):
+        """Return a SpreadsheetLayerSpec by file to load in bulk mode."""
+        specs = []
+        for filePath in self.bulkFilePaths():
+            spec = self.layerSpec()
+            spec.filePath = filePath
+            if filePath != self.filePath() or self.union():
+                # Layer name is given to the merged layer
+                spec.layerName = os.path.splitext(
+                    os.path.basename(filePath))[0]
+            if filePath != self.filePath():
+                if self.sheetBox.count() == 1:
+                    # Single sheet files may name their sheet after file
+                    spec.sheet = None
+                if spec.csvOptions is not None:
+                    # Separator and header names are read from each file
+                    spec.csvOptions = None
+                    spec.fields = None
+            if self.allSheets() and not self.allFiles():
+                spec.layerName = None
+            specs.append(spec)
+        return specs
+
+    def existingBulkVrtPaths(self, specs):
+        """Return paths of existing VRT files a bulk write would replace.
+
+        Sheets of other files are only known once opened, their VRT files
+        are the existing ones named as sheet VRT files of the file.
+        """
+        union = self.unionOptions()
+        if union is not None:
+            paths = [union['vrtPath']]
+        elif not self.allSheets():
+            paths = [spec.vrtPath() for spec in specs]
+        else:
+            paths = []
+            for spec in specs:
+                if spec.filePath == self.filePath():
+                    paths.extend(sheetVrtPath(spec.filePath,
+                                              self.sheetBox.itemText(i))
+                                 for i in xrange(0, self.sheetBox.count()))
+                    continue
+                directory, name = os.path.split(spec.filePath)
+                paths.extend(os.path.join(directory, f)
+                             for f in sorted(os.listdir(directory))
+                             if f.startswith(name + u'.')
+                             and f.endswith(u'.vrt')
+                             and f != name + u'.vrt')
+        return [path for path in paths if os.path.exists(path)]
+
+    def confirmOverwrite(self, paths):
+        """Ask once whether existing VRT files can be overwritten."""
+        shown = paths[:10]
+        if len(paths) > len(shown):
+            shown.append(self.tr(u"and {} other files")
+                         .format(len(paths) - len(shown)))
+        msgBox = QtGui.QMessageBox()
+        msgBox.setText(self.tr(u"{} VRT files already exist.")
+                       .format(len(paths)))
+        msgBox.setInformativeText(self.tr(u"Do you want to overwrite them ?"))
+        msgBox.setDetailedText(u'\n'.join(shown))
+        msgBox.setStandardButtons(QtGui.QMessageBox.Ok
+                                  | QtGui.QMessageBox.Cancel)
+        msgBox.setDefaultButton(QtGui.QMessageBox.Cancel)
+        return msgBox.exec_() == QtGui.QMessageBox.Ok
+
+    @QtCore.pyqtSlot(int, object, object, object, object)
+    def onDataSourceOpened(self, requestId, filePath, driverName, sheets,
+                           csvOptions):
+        if requestId != self.requestId:
+            return
+        self.dirty.discard('dataSource')
+
+        self.driverName = driverName
+        self.csvOptions = csvOptions
+        if self.driverName in ['XLS']:
+            self.setEofDetection(True)
+        else:
+            self.setEofDetection(False)
+        self.updateSheetBox(sheets)
+        if not self.readVrt():
+            if csvOptions is not None:
+                self.setHeader(csvOptions['header'])
+        if csvOptions is not None and csvOptions['encoding'] != 'UTF-8':
+            self.warning(u"{} does not look UTF-8 encoded, it is read as {}"
+                         .format(filePath, csvOptions['encoding']))
+
+        self.refresh(nonEmptyRows=True, fields=True)
 
     def layerName(self):
         return self.layerNameEdit.text()
@@ -257,9 +678,11 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
         self.layerNameEdit.setText(name)
 
     def closeDataSource(self):
-        if self.dataSource is not None:
-            self.dataSource = None
-            self.updateSheetBox()
+        self.pendingFields = None
+        if self.driverName is not None:
+            self.driverName = None
+            self.csvOptions = None
+            self.updateSheetBox([])
 
     def openDataSource(self):
         self.closeDataSource()
@@ -271,33 +694,13 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
 
         self.layerNameEdit.setText(finfo.completeBaseName())
 
-        dataSource = ogr.Open(filePath, 0)
-        if dataSource is None:
-            self.messageBar.pushMessage('Could not open {}'.format(filePath),
-                                        QgsMessageBar.WARNING, 5)
-        self.dataSource = dataSource
-
-        if self.dataSource and self.dataSource.GetDriver().GetName() in ['XLS']:
-            self.setEofDetection(True)
-        else:
-            self.setEofDetection(False)
-
-    def closeSampleDatasource(self):
-        if self.sampleDatasource is not None:
-            self.sampleDatasource = None
-
-    def openSampleDatasource(self):
-        self.closeSampleDatasource()
-
-        filePath = self.samplePath()
-        finfo = QtCore.QFileInfo(filePath)
-        if not finfo.exists():
-            return False
-        dataSource = ogr.Open(filePath, 0)
-        if dataSource is None:
-            self.messageBar.pushMessage('Could not open {}'.format(filePath),
-                                        QgsMessageBar.WARNING, 5)
-        self.sampleDatasource = dataSource
+        requestId = self.newRequest()
+        self.dirty = set(['dataSource'])
+        self.interrupted = set()
+        self.showProgress(True)
+        self.openDataSourceRequested.emit(requestId,
+                                          filePath,
+                                          self.streamingXlsx)
 
     def sheet(self):
         return self.sheetBox.currentText()
@@ -305,26 +708,20 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
     def setSheet(self, sheetName):
         self.sheetBox.setCurrentIndex(self.sheetBox.findText(sheetName))
 
-    def updateSheetBox(self):
-        self.sheetBox.clear()
-        dataSource = self.dataSource
-        if dataSource is None:
-            return
+    def featureCount(self):
+        index = self.sheetBox.currentIndex()
+        if index == -1:
+            return 0
+        return self.sheetBox.itemData(index)
 
-        for i in xrange(0, dataSource.GetLayerCount()):
-            layer = dataSource.GetLayer(i)
-            self.sheetBox.addItem(layer.GetName().decode('UTF-8'), layer)
+    def updateSheetBox(self, sheets):
+        self.sheetBox.clear()
+        for name, featureCount in sheets:
+            self.sheetBox.addItem(name, featureCount)
 
     @QtCore.pyqtSlot(int)
     def on_sheetBox_currentIndexChanged(self, index):
-        if index is None:
-            self.layer = None
-        else:
-            self.layer = self.sheetBox.itemData(index)
-        self.countNonEmptyRows()
-        self.updateFields()
-        self.updateFieldBoxes()
-        self.updateSampleView()
+        self.refresh(nonEmptyRows=True, fields=True)
 
     def linesToIgnore(self):
         return self.linesToIgnoreBox.value()
@@ -334,9 +731,7 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
 
     @QtCore.pyqtSlot(int)
     def on_linesToIgnoreBox_valueChanged(self, value):
-        self.updateFields()
-        self.updateFieldBoxes()
-        self.updateSampleView()
+        self.refresh(fields=True)
 
     def header(self):
         return self.headerBox.checkState() == QtCore.Qt.Checked
@@ -346,9 +741,7 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
 
     @QtCore.pyqtSlot(int)
     def on_headerBox_stateChanged(self, state):
-        self.updateFields()
-        self.updateFieldBoxes()
-        self.updateSampleView()
+        self.refresh(fields=True)
 
     def offset(self):
         offset = self.linesToIgnore()
@@ -376,43 +769,227 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
 
     @QtCore.pyqtSlot(int)
     def on_eofDetectionBox_stateChanged(self, state):
-        self.countNonEmptyRows()
-        self.updateSampleView()
+        self.refresh(nonEmptyRows=True)
+
+    def filter(self):
+        return self.filterEdit.text().strip()
+
+    def setFilter(self, value):
+        self.filterEdit.setText(value)
+
+    @QtCore.pyqtSlot(unicode)
+    def on_filterEdit_textChanged(self, text):
+        self.refresh()
 
-    def countNonEmptyRows(self):
-        if self.layer is None:
+    def refresh(self, nonEmptyRows=False, fields=False):
+        """Mark data as outdated and schedule a refresh.
+
+        Successive calls are merged into one worker request, sent when no
+        option has changed during refreshDelay milliseconds.
+        Parts which were still loading, or were interrupted, are requested
+        again.
+        """
+        if 'dataSource' in self.interrupted:
+            # File opening was interrupted, nothing else can be loaded
+            self.openDataSource()
+            return
+        self.dirty |= self.interrupted
+        self.interrupted = set()
+
+        if nonEmptyRows:
+            self.dirty.add('nonEmptyRows')
+        if fields:
+            self.dirty.add('fields')
+        self.dirty.add('sample')
+
+        # Opened datasource will trigger a complete refresh
+        if 'dataSource' in self.dirty:
             return
-        if self.eofDetection():
-            self._non_empty_rows = 0
-
-            layer = self.layer
-            layerDefn = layer.GetLayerDefn()
-            layer.SetNextByIndex(0)
-            feature = layer.GetNextFeature()
-            current_row = 1
-            while feature is not None:
-                values = []
-
-                for iField in xrange(0, layerDefn.GetFieldCount()):
-                    # values.append(feature.GetFieldAsString(iField).decode('UTF-8'))
-                    if feature.IsFieldSet(iField):
-                        self._non_empty_rows = current_row
-
-                feature = layer.GetNextFeature()
-                current_row += 1
+
+        # Drop results of running requests, they are outdated
+        self.newRequest()
+        self.refreshTimer.start()
+
+    def processRefresh(self):
+        """Ask the worker for outdated data, then for a new sample."""
+        if 'dataSource' in self.dirty:
+            return
+
+        requestId = self.requestId
+        sheet = self.sheet()
+        if self.driverName is None or sheet == '':
+            self.dirty.clear()
+            self.fields = []
+            self.updateFieldBoxes()
+            self.updateSampleView(None)
+            self.showProgress(False)
+            return
+
+        self.showProgress(True)
+        if 'nonEmptyRows' in self.dirty:
+            self.countNonEmptyRowsRequested.emit(requestId,
+                                                 sheet,
+                                                 self.eofDetection())
+        if 'fields' in self.dirty:
+            self.readFieldsRequested.emit(requestId,
+                                          sheet,
+                                          self.offset(),
+                                          self.header(),
+                                          self.typeInferenceRows())
+        self.requestSample()
+
+    def typeInferenceRows(self):
+        """Number of rows used to infer types, 0 for all, -1 for none."""
+        if not self.typeInference:
+            return -1
+        return max(0, self.typeInferenceRowCount)
+
+    def requestSample(self):
+        """Ask for a sample once rows and fields are known.
+
+        With a filter, matching rows are counted first, which also checks
+        the filter before using it in the sample query.
+        """
+        if self.dirty != set(['sample']):
+            return
+        self.filteredRows = None
+        self.filterError = None
+        self.filterCountLabel.setText('')
+        self.filterCountLabel.setToolTip('')
+        if self.filter():
+            builder = SpreadsheetLayerBuilder(self.layerSpec(),
+                                              self.featureCount(),
+                                              self._non_empty_rows)
+            self.countFilteredRowsRequested.emit(self.requestId,
+                                                 builder.countSql())
+            return
+        self.readSample()
+
+    def readSample(self):
+        self.updateGeometry()
+        with self.profiledStage('writeSampleVrt'):
+            builder = self.layerBuilder()
+            content = builder.vrt(sample=True)
+        # Wide sheets only decode columns around the visible ones
+        first, last = self.visibleColumns()
+        self.sampleWindow = (max(0, first - self.sampleColumnMargin),
+                             last + 1 + self.sampleColumnMargin)
+        ignoredColumns = set(self.excludedColumns())
+        ignoredColumns.update(
+            i for i in xrange(0, len(self.fields or []))
+            if not self.sampleWindow[0] <= i < self.sampleWindow[1])
+        self.readSampleRequested.emit(self.requestId,
+                                      content,
+                                      self.sampleRowCount,
+                                      sorted(ignoredColumns),
+                                      builder.sampleSource())
+
+    def visibleColumns(self):
+        """Return first and last columns shown by the sample view."""
+        header = self.sampleView.horizontalHeader()
+        if self.sampleView.model() is None or header.count() == 0:
+            return 0, 0
+        first = max(0, header.logicalIndexAt(0))
+        last = header.logicalIndexAt(self.sampleView.viewport().width() - 1)
+        if last < 0:
+            last = header.count() - 1
+        return first, last
+
+    @QtCore.pyqtSlot()
+    def onSampleScrolled(self):
+        """Read sample again when columns out of decoded ones are shown."""
+        if self.sampleView.model() is None or self.isLoading():
+            return
+        first, last = self.visibleColumns()
+        if first < self.sampleWindow[0] or last >= self.sampleWindow[1]:
+            self.refresh()
+
+    @QtCore.pyqtSlot(int, int, object)
+    def onFilteredRowsCounted(self, requestId, count, error):
+        if requestId != self.requestId:
+            return
+        if error is None:
+            self.filteredRows = count
+            self.filterCountLabel.setText(
+                self.tr(u"{} of {} rows").format(count, self.limit()))
         else:
-            self._non_empty_rows = self.layer.GetFeatureCount()
+            self.filterError = error
+            self.filterCountLabel.setText(self.tr(u"Invalid filter"))
+            self.filterCountLabel.setToolTip(error)
+        self.readSample()
+
+    def excludedColumns(self):
+        """Return indexes of fields excluded from the layer."""
+        return [i for i, field in enumerate(self.fields or [])
+                if not field.get('include', True)]
 
-    def sql(self):
-        sql = ('SELECT * FROM \'{}\''
-               ' LIMIT {} OFFSET {}'
-               ).format(self.sheet(),
-                        self.limit(),
-                        self.offset())
-        return sql
+    @QtCore.pyqtSlot(int)
+    def onSampleHeaderClicked(self, column):
+        model = self.sampleView.model()
+        if model is None or self.isLoading():
+            return
+        model.toggleColumn(column)
+        # Decode included column, or stop decoding excluded one
+        self.refresh()
+
+    @QtCore.pyqtSlot(int, int)
+    def onNonEmptyRowsCounted(self, requestId, count):
+        if requestId != self.requestId:
+            return
+        self._non_empty_rows = count
+        self.dirty.discard('nonEmptyRows')
+        self.requestSample()
+
+    @QtCore.pyqtSlot(int, object)
+    def onFieldsRead(self, requestId, fields):
+        if requestId != self.requestId:
+            return
+        # Keep excluded fields excluded when reading fields again
+        excluded = set(field['src'] for field in self.fields or []
+                       if not field.get('include', True))
+        for field in fields:
+            if field['src'] in excluded:
+                field['include'] = False
+        if self.pendingFields is not None:
+            # Restore types and exclusions of the existing VRT file
+            saved = dict(((field['src'], field['name']), field)
+                         for field in self.pendingFields)
+            for field in fields:
+                old = saved.get((field['src'], field['name']))
+                if old is None:
+                    continue
+                if old.get('type') is not None:
+                    field['type'] = old['type']
+                field['include'] = old.get('include', True)
+            self.pendingFields = None
+        self.fields = fields
+        self.dirty.discard('fields')
+        self.updateFieldBoxes()
+        self.requestSample()
+
+    @QtCore.pyqtSlot(int, object)
+    def onSampleRead(self, requestId, sample):
+        if requestId != self.requestId:
+            return
+        self.dirty.discard('sample')
+        self.showProgress(False)
+        self.updateSampleView(sample)
+
+    def gdalCompat(self):
+        """Run testGdal() on first use, once for each GDAL version."""
+        cls = SpreadsheetLayersDialog
+        if cls._gdalCompat is None:
+            settings = QtCore.QSettings()
+            key = u'{}/gdalCompat/{}'.format(self.pluginKey, gdal.VersionInfo())
+            if settings.contains(key):
+                cls._gdalCompat = settings.value(key, type=bool)
+            else:
+                cls._gdalCompat = testGdal()
+                settings.setValue(key, cls._gdalCompat)
+        return cls._gdalCompat
 
     def updateGeometry(self):
-        if GDAL_COMPAT or self.offset() == 0:
+        if self.gdalCompat() or self.offset() == 0:
             self.geometryBox.setEnabled(True)
             self.geometryBox.setToolTip('')
         else:
@@ -421,6 +998,17 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
                           u" mixed with PointFromColumn functionality.\n"
                           u"For more informations, consult the plugin documentation.")
             self.geometryBox.setToolTip(msg)
+        self.updateMaterialize()
+
+    @QtCore.pyqtSlot(bool)
+    def on_geometryBox_toggled(self, checked):
+        self.updateMaterialize()
+
+    @QtCore.pyqtSlot(bool)
+    def on_materializeBox_toggled(self, checked):
+        if not self.materializeForced:
+            self.materializeChoice = checked
+        self.updateMaterialize()
 
     def geometry(self):
         return (self.geometryBox.isEnabled()
@@ -433,7 +1021,13 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
         return self.xFieldBox.itemData(index, QtCore.Qt.EditRole)
 
     def setXField(self, fieldName):
-        self.xFieldBox.setCurrentIndex(self.xFieldBox.findData(fieldName, QtCore.Qt.EditRole))
+        index = self.xFieldBox.findData(fieldName, QtCore.Qt.EditRole)
+        if index == -1:
+            # Fields of CSV VRTs may be named after header line
+            index = self.xFieldBox.findText(fieldName)
+        self.xFieldBox.setCurrentIndex(index)
+        # Fields may not be loaded yet, see updateFieldBoxes()
+        self.pendingXField = fieldName if index == -1 else ''
 
     def yField(self):
         index = self.yFieldBox.currentIndex()
@@ -442,22 +1036,27 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
         return self.yFieldBox.itemData(index, QtCore.Qt.EditRole)
 
     def setYField(self, fieldName):
-        self.yFieldBox.setCurrentIndex(self.yFieldBox.findData(fieldName, QtCore.Qt.EditRole))
+        index = self.yFieldBox.findData(fieldName, QtCore.Qt.EditRole)
+        if index == -1:
+            index = self.yFieldBox.findText(fieldName)
+        self.yFieldBox.setCurrentIndex(index)
+        # Fields may not be loaded yet, see updateFieldBoxes()
+        self.pendingYField = fieldName if index == -1 else ''
 
     def updateFieldBoxes(self):
         if self.offset() > 0:
             # return
             pass
 
-        if self.layer is None:
+        if not self.fields:
             self.xFieldBox.clear()
             self.yFieldBox.clear()
             return
 
         model = FieldsModel(self.fields)
 
-        xField = self.xField()
-        yField = self.yField()
+        xField = self.xField() or self.pendingXField
+        yField = self.yField() or self.pendingYField
 
         self.xFieldBox.setModel(model)
         self.yFieldBox.setModel(model)
@@ -487,6 +1086,56 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
                     self.yFieldBox.setCurrentIndex(i)
                     break;
 
+    def spatialIndexRequired(self):
+        """Large point layers are always materialized with a spatial index."""
+        rows = self.limit()
+        if self.filteredRows is not None:
+            rows = self.filteredRows
+        return (self.spatialIndexMinRows > 0
+                and self.geometry()
+                and rows >= self.spatialIndexMinRows)
+
+    def updateMaterialize(self):
+        if self.formatBox.count() == 0:
+            self.materializeBox.setEnabled(False)
+            msg = self.tr(u"Used GDAL version doesn't support GeoPackage"
+                          u" nor FlatGeobuf format.")
+            self.materializeBox.setToolTip(msg)
+        elif self.spatialIndexRequired():
+            if not self.materializeForced:
+                self.materializeForced = True
+                self.materializeBox.setChecked(True)
+            self.materializeBox.setEnabled(False)
+            msg = self.tr(u"Point layers with more than {} rows are materialized"
+                          u" with a spatial index.").format(self.spatialIndexMinRows)
+            self.materializeBox.setToolTip(msg)
+        else:
+            if self.materializeForced:
+                self.materializeForced = False
+                self.materializeBox.setChecked(self.materializeChoice)
+            self.materializeBox.setEnabled(True)
+            self.materializeBox.setToolTip(self.materializeToolTip)
+        self.formatBox.setEnabled(self.materialize())
+
+    def materialize(self):
+        return self.formatBox.count() > 0 and self.materializeBox.isChecked()
+
+    def setMaterialize(self, value):
+        self.materializeChoice = value
+        if not self.materializeForced:
+            self.materializeBox.setChecked(value)
+
+    def materializeFormat(self):
+        """Return driver name of the format to convert to, None for none."""
+        if not self.materialize():
+            return None
+        return self.formatBox.itemData(self.formatBox.currentIndex())
+
+    def setMaterializeFormat(self, driverName):
+        index = self.formatBox.findData(driverName)
+        if index != -1:
+            self.formatBox.setCurrentIndex(index)
+
     def showGeometryFields(self):
         return self.showGeometryFieldsBox.isChecked()
 
@@ -504,32 +1153,20 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
         if dlg.exec_():
             self.crsEdit.setText(dlg.selectedAuthId())
 
-    def updateSampleView(self):
-        if self.sampleRefreshDisabled:
-            return
-
-        self.updateGeometry()
-
-        if self.layer is not None:
-            self.writeSampleVrt()
-            self.openSampleDatasource()
-
-        layer = None
-        dataSource = self.sampleDatasource
-        if dataSource is not None:
-            for i in xrange(0, dataSource.GetLayerCount()):
-                layer = dataSource.GetLayer(i)
-
-        if layer is None:
+    def updateSampleView(self, sample):
+        if sample is None:
             self.sampleView.setModel(None)
             return
 
+        # Keep horizontal position, as sample is read again on scroll
+        position = self.sampleView.horizontalScrollBar().value()
         self.sampleView.reset()
-        model = OgrTableModel(layer,
-                              self.fields,
-                              parent=self,
-                              maxRowCount=self.sampleRowCount)
-        self.sampleView.setModel(model)
+        with self.profiledStage('setSample'):
+            model = OgrTableModel(fields=self.fields,
+                                  parent=self,
+                                  maxRowCount=self.sampleRowCount)
+            model.setSample(sample)
+            self.sampleView.setModel(model)
 
         # Open persistent editor on last line (column format)
         for column in xrange(0, model.columnCount()):
@@ -542,16 +1179,40 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
                 vheader.moveSection(position, row)
         # Move column format line at first
         vheader.moveSection(model.rowCount()-1, 0)
+        # Scroll range is only known once the view is laid out
+        QtCore.QTimer.singleShot(
+            0, functools.partial(self.restoreSampleScroll, position))
+
+    def restoreSampleScroll(self, position):
+        self.sampleView.horizontalScrollBar().setValue(position)
+        # View may also have been scrolled while reading
+        self.onSampleScrolled()
 
 
     def validate(self):
         try:
-            if self.dataSource is None:
+            if self.interrupted - set(['sample']):
+                # Do not write a layer from partially loaded data
+                self.refresh()
+                raise ValueError(self.tr("Loading was stopped, please wait"
+                                         " for the end of file loading"))
+
+            if self.driverName is None:
                 raise ValueError(self.tr("Please select an input file"))
 
-            if self.layer is None:
+            if self.sheet() == '':
                 raise ValueError(self.tr("Please select a sheet"))
 
+            if self.isLoading():
+                raise ValueError(self.tr("Please wait for the end of file loading"))
+
+            if self.filterError is not None:
+                raise ValueError(self.tr(u"Invalid filter: {}")
+                                 .format(self.filterError))
+
+            if self.union() and self.layerName() == '':
+                raise ValueError(self.tr("Please enter a layer name"))
+
             if self.xField == '':
                 raise ValueError(self.tr("Please select an x field"))
 
@@ -567,191 +1228,105 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
     def vrtPath(self):
         return u'{}.vrt'.format(self.filePath())
 
-    def samplePath(self):
-        filename = u'{}.tmp.vrt'.format(os.path.basename(self.filePath()))
-        return os.path.join(gettempdir(), filename)
+    def materializedPath(self):
+        return materializedPath(self.vrtPath(), self.materializeFormat())
 
     def readVrt(self):
-        if self.dataSource is None:
+        """Restore options from the existing VRT file, if any.
+
+        Options are set in one batch, without refreshing anything, the
+        caller refreshes once. Fields types and exclusions are applied when
+        fields are read, see onFieldsRead().
+        """
+        if self.driverName is None:
             return False
 
         vrtPath = self.vrtPath()
         if not os.path.exists(vrtPath):
             return False
 
-        file = QtCore.QFile(vrtPath)
-        if not file.open(QtCore.QIODevice.ReadOnly | QtCore. QIODevice.Text):
-            self.warning("Impossible to open VRT file {}".format(vrtPath))
-            return False
-
-        self.geometryBox.setChecked(False)
-
         try:
-            self.readVrtStream(file)
-        except Exception:
+            with self.profiledStage('readVrt'):
+                spec = readVrtConfig(vrtPath)
+        except (VrtConfigError, OSError):
             self.warning("An error occurs during existing VRT file loading")
             return False
 
-        finally:
-            file.close()
+        self.setMaterialize(False)
+        for driverName in supportedFormats():
+            if os.path.exists(materializedPath(vrtPath, driverName)):
+                self.setMaterializeFormat(driverName)
+                self.setMaterialize(True)
+                break
 
+        self.applyLayerSpec(spec)
         # self.info("Existing VRT file has been loaded")
         return True
 
-    def readVrtStream(self, file):
-        stream = QtCore.QXmlStreamReader(file)
-
-        stream.readNextStartElement()
-        if stream.name() == "OGRVRTDataSource":
-
-            stream.readNextStartElement()
-            if stream.name() == "OGRVRTLayer":
-                self.setLayerName(stream.attributes().value("name"))
-
-                while stream.readNext() != QtCore.QXmlStreamReader.EndDocument:
-                    if stream.isComment():
-                        text = stream.text()
-                        pattern = re.compile(r"Header=(\w+)")
-                        match = pattern.search(text)
-                        if match:
-                            self.setHeader(eval(match.group(1)))
-
-                    if stream.isStartElement():
-                        if stream.name() == "SrcDataSource":
-                            # do nothing : datasource should be already set
-                            pass
-
-                        elif stream.name() == "SrcLayer":
-                            text = stream.readElementText()
-                            self.setSheet(text)
-                            self.setOffset(0)
-
-                        elif stream.name() == "SrcSql":
-                            text = stream.readElementText()
-
-                            pattern = re.compile(r"FROM '(.+)'")
-                            match = pattern.search(text)
-                            if match:
-                                self.setSheet(match.group(1))
-
-                            pattern = re.compile(r'OFFSET (\d+)')
-                            match = pattern.search(text)
-                            if match:
-                                self.setOffset(int(match.group(1)))
-
-                        elif stream.name() == "GeometryType":
-                            self.geometryBox.setChecked(True)
-
-                        elif stream.name() == "LayerSRS":
-                            text = stream.readElementText()
-                            self.setCrs(text)
-
-                        elif stream.name() == "GeometryField":
-                            self.setXField(stream.attributes().value("x"))
-                            self.setYField(stream.attributes().value("y"))
-
-                        if not stream.isEndElement():
-                            stream.skipCurrentElement()
-
-            stream.skipCurrentElement()
-
-        stream.skipCurrentElement()
-
-    def updateFields(self):
-        if self.layer is None:
-            self.fields = []
-            return
-
-        # Select header line
-        if self.header() or self.offset() >= 1:
-            self.layer.SetNextByIndex(self.offset() - 1)
-            feature = self.layer.GetNextFeature()
-
-        fields = []
-        layerDefn = self.layer.GetLayerDefn()
-        for iField in xrange(0, layerDefn.GetFieldCount()):
-            fieldDefn = layerDefn.GetFieldDefn(iField)
-            src = fieldDefn.GetNameRef().decode('UTF-8')
-            name = src
-            if self.header() or self.offset() >= 1:
-                name = feature.GetFieldAsString(iField).decode('UTF-8') or name
-            fields.append({'src': src,
-                           'name': name,
-                           'type': fieldDefn.GetType()
-                           })
-        self.fields = fields
+    def applyLayerSpec(self, spec):
+        """Set options from spec with refresh signals blocked."""
+        optionWidgets = [self.sheetBox,
+                         self.headerBox,
+                         self.linesToIgnoreBox,
+                         self.eofDetectionBox,
+                         self.filterEdit]
+        for widget in optionWidgets:
+            widget.blockSignals(True)
+        try:
+            self.setLayerName(spec.layerName)
+            if spec.sheet is not None:
+                self.setSheet(spec.sheet)
+            self.setHeader(spec.header)
+            self.setLinesToIgnore(spec.linesToIgnore)
+            if spec.eofDetection is not None:
+                self.setEofDetection(spec.eofDetection)
+            self.setFilter(spec.filter or u'')
+        finally:
+            for widget in optionWidgets:
+                widget.blockSignals(False)
+
+        self.geometryBox.setChecked(spec.geometry())
+        if spec.geometry():
+            self.setXField(spec.xField)
+            self.setYField(spec.yField)
+        if spec.crs:
+            self.setCrs(spec.crs)
+        self.showGeometryFieldsBox.setChecked(spec.showGeometryFields)
+        self.pendingFields = spec.fields
+
+    def layerSpec(self):
+        xField = yField = None
+        if self.geometry():
+            xField = self.xField()
+            yField = self.yField()
+        return SpreadsheetLayerSpec(self.filePath(),
+                                    sheet=self.sheet(),
+                                    layerName=self.layerName(),
+                                    header=self.header(),
+                                    linesToIgnore=self.linesToIgnore(),
+                                    eofDetection=self.eofDetection(),
+                                    xField=xField,
+                                    yField=yField,
+                                    crs=self.crs(),
+                                    showGeometryFields=self.showGeometryFields(),
+                                    fields=self.fields,
+                                    filter=self.filter(),
+                                    csvOptions=self.csvOptions)
+
+    def layerBuilder(self):
+        spec = self.layerSpec()
+        if self.filterError is not None:
+            # Show unfiltered sample rather than nothing
+            spec.filter = None
+        return SpreadsheetLayerBuilder(spec,
+                                       self.featureCount(),
+                                       self._non_empty_rows)
 
     def prepareVrt(self, sample=False, without_fields=False):
-        buffer = QtCore.QBuffer()
-        buffer.open(QtCore.QBuffer.ReadWrite)
-
-        stream = QtCore.QXmlStreamWriter(buffer)
-        stream.setAutoFormatting(True)
-        stream.writeStartDocument()
-        stream.writeStartElement("OGRVRTDataSource")
-
-        stream.writeStartElement("OGRVRTLayer")
-        stream.writeAttribute("name", self.layerName())
-
-        stream.writeStartElement("SrcDataSource")
-        if sample:
-            stream.writeCharacters(self.filePath())
-        else:
-            stream.writeAttribute("relativeToVRT", "1")
-            stream.writeCharacters(os.path.basename(self.filePath()))
-        stream.writeEndElement()
-
-        stream.writeComment('Header={}'.format(self.header()))
-
-        if (self.offset() > 0
-            or self._non_empty_rows != self.layer.GetFeatureCount()
-        ):
-            stream.writeStartElement("SrcSql")
-            stream.writeAttribute("dialect", "sqlite")
-            stream.writeCharacters(self.sql())
-            stream.writeEndElement()
-        else:
-            stream.writeStartElement("SrcLayer")
-            stream.writeCharacters(self.sheet())
-            stream.writeEndElement()
-
-        if not without_fields:
-            for field in self.fields:
-                if (self.geometry() and not sample):
-                    if field['src'] in (self.xField(), self.yField()):
-                        if not self.showGeometryFields():
-                            continue
-                stream.writeStartElement("Field")
-                stream.writeAttribute("name", field['name'])
-                stream.writeAttribute("src", field['src'])
-                stream.writeAttribute("type", ogr.GetFieldTypeName(field['type']))
-                stream.writeEndElement()
-
-        if (self.geometry() and not sample):
-            stream.writeStartElement("GeometryType")
-            stream.writeCharacters("wkbPoint")
-            stream.writeEndElement()
-
-            if self.crs():
-                stream.writeStartElement("LayerSRS")
-                stream.writeCharacters(self.crs())
-                stream.writeEndElement()
-
-            stream.writeStartElement("GeometryField")
-            stream.writeAttribute("encoding", "PointFromColumns")
-            stream.writeAttribute("x", self.xField())
-            stream.writeAttribute("y", self.yField())
-            stream.writeEndElement()
-
-        stream.writeEndElement()  # OGRVRTLayer
-        stream.writeEndElement()  # OGRVRTDataSource
-        stream.writeEndDocument()
-
-        buffer.reset()
-        content = buffer.readAll()
-        buffer.close
-
-        return content
+        with self.profiledStage('prepareVrt'):
+            builder = self.layerBuilder()
+            content = builder.vrt(sample, without_fields)
+        return QtCore.QByteArray(content)
 
     def writeVrt(self):
         content = self.prepareVrt()
@@ -783,32 +1358,101 @@ class SpreadsheetLayersDialog(QtGui.QDialog, Ui_SpreadsheetLayersDialog):
         file.close()
         return True
 
-    def writeSampleVrt(self, without_fields=False):
-        content = self.prepareVrt(sample=True,
-                                  without_fields=without_fields)
-
-        vrtPath = self.samplePath()
-        file = QtCore.QFile(vrtPath)
-        if file.exists():
-            QtCore.QFile.remove(vrtPath)
-
-        if not file.open(QtCore.QIODevice.ReadWrite | QtCore. QIODevice.Text):
-            self.warning("Impossible to open VRT file {}".format(vrtPath))
-            return False
-
-        file.write(content)
-        file.close()
-        return True
-
     def accept(self, *args, **kwargs):
         if not self.validate():
             return False
 
+        if self.materialize():
+            QtCore.QSettings().setValue(self.pluginKey + "/materializeFormat",
+                                        self.materializeFormat())
+
+        if self.bulk():
+            specs = self.bulkSpecs()
+            existing = self.existingBulkVrtPaths(specs)
+            if existing and not self.confirmOverwrite(existing):
+                return False
+            # Dialog is accepted once all VRT files are written
+            requestId = self.newRequest()
+            self.showProgress(True)
+            self.writeVrtsRequested.emit(requestId,
+                                         specs,
+                                         self.allSheets(),
+                                         self.materializeFormat(),
+                                         self.unionOptions())
+            return True
+
         if not self.writeVrt():
             return False
 
+        if self.materialize():
+            # Dialog is accepted once converted file is written, stop
+            # button cancels conversion and keeps dialog opened
+            requestId = self.newRequest()
+            self.showProgress(True)
+            self.materializeRequested.emit(requestId,
+                                           self.vrtPath(),
+                                           self.materializedPath())
+            return True
+
         return super(SpreadsheetLayersDialog, self).accept(*args, **kwargs)
 
+    @QtCore.pyqtSlot(int, object)
+    def onMaterialized(self, requestId, outPath):
+        if requestId != self.requestId:
+            return
+        self.showProgress(False)
+        super(SpreadsheetLayersDialog, self).accept()
+
+    @QtCore.pyqtSlot(int, object)
+    def onVrtsWritten(self, requestId, results):
+        if requestId != self.requestId:
+            return
+        self.showProgress(False)
+        self.bulkResults = results
+        if all(error is not None for spec, vrtPath, error in results):
+            for spec, vrtPath, error in results:
+                self.warning(error)
+            return
+        super(SpreadsheetLayersDialog, self).accept()
+
+    def bulkErrors(self):
+        return [u'{}: {}'.format(spec.filePath, error)
+                for spec, vrtPath, error in self.bulkResults
+                if error is not None]
+
+    def layerSources(self):
+        """Return (uri, layerName, vrtPath, encoding) of layers to load.
+
+        vrtPath is only set for materialized layers, encoding is the one of
+        CSV files, UTF-8 otherwise.
+        """
+        if self.bulk():
+            layers = [(vrtPath, spec.layerName, spec.csvOptions)
+                      for spec, vrtPath, error in self.bulkResults
+                      if error is None]
+        else:
+            layers = [(self.vrtPath(), self.layerName(), self.csvOptions)]
+
+        sources = []
+        for vrtPath, layerName, csvOptions in layers:
+            encoding = 'UTF-8'
+            if csvOptions is not None:
+                encoding = csvOptions['encoding']
+            if self.materialize():
+                sources.append((u'{}|layername={}'.format(
+                    materializedPath(vrtPath, self.materializeFormat()),
+                    layerName),
+                    layerName,
+                    vrtPath,
+                    encoding))
+            else:
+                sources.append((vrtPath, layerName, None, encoding))
+        return sources
+
+    def done(self, result):
+        self.stopWorker()
+        super(SpreadsheetLayersDialog, self).done(result)
+
     @QtCore.pyqtSlot()
     def on_helpButton_clicked(self):
         html_path = os.path.join(os.path.dirname(__file__),